@@ -0,0 +1,278 @@
+"""Benchmarks for the heat conduction engine of heat_conduction.py.
+
+Run as a script, e.g.
+
+    python bench_heat.py step --shapes 21x101 101x501 201x1001 --steps 50
+    python bench_heat.py implicit --shapes 41x201 81x401 --time 600 --dts 1 10 60 150
+    python bench_heat.py export --steps 400 --frame-every 1 10 50
+    python bench_heat.py check
+
+step times one RK4 step of the original heat_transfer.py update (a Cartesian
+laplacian from np.roll, which wraps the grid around periodically) against
+HeatConduction.step in the Cartesian and axisymmetric geometries. implicit
+runs the cylinder of heat_transfer.py with Crank-Nicolson and ADI steps of
+--dts seconds up to --time and prints their error against RK4 at its
+stability limit, and then marches every method to the steady state (the RK4
+time there is estimated from its time per step). export times the original
+GIF export of heat_transfer.py, which drew a frame for every solver step
+(and ran the solver again for the window), against one simulate() run whose
+decimated frames are streamed by export() (to os.devnull, no ffmpeg needed).
+check compares the engine with exact results: laplacians of quadratics,
+which the scheme reproduces exactly, and the decay of a sine mode and (with
+scipy) of the Bessel mode of a cylinder, for every method; it exits with an
+error if they disagree."""
+
+import argparse
+import os
+import time
+import numpy as np
+from heat_conduction import HeatConduction, Dirichlet, Neumann
+from convergence import ConvergenceMonitor
+
+
+def roll_step(T, alpha, dx, dt, T_center):
+    """update_temperature() of the original heat_transfer.py."""
+    nx = T.shape[0]
+    T_new = T.copy()
+
+    def dTdt(T):
+        d2T_dx2 = (np.roll(T, -1, axis=0) - 2 * T + np.roll(T, 1, axis=0)) / dx**2
+        d2T_dy2 = (np.roll(T, -1, axis=1) - 2 * T + np.roll(T, 1, axis=1)) / dx**2
+        return alpha * (d2T_dx2 + d2T_dy2)
+
+    k1 = dTdt(T)
+    k2 = dTdt(T + 0.5 * dt * k1)
+    k3 = dTdt(T + 0.5 * dt * k2)
+    k4 = dTdt(T + dt * k3)
+    T_new = T_new + (dt / 6) * (k1 + 2*k2 + 2*k3 + k4)
+    T_new[int(nx / 2), :] = T_center
+    return T_new
+
+
+def cylinder(shape, geometry="axisymmetric", method="rk4", theta=0.5):
+    """The steel cylinder of heat_transfer.py on a grid of the given shape."""
+    T = np.full(shape, 25.0)
+    center = np.zeros(shape, dtype=bool)
+    center[0 if geometry == "axisymmetric" else shape[0]//2] = True
+    T[center] = 1000.0
+    spacing = (0.10/(shape[0] - 1), 0.50/(shape[1] - 1))
+    first = None if geometry == "axisymmetric" else Neumann(0)
+    return HeatConduction(T, spacing, 1.172e-5, geometry, boundaries=[(first, Neumann(0)),
+                          (Dirichlet(25.0), Dirichlet(25.0))], fixed=center,
+                          method=method, theta=theta)
+
+
+def rk4_dt(solver):
+    """A stable RK4 step: the method is stable for dt*eigenvalue down to
+    -2.78 and Gershgorin bounds the eigenvalues of rate() by twice its
+    largest diagonal coefficient."""
+    return 2.78/(2*np.abs(sum(coefs[1] for coefs in solver.coefficients)).max())
+
+
+def march(solver, dt, tolerance=1e-5, check_interval=1, max_steps=100000):
+    """Step until |dT/dt| is below tolerance degrees per second; returns the
+    convergence monitor."""
+    monitor = ConvergenceMonitor(tolerance, check_interval)
+    solver.run(max_steps, dt, max_steps, monitor)
+    return monitor
+
+
+def steady_state(solver):
+    """The steady temperature of solver, from a sparse solve of rate(T) = 0
+    on the free cells."""
+    from scipy import sparse
+    from scipy.sparse.linalg import spsolve
+    fixed = solver.fixed.ravel()
+    matrix = (solver.matrix() + sparse.diags(fixed.astype(float))).tocsc()
+    return spsolve(matrix, fixed*solver.T.ravel() - solver.source.ravel()).reshape(solver.shape)
+
+
+def bench_step(shapes, n_steps):
+    for shape in shapes:
+        dx, dt = 0.10/(shape[0] - 1), 0.1
+        T = np.full(shape, 25.0)
+        T[shape[0]//2] = 1000.0
+        t_0 = time.perf_counter()
+        for _ in range(n_steps):
+            T = roll_step(T, 1.172e-5, dx, dt, 1000.0)
+        base = (time.perf_counter() - t_0)/n_steps
+        line = "{:>5} x {:<5}  np.roll: {:9.1f} us/step".format(*shape, 1e6*base)
+        for geometry in ("cartesian", "axisymmetric"):
+            solver = cylinder(shape, geometry)
+            t_0 = time.perf_counter()
+            for _ in range(n_steps):
+                solver.step(dt)
+            seconds = (time.perf_counter() - t_0)/n_steps
+            line += "  {}: {:9.1f} us/step ({:.2f}x)".format(geometry, 1e6*seconds, base/seconds)
+        print(line)
+
+
+def bench_implicit(shapes, end_time, dts, steady_dt, euler_dt):
+    for shape in shapes:
+        reference = cylinder(shape)
+        dt = rk4_dt(reference)
+        n_steps = int(np.ceil(end_time/dt))
+        t_0 = time.perf_counter()
+        reference.run(n_steps, end_time/n_steps, n_steps)
+        rk4_step = (time.perf_counter() - t_0)/n_steps
+        print("{} x {}: RK4 at dt = {:.3f} s ({:.0f} us/step), {} steps to {:g} s in {:.2f} s".format(
+            *shape, end_time/n_steps, 1e6*rk4_step, n_steps, end_time, rk4_step*n_steps))
+        for method in ("crank-nicolson", "adi"):
+            for dt in dts:
+                solver = cylinder(shape, method=method)
+                t_0 = time.perf_counter()
+                solver.run(int(round(end_time/dt)), dt, 1)
+                seconds = time.perf_counter() - t_0
+                print("  {:>14} dt = {:6g} s: max error {:8.3f} C, {:.3f} s ({:.1f}x)".format(
+                    method, dt, np.abs(solver.T - reference.T).max(), seconds, rk4_step*n_steps/seconds))
+
+        steady = steady_state(reference)
+        for method, theta, dt in (("crank-nicolson", 0.5, steady_dt), ("adi", 0.5, steady_dt),
+                                  ("crank-nicolson", 1.0, euler_dt)):
+            solver = cylinder(shape, method=method, theta=theta)
+            t_0 = time.perf_counter()
+            steps = march(solver, dt).converged_at
+            seconds = time.perf_counter() - t_0
+            rk4_seconds = solver.t/reference.t*rk4_step*n_steps
+            print("  steady, {:>14} theta {:.1f} dt = {:g} s: {} steps to t = {:.0f} s, max error {:.4f} C, "
+                  "{:.2f} s (RK4 about {:.0f} s)".format(method, theta, dt, steps, solver.t,
+                                                         np.abs(solver.T - steady).max(), seconds, rk4_seconds))
+
+
+def bench_export(steps, frame_every):
+    import heat_transfer
+
+    # The original script: FuncAnimation advanced the solver in every frame it
+    # drew, once for ani.save() and once more for plt.show().
+    view, solver = heat_transfer.CylinderView(np.arange(steps)*heat_transfer.dt), heat_transfer.cylinder()
+    t_0 = time.perf_counter()
+    for num in range(steps):
+        solver.step(heat_transfer.dt)
+        view.render(num, solver.T)
+    draw_every_step = time.perf_counter() - t_0
+    t_0 = time.perf_counter()
+    heat_transfer.simulate(steps)
+    solve = time.perf_counter() - t_0
+    print("{} steps: solver {:.2f} s, solver and a frame per step {:.2f} s (twice with the window: {:.2f} s)".format(
+        steps, solve, draw_every_step, 2*draw_every_step))
+    for every in frame_every:
+        t_0 = time.perf_counter()
+        times, frames = heat_transfer.simulate(steps, every)
+        n_frames = heat_transfer.export(times, frames, "heat_transfer.gif", raw=os.devnull)
+        seconds = time.perf_counter() - t_0
+        print("  frame every {:3d} steps: {:4d} frames, {:.2f} s ({:.1f}x)".format(
+            every, n_frames, seconds, draw_every_step/seconds))
+
+
+def check():
+    # Quadratics: exact laplacians, including the Neumann faces and the axis.
+    h = (0.1, 0.2, 0.25)
+    x, y, z = (np.arange(n)*d for n, d in zip((21, 17, 9), h))
+    X, Y = np.meshgrid(x, y, indexing="ij")
+    solver = HeatConduction(X**2 + 3*Y**2, h[:2], 1.0, boundaries=[(Neumann(0), Neumann(2*x[-1])),
+                                                                    (Neumann(0), Neumann(6*y[-1]))])
+    np.testing.assert_allclose(solver.laplacian(solver.T), 8, atol=1e-9)
+    X3, Y3, Z3 = np.meshgrid(x, y, z, indexing="ij")
+    solver = HeatConduction(X3**2 - Z3**2 + Y3, h, 1.0, boundaries=[(Neumann(0), Neumann(2*x[-1])),
+                            (Neumann(-1), Neumann(1)), (Neumann(0), Neumann(-2*z[-1]))])
+    np.testing.assert_allclose(solver.laplacian(solver.T), 0, atol=1e-9)
+    solver = HeatConduction(X**2 + Y**2, h[:2], 1.0, "axisymmetric",
+                            boundaries=[(None, Neumann(2*x[-1])), (Neumann(0), Neumann(2*y[-1]))])
+    np.testing.assert_allclose(solver.laplacian(solver.T), 6, atol=1e-9)
+    print("laplacian of quadratics (cartesian 2D, 3D, axisymmetric) ok")
+
+    # The tridiagonal coefficients of the implicit methods are rate()
+    rng = np.random.default_rng(0)
+    T = rng.uniform(0, 100, (21, 17))
+    for solver in (cylinder(T.shape), HeatConduction(T, h[:2], 0.5, boundaries=[
+            (Neumann(-1), Dirichlet(20)), (Neumann(rng.uniform(size=21)), Neumann(3))])):
+        applied = sum(solver._apply(axis, T, np.empty(T.shape)) for axis in range(2))
+        np.testing.assert_allclose(applied + solver.source, solver.rate(T), atol=1e-9)
+    print("tridiagonal coefficients ok")
+
+    # Decay of sin(pi x) between two faces at zero, the implicit methods with 50x larger steps
+    x = np.linspace(0, 1, 101)
+    for method, dt in (("rk4", 2e-4), ("crank-nicolson", 1e-2), ("adi", 1e-2)):
+        solver = HeatConduction(np.sin(np.pi*x)[:, None]*np.ones(5), (x[1], 0.1), 0.1,
+                                boundaries=[(Dirichlet(0), Dirichlet(0))], method=method)
+        times, samples = solver.run(int(round(1/dt)), dt, int(round(0.2/dt)))
+        exact = np.exp(-0.1*np.pi**2*times)[:, None, None]*np.sin(np.pi*x)[None, :, None]
+        error = np.abs(samples - exact).max()
+        if error > 1e-4:
+            raise SystemExit("sine mode decays with an error of {:.3g} ({})".format(error, method))
+        print("sine mode decay, {} dt = {:g}: max error {:.1e} ok".format(method, dt, error))
+
+    # Early stop once |dT/dt| < 0.05, checked every 10 steps: max |dT/dt| = 0.1 pi^2 exp(-0.1 pi^2 t)
+    solver = HeatConduction(np.sin(np.pi*x)[:, None]*np.ones(5), (x[1], 0.1), 0.1,
+                            boundaries=[(Dirichlet(0), Dirichlet(0))])
+    monitor = ConvergenceMonitor(0.05, check_interval=10)
+    times, samples = solver.run(100000, 2e-4, 1000, monitor)
+    expected = np.log(0.1*np.pi**2/0.05)/(0.1*np.pi**2)
+    if not (monitor.converged and abs(solver.t - expected) < 10*2e-4 and times[-1] == solver.t
+            and monitor.converged_at % 10 == 0 and np.array_equal(samples[-1], solver.T)):
+        raise SystemExit("early stop at t = {:.4f} ({}), expected {:.4f}".format(
+            solver.t, monitor.report(), expected))
+    print("early stop at the steady state tolerance, {} ok".format(monitor.report()))
+
+    try:
+        from scipy.special import j0, jn_zeros
+    except ImportError:
+        print("scipy not installed, Bessel mode not checked")
+        return
+    r = np.linspace(0, 1, 81)
+    k = jn_zeros(0, 1)[0]
+    for method, dt in (("rk4", 5e-4), ("crank-nicolson", 1e-2), ("adi", 1e-2)):
+        solver = HeatConduction(j0(k*r)[:, None]*np.ones(4), (r[1], 0.1), 0.1, "axisymmetric",
+                                boundaries=[(None, Dirichlet(0))], method=method)
+        times, samples = solver.run(int(round(1/dt)), dt, int(round(0.25/dt)))
+        exact = np.exp(-0.1*k**2*times)[:, None, None]*j0(k*r)[None, :, None]
+        error = np.abs(samples - exact).max()
+        if error > 1e-3:
+            raise SystemExit("Bessel mode decays with an error of {:.3g} ({})".format(error, method))
+        print("Bessel mode decay, {} dt = {:g}: max error {:.1e} ok".format(method, dt, error))
+
+    # Fully implicit steps of 10^4 s reach the steady state of the cylinder
+    solver = cylinder((21, 101), method="crank-nicolson", theta=1.0)
+    steps = march(solver, 1e4).converged_at
+    error = np.abs(solver.T - steady_state(solver)).max()
+    if error > 0.05:
+        raise SystemExit("the cylinder is {:.3g} C from its steady state".format(error))
+    print("cylinder steady state in {} steps: max error {:.1e} C ok".format(steps, error))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    step = sub.add_parser("step", help="time per step of np.roll RK4 against the engine")
+    step.add_argument("--shapes", nargs="+", default=[(21, 101), (101, 501), (201, 1001)],
+                      type=lambda s: tuple(int(n) for n in s.split("x")))
+    step.add_argument("--steps", type=int, default=50)
+
+    implicit = sub.add_parser("implicit", help="accuracy and time of Crank-Nicolson and ADI against RK4")
+    implicit.add_argument("--shapes", nargs="+", default=[(41, 201), (81, 401)],
+                          type=lambda s: tuple(int(n) for n in s.split("x")))
+    implicit.add_argument("--time", type=float, default=600.0, help="simulated seconds for the errors")
+    implicit.add_argument("--dts", type=float, nargs="+", default=[1.0, 10.0, 60.0, 150.0])
+    implicit.add_argument("--steady-dt", type=float, default=50.0, help="step to the steady state, theta 0.5")
+    implicit.add_argument("--euler-dt", type=float, default=1e4, help="step to the steady state, theta 1")
+
+    export = sub.add_parser("export", help="frame per step export against simulate-once and stream")
+    export.add_argument("--steps", type=int, default=400)
+    export.add_argument("--frame-every", type=int, nargs="+", default=[1, 10, 50])
+
+    sub.add_parser("check", help="compare the engine with exact solutions")
+
+    args = parser.parse_args()
+    if args.bench == "step":
+        bench_step(args.shapes, args.steps)
+    elif args.bench == "implicit":
+        bench_implicit(args.shapes, args.time, args.dts, args.steady_dt, args.euler_dt)
+    elif args.bench == "export":
+        bench_export(args.steps, args.frame_every)
+    elif args.bench == "check":
+        check()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""Benchmarks for the steady-state solvers of heat_transfer_box.py.
+
+Run as a script, e.g.
+
+    python bench_heat_box.py relax --resolutions 4 8 13 26 52 --loop-max 8 --check-interval 10
+    python bench_heat_box.py multigrid --resolutions 13 26 52 100 200 --jacobi-max 26
+    python bench_heat_box.py direct --resolutions 13 26 52 100 --variants 20
+    python bench_heat_box.py check
+
+relax prints the number of sweeps and the wall time to convergence (the
+default threshold of heat_transfer_box) of every method for each resolution,
+including the original per-cell Python loop for resolutions up to
+--loop-max; --check-interval sums the temperature change only every that
+many sweeps. multigrid prints the reduction of the residual in every
+V-cycle, the set up and solve times of the multigrid solver and, up to
+--jacobi-max, the sweeps and time Jacobi relaxation needs for the same
+threshold. direct times the sparse LU factorization of DirectSolver once and
+then the solve of --variants meshes with different boundary and insert
+temperatures, one by one and as a single stack, against multigrid solving
+every variant from scratch. check solves a small mesh to a tight threshold
+with the per-cell loop and every method and exits with an error if the
+solutions differ."""
+
+import argparse
+import time
+import numpy as np
+import heat_transfer_box as box
+from convergence import ConvergenceMonitor
+
+METHODS = ["jacobi", "gauss-seidel", "sor", "multigrid", "direct"]
+
+
+def loop_solve(mesh, mask, threshold=box.threshold, max_iter=1000000):
+    """The original solver: in-place sweeps over every cell with a Python
+    loop and laplace_eq()."""
+    for iteration in range(1, max_iter + 1):
+        temp_diff = 0
+        for i, j in np.ndindex(mesh.shape):
+            if mask[i, j]:
+                new_val = box.laplace_eq(mesh, i, j)
+                temp_diff += abs(new_val - mesh[i, j])
+                mesh[i, j] = new_val
+        if temp_diff < threshold:
+            return mesh, iteration
+    raise RuntimeError("No convergence after {} iterations".format(max_iter))
+
+
+def timed_solve(method, resolution, threshold, check_interval=1):
+    mesh, mask = box.create_mesh(resolution, box.init_temp)
+    t_0 = time.perf_counter()
+    if method == "loop":
+        mesh, iterations = loop_solve(mesh, mask, threshold)
+    else:
+        mesh, iterations = box.solve(mesh, mask, method, monitor=ConvergenceMonitor(threshold, check_interval))
+    return mesh, iterations, time.perf_counter() - t_0
+
+
+def bench_relax(resolutions, methods, loop_max, threshold, check_interval):
+    for resolution in resolutions:
+        mesh, _ = box.create_mesh(resolution, box.init_temp)
+        print("resolution {} ({} x {} cells)".format(resolution, *mesh.shape))
+        base = None
+        for method in (["loop"] if resolution <= loop_max else []) + methods:
+            _, iterations, seconds = timed_solve(method, resolution, threshold,
+                                                 1 if method == "loop" else check_interval)
+            base = base or seconds
+            print("  {:>13}: {:7d} sweeps {:9.3f} s  {:8.1f} us/sweep  ({:.1f}x)".format(
+                method, iterations, seconds, 1e6*seconds/iterations, base/seconds))
+
+
+def bench_multigrid(resolutions, jacobi_max, threshold, cycles):
+    for resolution in resolutions:
+        mesh, mask = box.create_mesh(resolution, box.init_temp)
+        t_0 = time.perf_counter()
+        solver = box.Multigrid(mask)
+        setup = time.perf_counter() - t_0
+        print("resolution {} ({} x {} cells, {} grids, finest {} x {})".format(
+            resolution, *mesh.shape, len(solver.levels), *solver.free.shape))
+        residuals = []
+        t_0 = time.perf_counter()
+        for temp_diff in solver.cycles(mesh):
+            residuals.append(temp_diff)
+            if temp_diff < threshold and len(residuals) >= cycles:
+                break
+        seconds = time.perf_counter() - t_0
+        factors = np.array(residuals[1:])/np.array(residuals[:-1])
+        converged = next(n for n, r in enumerate(residuals, 1) if r < threshold)
+        print("  multigrid: {} cycles to the threshold, {:.3f} s set up + {:.3f} s/cycle".format(
+            converged, setup, seconds/len(residuals)))
+        print("  residual reduction per cycle: " + " ".join("{:.3f}".format(f) for f in factors))
+        if resolution <= jacobi_max:
+            _, iterations, seconds = timed_solve("jacobi", resolution, threshold)
+            _, _, mg_seconds = timed_solve("multigrid", resolution, threshold)
+            print("  jacobi: {} sweeps {:.3f} s, multigrid {:.3f} s ({:.0f}x)".format(
+                iterations, seconds, mg_seconds, seconds/mg_seconds))
+
+
+def variants(resolution, n_variants):
+    """n_variants meshes with different boundary and insert temperatures."""
+    rng = np.random.default_rng(0)
+    return [box.create_mesh(resolution, rng.uniform(50, 150), top_temp=rng.uniform(80, 120),
+                            bottom_temp=rng.uniform(20, 40), side_temp=rng.uniform(20, 40),
+                            insert_temp=rng.uniform(150, 300))[0] for _ in range(n_variants)]
+
+
+def bench_direct(resolutions, n_variants, threshold):
+    box.DirectSolver(box.create_mesh(1, box.init_temp)[1])     # Import scipy outside the timings
+    for resolution in resolutions:
+        meshes = variants(resolution, n_variants)
+        _, mask = box.create_mesh(resolution, box.init_temp)
+        t_0 = time.perf_counter()
+        solver = box.DirectSolver(mask)
+        factorize = time.perf_counter() - t_0
+        t_0 = time.perf_counter()
+        for mesh in meshes:
+            solver.solve(mesh.copy())
+        one_by_one = (time.perf_counter() - t_0)/n_variants
+        stack = np.stack(meshes)
+        t_0 = time.perf_counter()
+        solver.solve(stack)
+        stacked = (time.perf_counter() - t_0)/n_variants
+        t_0 = time.perf_counter()
+        for mesh in meshes:
+            box.solve(mesh, mask, "multigrid", threshold=threshold)
+        multigrid = (time.perf_counter() - t_0)/n_variants
+        total = factorize + n_variants*stacked
+        print("resolution {} ({} unknowns): factorize {:.3f} s, solve {:.4f} s/variant ({:.4f} stacked), "
+              "multigrid {:.3f} s/variant; {} variants {:.2f} s against {:.2f} s ({:.1f}x)".format(
+                  resolution, solver.n_free, factorize, one_by_one, stacked, multigrid,
+                  n_variants, total, n_variants*multigrid, n_variants*multigrid/total))
+
+
+def check():
+    for resolution in (3, 4):       # Odd and even number of rows
+        reference, _, _ = timed_solve("loop", resolution, 1e-9)
+        for method in METHODS:
+            mesh, iterations, _ = timed_solve(method, resolution, 1e-9)
+            error = np.abs(mesh - reference).max()
+            if error > 1e-6:
+                raise SystemExit("{} at resolution {} differs from the loop by {:.3g}".format(
+                    method, resolution, error))
+            print("resolution {} {:>13}: {:6d} sweeps, max difference {:.1e} ok".format(
+                resolution, method, iterations, error))
+
+        # Checking every 10th sweep stops at the first check past the sweep of every-sweep checks
+        for method in ("jacobi", "sor"):
+            _, every, _ = timed_solve(method, resolution, 1e-9)
+            _, tenth, _ = timed_solve(method, resolution, 1e-9, 10)
+            if tenth != -(-every//10)*10:
+                raise SystemExit("{} stops at sweep {} checking every 10th, not {}".format(
+                    method, tenth, -(-every//10)*10))
+        print("resolution {} check interval ok".format(resolution))
+
+        # The first Jacobi sweep is the same as one sweep of laplace_eq on the old mesh.
+        mesh, mask = box.create_mesh(resolution, box.init_temp)
+        expected = mesh.copy()
+        for i, j in np.ndindex(mesh.shape):
+            if mask[i, j]:
+                expected[i, j] = box.laplace_eq(mesh, i, j)
+        next(box.relax(mesh, mask, "jacobi"))
+        np.testing.assert_allclose(mesh, expected, rtol=1e-14)
+        print("resolution {} first jacobi sweep ok".format(resolution))
+
+        # One factorization for boundary temperature variants, one by one or stacked
+        _, mask = box.create_mesh(resolution, box.init_temp)
+        solver = box.DirectSolver(mask)
+        meshes = variants(resolution, 3)
+        stack = solver.solve(np.stack(meshes))
+        for mesh, stacked in zip(meshes, stack):
+            reference, _ = loop_solve(mesh.copy(), mask, 1e-9)
+            np.testing.assert_allclose(solver.solve(mesh), reference, atol=1e-6)
+            np.testing.assert_allclose(stacked, reference, atol=1e-6)
+        print("resolution {} direct solver variants ok".format(resolution))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    relax = sub.add_parser("relax", help="sweeps and time to convergence across resolutions")
+    relax.add_argument("--resolutions", type=int, nargs="+", default=[4, 8, 13, 26])
+    relax.add_argument("--methods", nargs="+", choices=METHODS, default=METHODS)
+    relax.add_argument("--loop-max", type=int, default=8, help="largest resolution for the per-cell loop")
+    relax.add_argument("--threshold", type=float, default=box.threshold)
+    relax.add_argument("--check-interval", type=int, default=1, help="sweeps between convergence checks")
+
+    multigrid = sub.add_parser("multigrid", help="convergence rate and time of multigrid against Jacobi")
+    multigrid.add_argument("--resolutions", type=int, nargs="+", default=[13, 26, 52, 100])
+    multigrid.add_argument("--jacobi-max", type=int, default=26, help="largest resolution solved with Jacobi")
+    multigrid.add_argument("--threshold", type=float, default=box.threshold)
+    multigrid.add_argument("--cycles", type=int, default=6, help="V-cycles to run at least, for the rates")
+
+    direct = sub.add_parser("direct", help="sparse LU reused for boundary temperature variants")
+    direct.add_argument("--resolutions", type=int, nargs="+", default=[13, 26, 52, 100])
+    direct.add_argument("--variants", type=int, default=20)
+    direct.add_argument("--threshold", type=float, default=box.threshold)
+
+    sub.add_parser("check", help="compare the solutions of all methods with the per-cell loop")
+
+    args = parser.parse_args()
+    if args.bench == "relax":
+        bench_relax(args.resolutions, args.methods, args.loop_max, args.threshold, args.check_interval)
+    elif args.bench == "multigrid":
+        bench_multigrid(args.resolutions, args.jacobi_max, args.threshold, args.cycles)
+    elif args.bench == "direct":
+        bench_direct(args.resolutions, args.variants, args.threshold)
+    elif args.bench == "check":
+        check()
+
+
+if __name__ == "__main__":
+    main()
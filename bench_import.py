@@ -0,0 +1,131 @@
+"""Import time of the compute modules, measured with python -X importtime.
+
+Run as a script, e.g.
+
+    python bench_import.py times
+    python bench_import.py check
+    python bench_import.py check --budget-ms 100
+
+Every module is imported in a fresh interpreter (the fastest of a few runs
+counts). times prints the cumulative import time of each module and the
+packages that dominate it. check exits with an error if a compute module
+pulls in a plotting, compiler or GUI package (matplotlib, mpl_toolkits,
+numba, scipy, pygame). Import times are wall-clock and vary from run to run,
+so they only fail the check with --budget-ms, and then against the module's
+own time: its cumulative time minus that of the packages outside this
+repository it imports (numpy, multiprocessing, ...)."""
+
+import argparse
+import os
+import subprocess
+import sys
+
+MODULES = ["shallow_water", "shallow_water_ensemble", "shallow_water_parallel", "snapshot_store",
+           "phase_timer", "fourier_transform", "level_of_detail", "viz_tools1", "wave_and_velocity",
+           "heat_transfer_box", "heat_conduction", "convergence", "heat_transfer",
+           "guitar_strings_vibs"]
+FORBIDDEN = ("matplotlib", "mpl_toolkits", "numba", "scipy", "pygame")
+REPO_MODULES = {name[:-3] for name in os.listdir(os.path.dirname(os.path.abspath(__file__)))
+                if name.endswith(".py")}
+
+
+def import_times(module):
+    """Cumulative import time [ms] of every module imported by `import
+    module` in a fresh interpreter, keyed by module name. The "(own)" entry
+    is the time of module without the packages outside this repository
+    that it (or the repository modules it imports) imports."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                            capture_output=True, text=True, check=True)
+    times, entries = {}, []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1)//2
+        times[name.strip()] = int(cumulative)/1000
+        entries.append((depth, name.strip(), int(cumulative)/1000))
+
+    # Lines are printed children first, each parent after its subtree: walk
+    # back through the subtree of module, counting the external packages
+    # that no other external package encloses.
+    end = max(i for i, (depth, name, _) in enumerate(entries) if name == module)
+    external, enclosing = 0.0, []
+    for depth, name, cumulative in reversed(entries[:end]):
+        if depth <= entries[end][0]:
+            break
+        del enclosing[depth - entries[end][0] - 1:]
+        outside = name.split(".")[0] not in REPO_MODULES
+        if outside and not any(enclosing):
+            external += cumulative
+        enclosing.append(outside)
+    times["(own)"] = times[module] - external
+    return times
+
+
+def fastest(module, repeat):
+    """import_times() of the run in which module was imported fastest."""
+    runs = [import_times(module) for _ in range(repeat)]
+    return min(runs, key=lambda times: times[module])
+
+
+def top_level(times, n=3):
+    """The n most expensive top-level packages in times."""
+    packages = {}
+    for name, cumulative in times.items():
+        if name == "(own)":
+            continue
+        package = name.split(".")[0]
+        packages[package] = max(packages.get(package, 0.0), cumulative)
+    return sorted(packages.items(), key=lambda item: -item[1])[:n]
+
+
+def bench_times(modules, repeat):
+    baseline = fastest("numpy", repeat)["numpy"]
+    print("{:<24} {:8.1f} ms".format("numpy", baseline))
+    for module in modules:
+        times = fastest(module, repeat)
+        heaviest = ", ".join("{} {:.1f}".format(name, ms) for name, ms in top_level(times))
+        print("{:<24} {:8.1f} ms  ({})".format(module, times[module], heaviest))
+
+
+def check(modules, repeat, budget_ms=None):
+    failures = []
+    for module in modules:
+        times = fastest(module, repeat)
+        heavy = sorted({name.split(".")[0] for name in times if name.split(".")[0] in FORBIDDEN})
+        own = times["(own)"]
+        status = "ok"
+        if heavy:
+            status = "imports " + ", ".join(heavy)
+        elif budget_ms is not None and own > budget_ms:
+            status = "{:.1f} ms of its own exceeds the budget of {:.1f} ms".format(own, budget_ms)
+        if status != "ok":
+            failures.append(module)
+        print("{:<24} {:8.1f} ms ({:6.1f} ms own)  {}".format(module, times[module], own, status))
+    if failures:
+        sys.exit("Import check failed for " + ", ".join(failures))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    times = sub.add_parser("times", help="cumulative import time of every module")
+    times.add_argument("--modules", nargs="+", default=MODULES)
+    times.add_argument("--repeat", type=int, default=5)
+
+    check_parser = sub.add_parser("check", help="fail if a module imports plotting packages (or is slow)")
+    check_parser.add_argument("--modules", nargs="+", default=MODULES)
+    check_parser.add_argument("--repeat", type=int, default=5)
+    check_parser.add_argument("--budget-ms", type=float, default=None,
+                              help="also fail if a module's own import time exceeds this")
+
+    args = parser.parse_args()
+    if args.bench == "times":
+        bench_times(args.modules, args.repeat)
+    elif args.bench == "check":
+        check(args.modules, args.repeat, args.budget_ms)
+
+
+if __name__ == "__main__":
+    main()
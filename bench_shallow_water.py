@@ -0,0 +1,296 @@
+"""Benchmarks for the shallow water engine in shallow_water.py.
+
+Run as a script, e.g.
+
+    python bench_shallow_water.py steps --sizes 150 500 1000 2000
+    python bench_shallow_water.py parallel --workers 1 2 4 8
+    python bench_shallow_water.py ensemble --members 8 32
+    python bench_shallow_water.py adaptive --cfl 0.25 0.5
+    python bench_shallow_water.py precision --sizes 150 1000
+    python bench_shallow_water.py profile --output timings.jsonl
+    python bench_shallow_water.py check
+
+Every benchmark prints one line per measurement. The check command runs the
+backends against each other and exits with an error if they disagree."""
+
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from phase_timer import write_record
+from shallow_water import ShallowWaterConfig, ShallowWaterSolver
+from shallow_water_parallel import ParallelShallowWaterSolver
+from shallow_water_ensemble import ShallowWaterEnsemble
+
+
+def steps_per_second(config, n_steps, warmup=2, n_workers=None):
+    """Time n_steps steps of a solver built from config and return the
+    number of steps per second. Sampling is switched off so that only the
+    stepping is measured. With n_workers the parallel solver is used."""
+    config.anim_interval = config.sample_interval = n_steps + warmup + 1
+    if n_workers is None:
+        solver = ShallowWaterSolver(config)
+    else:
+        solver = ParallelShallowWaterSolver(config, n_workers=n_workers)
+    try:
+        solver.run(warmup)
+        t_0 = time.perf_counter()
+        solver.run(n_steps)
+        return n_steps/(time.perf_counter() - t_0)
+    finally:
+        if n_workers is not None:
+            solver.close()
+
+
+def bench_steps(sizes, backends, n_steps):
+    """Steps per second of each backend at several grid sizes."""
+    for N in sizes:
+        rates = {}
+        for backend in backends:
+            config = ShallowWaterConfig(N_x=N, N_y=N, backend=backend)
+            rates[backend] = steps_per_second(config, n_steps)
+        line = "N = {:5d}".format(N)
+        for backend, rate in rates.items():
+            line += "  {}: {:9.2f} steps/s".format(backend, rate)
+        if "reference" in rates:
+            for backend in backends:
+                if backend != "reference":
+                    line += "  {}/reference: {:.2f}x".format(backend, rates[backend]/rates["reference"])
+        print(line)
+
+
+def bench_parallel(size, workers, n_steps):
+    """Strong scaling (fixed N x N grid, relative to the serial numpy backend)
+    and weak scaling (N rows per worker, relative to the first worker count)
+    of the parallel solver."""
+    serial = steps_per_second(ShallowWaterConfig(N_x=size, N_y=size), n_steps)
+    print("strong  N = {:5d}  serial: {:8.2f} steps/s".format(size, serial))
+    for n_workers in workers:
+        rate = steps_per_second(ShallowWaterConfig(N_x=size, N_y=size), n_steps, n_workers=n_workers)
+        print("strong  N = {:5d}  workers: {:3d}  {:8.2f} steps/s  speedup: {:5.2f}  efficiency: {:4.2f}".format(
+            size, n_workers, rate, rate/serial, rate/serial/n_workers))
+    base = None
+    for n_workers in workers:
+        config = ShallowWaterConfig(N_x=size*n_workers, N_y=size)
+        rate = steps_per_second(config, n_steps, n_workers=n_workers)
+        base = base or rate
+        print("weak    {:5d} x {:5d}  workers: {:3d}  {:8.2f} steps/s  efficiency: {:4.2f}".format(
+            config.N_x, size, n_workers, rate, rate/base))
+
+
+def bench_ensemble(size, member_counts, n_steps):
+    """Member-steps per second of a depth sweep run as one stacked ensemble,
+    as separate solvers in one process and as one script execution per
+    member."""
+    for n_members in member_counts:
+        depths = np.linspace(50, 150, n_members)
+        config = ShallowWaterConfig(N_x=size, N_y=size, anim_interval=n_steps + 1, sample_interval=n_steps + 1)
+
+        t_0 = time.perf_counter()
+        ShallowWaterEnsemble(config, [dict(H=H) for H in depths]).run(n_steps)
+        ensemble = n_members*n_steps/(time.perf_counter() - t_0)
+
+        t_0 = time.perf_counter()
+        for H in depths:
+            config.H = H
+            ShallowWaterSolver(config).run(n_steps)
+        separate = n_members*n_steps/(time.perf_counter() - t_0)
+
+        t_0 = time.perf_counter()
+        for H in depths:
+            subprocess.run([sys.executable, "-c",
+                "from shallow_water import ShallowWaterConfig, ShallowWaterSolver; "
+                "ShallowWaterSolver(ShallowWaterConfig(N_x={0}, N_y={0}, H={1}, anim_interval={2}, "
+                "sample_interval={2})).run({3})".format(size, H, n_steps + 1, n_steps)], check=True)
+        scripts = n_members*n_steps/(time.perf_counter() - t_0)
+
+        print("N = {:4d}  members: {:3d}  ensemble: {:9.1f}  separate: {:9.1f}  scripts: {:9.1f} "
+              "member-steps/s  ensemble/scripts: {:.2f}x".format(
+              size, n_members, ensemble, separate, scripts, ensemble/scripts))
+
+
+def bench_adaptive(size, cfls, n_steps):
+    """Steps and wall time needed to reach the end time of an n_steps fixed
+    step run with adaptive time steps, and the largest difference of the eta
+    snapshots (taken at the same physical times) from the fixed step run."""
+    config = ShallowWaterConfig(N_x=size, N_y=size, max_time_step=n_steps,
+                                anim_interval=max(n_steps//20, 1), sample_interval=max(n_steps//4, 1))
+    t_0 = time.perf_counter()
+    fixed = ShallowWaterSolver(config).run()
+    wall = time.perf_counter() - t_0
+    print("N = {:4d}  fixed dt       steps: {:6d}  time: {:7.2f} s  max |eta|: {:.3g}".format(
+        size, fixed.time_step, wall, np.abs(fixed.eta).max()))
+    for cfl in cfls:
+        config.adaptive_dt, config.cfl = True, cfl
+        t_0 = time.perf_counter()
+        adaptive = ShallowWaterSolver(config).run()
+        wall = time.perf_counter() - t_0
+        error = max(np.abs(a - f).max() for a, f in zip(adaptive.eta_list, fixed.eta_list))
+        print("N = {:4d}  adaptive {:4.2f}  steps: {:6d}  time: {:7.2f} s  max snapshot difference: {:.3g}".format(
+            size, cfl, adaptive.time_step, wall, error))
+
+
+def bench_precision(sizes, backends, n_steps, n_check_steps):
+    """Steps per second in float64 and float32 per backend and grid size,
+    then the mass drift |mass(t) - mass(0)|/|mass(0)| of a long run in
+    float64, in float32 with float64 accumulation of the mass and in float32
+    throughout, and the largest eta difference of the float32 run."""
+    for N in sizes:
+        line = "N = {:5d}".format(N)
+        for backend in backends:
+            rates = {}
+            for dtype in ("float64", "float32"):
+                config = ShallowWaterConfig(N_x=N, N_y=N, backend=backend, dtype=dtype)
+                rates[dtype] = steps_per_second(config, n_steps)
+            line += "  {}: {:8.2f} / {:8.2f} steps/s ({:.2f}x)".format(
+                backend, rates["float64"], rates["float32"], rates["float32"]/rates["float64"])
+        print(line + "  [float64 / float32]")
+
+    runs = {"float64": dict(dtype="float64"),
+            "float32, float64 mass": dict(dtype="float32", mass_float64=True),
+            "float32, float32 mass": dict(dtype="float32", mass_float64=False)}
+    eta_64 = None
+    for label, precision in runs.items():
+        config = ShallowWaterConfig(N_x=sizes[0], N_y=sizes[0], max_time_step=n_check_steps,
+                                    anim_interval=n_check_steps + 1, sample_interval=n_check_steps + 1,
+                                    **precision)
+        solver = ShallowWaterSolver(config)
+        mass_0 = solver.mass()
+        solver.run()
+        drift = abs(solver.mass() - mass_0)/abs(mass_0)
+        eta_64 = solver.eta.astype(np.float64) if eta_64 is None else eta_64
+        print("N = {:5d}  steps: {:6d}  {:<22} mass drift: {:.3e}  max |eta - eta_float64|: {:.3e}".format(
+            sizes[0], n_check_steps, label, drift, np.abs(solver.eta - eta_64).max()))
+
+
+def git_revision():
+    """Commit of the working tree, to tell timings of different versions apart."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_profile(sizes, backends, n_steps, output):
+    """Per-phase timings of n_steps steps with the default sample and
+    snapshot intervals, the snapshots streamed to a temporary store. One JSON
+    record per backend and grid size is written to output, including the
+    steps/s of the same run without profiling, which shows the overhead of
+    the timers."""
+    revision = git_revision()
+    for N in sizes:
+        for backend in backends:
+            rates = {}
+            for profile in (False, True):
+                config = ShallowWaterConfig(N_x=N, N_y=N, backend=backend, max_time_step=n_steps, profile=profile)
+                solver = ShallowWaterSolver(config)
+                solver.run(1)   # Compile the numba kernel outside the timings
+                if profile:
+                    solver.timer.reset()
+                with tempfile.TemporaryDirectory() as store_dir:
+                    with solver.snapshot_writer(store_dir):
+                        t_0 = time.perf_counter()
+                        solver.run()
+                        rates[profile] = (n_steps - 1)/(time.perf_counter() - t_0)
+            write_record(solver.profile_record(revision=revision, unprofiled_steps_per_second=rates[False],
+                                               profiled_steps_per_second=rates[True]), output)
+
+
+def check_parallel(workers, n_steps=200):
+    """Assert that the domain-decomposed solver reproduces the serial one."""
+    for terms in (dict(), dict(use_friction=True, use_wind=True, use_source=True, use_sink=True)):
+        config = ShallowWaterConfig(N_x=48, N_y=40, anim_interval=25, **terms)
+        serial = ShallowWaterSolver(config).run(n_steps)
+        for n_workers in workers:
+            with ParallelShallowWaterSolver(config, n_workers=n_workers) as solver:
+                solver.run(n_steps)
+            for name in ("eta", "u", "v"):
+                np.testing.assert_array_equal(getattr(solver, name), getattr(serial, name),
+                    err_msg="{} workers, {}, {}".format(n_workers, terms, name))
+            for frame, serial_frame in zip(solver.eta_list, serial.eta_list):
+                np.testing.assert_array_equal(frame, serial_frame)
+            print(" parallel: {} workers, {} ok".format(n_workers, terms or "default"))
+
+
+def check_backends(backends, n_steps=200, rtol=1e-12, atol=1e-14):
+    """Run every combination of model terms with each backend and assert that
+    eta, u and v agree with the reference backend to tolerance."""
+    term_sets = [dict(),
+                 dict(use_beta=False),
+                 dict(use_coriolis=False),
+                 dict(use_friction=True, use_wind=True, use_source=True, use_sink=True)]
+    for terms in term_sets:
+        config = ShallowWaterConfig(N_x=48, N_y=40, backend="reference", **terms)
+        reference = ShallowWaterSolver(config).run(n_steps)
+        for backend in backends:
+            config = ShallowWaterConfig(N_x=48, N_y=40, backend=backend, **terms)
+            solver = ShallowWaterSolver(config).run(n_steps)
+            for name in ("eta", "u", "v"):
+                np.testing.assert_allclose(getattr(solver, name), getattr(reference, name),
+                    rtol=rtol, atol=atol, err_msg="{} backend, {}, {}".format(solver.backend, terms, name))
+            print("{:>9}: {} ok".format(solver.backend, terms or "default"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    steps = sub.add_parser("steps", help="steps/second per backend and grid size")
+    steps.add_argument("--sizes", type=int, nargs="+", default=[150, 500, 1000, 2000])
+    steps.add_argument("--backends", nargs="+", default=["reference", "numpy", "numba"])
+    steps.add_argument("--steps", type=int, default=20)
+
+    parallel = sub.add_parser("parallel", help="strong and weak scaling of the parallel solver")
+    parallel.add_argument("--size", type=int, default=1000)
+    parallel.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parallel.add_argument("--steps", type=int, default=20)
+
+    ensemble = sub.add_parser("ensemble", help="ensemble throughput versus separate runs")
+    ensemble.add_argument("--size", type=int, default=150)
+    ensemble.add_argument("--members", type=int, nargs="+", default=[8, 32])
+    ensemble.add_argument("--steps", type=int, default=100)
+
+    adaptive = sub.add_parser("adaptive", help="adaptive versus fixed time steps")
+    adaptive.add_argument("--size", type=int, default=150)
+    adaptive.add_argument("--cfl", type=float, nargs="+", default=[0.25, 0.5])
+    adaptive.add_argument("--steps", type=int, default=5000)
+
+    precision = sub.add_parser("precision", help="float32 versus float64 speed and mass conservation")
+    precision.add_argument("--sizes", type=int, nargs="+", default=[150, 1000])
+    precision.add_argument("--backends", nargs="+", default=["numpy", "numba"])
+    precision.add_argument("--steps", type=int, default=20)
+    precision.add_argument("--check-steps", type=int, default=5000)
+
+    profile = sub.add_parser("profile", help="per-phase timings as JSON records")
+    profile.add_argument("--sizes", type=int, nargs="+", default=[150, 1000])
+    profile.add_argument("--backends", nargs="+", default=["reference", "numpy", "numba"])
+    profile.add_argument("--steps", type=int, default=200)
+    profile.add_argument("--output", default="-", help="file to append the records to, '-' for stdout")
+
+    check = sub.add_parser("check", help="compare backends against the reference backend")
+    check.add_argument("--backends", nargs="+", default=["numpy", "numba"])
+    check.add_argument("--workers", type=int, nargs="+", default=[1, 2, 3])
+
+    args = parser.parse_args()
+    if args.bench == "steps":
+        bench_steps(args.sizes, args.backends, args.steps)
+    elif args.bench == "parallel":
+        bench_parallel(args.size, args.workers, args.steps)
+    elif args.bench == "ensemble":
+        bench_ensemble(args.size, args.members, args.steps)
+    elif args.bench == "adaptive":
+        bench_adaptive(args.size, args.cfl, args.steps)
+    elif args.bench == "precision":
+        bench_precision(args.sizes, args.backends, args.steps, args.check_steps)
+    elif args.bench == "profile":
+        bench_profile(args.sizes, args.backends, args.steps, args.output)
+    elif args.bench == "check":
+        check_backends(args.backends)
+        check_parallel(args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Benchmarks for the spectral analysis in fourier_transform.py.
+
+Run as a script, e.g.
+
+    python bench_spectrum.py scaling --fft-sizes 1024 16384 262144 4194304 --dft-sizes 256 1024 4096
+    python bench_spectrum.py check
+
+scaling times fourier_transform() against a direct evaluation of the discrete
+Fourier transform and prints the exponent p of a fit time ~ n^p for both
+(about 1 for the FFT, 2 for the DFT). check compares the FFT spectra with the
+direct DFT and, when scipy is installed, welch() and periodogram() with
+scipy.signal, and exits with an error if they disagree."""
+
+import argparse
+import time
+import numpy as np
+import fourier_transform as ft
+
+
+def naive_dft(signal, block=256):
+    """Non-negative frequency half of the DFT of signal, evaluated as a sum
+    over all samples for every frequency: O(n^2). The frequencies are done in
+    blocks to bound the memory of the exponential table."""
+    signal = np.asarray(signal, dtype=float)
+    n = len(signal)
+    samples = np.arange(n)
+    spectrum = np.empty(n//2 + 1, dtype=complex)
+    for k_0 in range(0, n//2 + 1, block):
+        k = np.arange(k_0, min(k_0 + block, n//2 + 1))
+        spectrum[k] = np.exp(-2j*np.pi*np.outer(k, samples)/n) @ signal
+    return spectrum
+
+
+def naive_fourier_transform(signal, N, T):
+    """fourier_transform() computed with naive_dft()."""
+    amplitude = np.abs(naive_dft(np.asarray(signal)[:N]))/N
+    amplitude[1:(N + 1)//2] *= 2
+    return np.arange(N//2 + 1)/T, amplitude
+
+
+def timed(function, *args, repeat=3):
+    """Smallest wall time of repeat calls of function(*args)."""
+    best = np.inf
+    for _ in range(repeat):
+        t_0 = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - t_0)
+    return best
+
+
+def bench_scaling(fft_sizes, dft_sizes):
+    rng = np.random.default_rng(0)
+    for label, function, sizes in (("fft", ft.fourier_transform, fft_sizes),
+                                   ("dft", naive_fourier_transform, dft_sizes)):
+        times = []
+        for n in sizes:
+            signal = rng.normal(size=n)
+            times.append(timed(function, signal, n, float(n)))
+            print("{}  n = {:9d}  {:10.6f} s".format(label, n, times[-1]))
+        if len(sizes) > 1:
+            exponent = np.polyfit(np.log(sizes), np.log(times), 1)[0]
+            print("{}  time ~ n^{:.2f}".format(label, exponent))
+    for n in sorted(set(fft_sizes) & set(dft_sizes)):
+        signal = rng.normal(size=n)
+        print("n = {:6d}  dft/fft: {:.0f}x".format(n, timed(naive_fourier_transform, signal, n, float(n))
+                                                  /timed(ft.fourier_transform, signal, n, float(n))))
+
+
+def check():
+    rng = np.random.default_rng(1)
+    for n in (255, 256, 1000):
+        t = np.arange(n)*0.5
+        signal = np.sin(2*np.pi*0.1*t) + 0.3*rng.normal(size=n)
+        freq, amplitude = ft.fourier_transform(signal, n, n*0.5)
+        naive_freq, naive_amplitude = naive_fourier_transform(signal, n, n*0.5)
+        np.testing.assert_allclose(freq, naive_freq, rtol=1e-12)
+        np.testing.assert_allclose(amplitude, naive_amplitude, rtol=1e-9, atol=1e-12)
+        freq, psd = ft.periodogram(signal, fs=2.0, window_name=None)
+        np.testing.assert_allclose(psd.sum()*freq[1], signal.var(), rtol=1e-12)
+        print("fourier_transform, periodogram: n = {} ok".format(n))
+
+    eta = rng.normal(size=(48, 40))
+    k_x, k_y, power = ft.spatial_spectrum(eta, 2.0, 3.0)
+    np.testing.assert_allclose(power.sum()*(k_x[1] - k_x[0])*k_y[1], eta.var(), rtol=1e-12)
+    k, radial = ft.radial_spectrum(eta, 2.0, 3.0)
+    np.testing.assert_allclose((radial*np.diff(k).mean()).sum(), eta.var(), rtol=1e-12)
+    print("spatial_spectrum, radial_spectrum ok")
+
+    try:
+        from scipy import signal as scipy_signal
+    except ImportError:
+        print("scipy not installed, welch and periodogram not compared")
+        return
+    series = rng.normal(size=5001)
+    for detrend, scipy_detrend in (("mean", "constant"), ("linear", "linear")):
+        freq, psd = ft.welch(series, fs=4.0, segment_length=512, detrend=detrend)
+        scipy_freq, scipy_psd = scipy_signal.welch(series, fs=4.0, nperseg=512, detrend=scipy_detrend)
+        np.testing.assert_allclose(freq, scipy_freq)
+        np.testing.assert_allclose(psd, scipy_psd, rtol=1e-10)
+        freq, psd = ft.periodogram(series, fs=4.0, detrend=detrend)
+        scipy_freq, scipy_psd = scipy_signal.periodogram(series, fs=4.0, window="hann", detrend=scipy_detrend)
+        np.testing.assert_allclose(psd, scipy_psd, rtol=1e-10, atol=1e-14)
+    print("welch, periodogram match scipy.signal ok")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    scaling = sub.add_parser("scaling", help="FFT versus direct DFT time for growing series")
+    scaling.add_argument("--fft-sizes", type=int, nargs="+", default=[1024, 4096, 16384, 262144, 4194304])
+    scaling.add_argument("--dft-sizes", type=int, nargs="+", default=[256, 1024, 4096])
+
+    sub.add_parser("check", help="compare the spectra with a direct DFT and scipy.signal")
+
+    args = parser.parse_args()
+    if args.bench == "scaling":
+        bench_scaling(args.fft_sizes, args.dft_sizes)
+    elif args.bench == "check":
+        check()
+
+
+if __name__ == "__main__":
+    main()
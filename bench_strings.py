@@ -0,0 +1,121 @@
+"""Benchmarks for the string kernel of guitar_strings_vibs.py.
+
+Run as a script, e.g.
+
+    python bench_strings.py fps --strings 6 --points 200 1000 10000 100000
+    python bench_strings.py check
+
+fps times one time step of the original per-point Python loop over a list of
+strings against Strings.step, and from the time per string point and step
+prints how many points (strings x points per string) each sustains at 60
+frames per second with 1 and --substeps steps per frame. Drawing is not
+timed. check compares Strings.step with the loop over plucked strings and
+exits with an error if they differ."""
+
+import argparse
+import time
+import numpy as np
+from guitar_strings_vibs import Strings
+
+BUDGET = 1/60   # Seconds per frame at 60 FPS
+
+
+def loop_step(u, u_prev, u_next, n, c, dx, dt, damping, k):
+    """The update of the original guitar_strings_vibs.py on lists of arrays,
+    which are swapped in place."""
+    for s in range(len(u)):
+        for i in range(1, n - 1):
+            u_next[s][i] = (2 * u[s][i] - u_prev[s][i] +
+                            k * (u[s][i + 1] + u[s][i - 1] - 2 * u[s][i]) +
+                            c ** 2 * dt ** 2 / dx ** 2 *
+                            (u[s][i + 1] + u[s][i - 1] - 2 * u[s][i]))
+
+        # Apply damping
+        u_next[s] *= damping
+
+        # Update the wave grids
+        u_prev[s], u[s], u_next[s] = u[s], u_next[s], u_prev[s]
+
+
+def plucked(num_strings, n, seed=0):
+    """Strings with a few random plucks, and the same state as lists."""
+    rng = np.random.default_rng(seed)
+    strings = Strings(num_strings, n)
+    for _ in range(3*num_strings):
+        strings.pluck(rng.integers(num_strings), rng.integers(n), rng.uniform(-3, 3))
+    return strings, [row.copy() for row in strings.u], [row.copy() for row in strings.u_prev]
+
+
+def seconds_per_step(step, min_seconds=0.2):
+    """Time per call of step, repeated for at least min_seconds."""
+    calls, t_0 = 0, time.perf_counter()
+    while True:
+        step()
+        calls += 1
+        seconds = time.perf_counter() - t_0
+        if seconds >= min_seconds:
+            return seconds/calls
+
+
+def bench_fps(num_strings, points, substeps, loop_max):
+    for n in points:
+        strings, u, u_prev = plucked(num_strings, n)
+        vectorized = seconds_per_step(strings.step)
+        line = "{} x {:<7d} Strings.step: {:9.1f} us/step".format(num_strings, n, 1e6*vectorized)
+        if n <= loop_max:
+            u_next = [np.zeros(n) for _ in range(num_strings)]
+            loop = seconds_per_step(lambda: loop_step(u, u_prev, u_next, n, 1, 1, 0.1, 0.99, 0.1))
+            line += "  loop: {:9.1f} us/step ({:.0f}x)".format(1e6*loop, loop/vectorized)
+        print(line)
+
+    # Sustainable points at 60 FPS, from the time per point of the largest grid
+    n = points[-1]
+    strings, u, u_prev = plucked(num_strings, n)
+    per_point = seconds_per_step(strings.step)/(num_strings*n)
+    n_loop = min(n, loop_max)
+    strings, u, u_prev = plucked(num_strings, n_loop)
+    u_next = [np.zeros(n_loop) for _ in range(num_strings)]
+    loop_per_point = seconds_per_step(lambda: loop_step(u, u_prev, u_next, n_loop, 1, 1, 0.1, 0.99, 0.1)) \
+        / (num_strings*n_loop)
+    for steps in (1, substeps):
+        print("at 60 FPS with {} step(s) per frame: loop {:,.0f} points, Strings.step {:,.0f} points".format(
+            steps, BUDGET/(steps*loop_per_point), BUDGET/(steps*per_point)))
+
+
+def check():
+    for num_strings, n in ((6, 200), (3, 17)):
+        strings, u, u_prev = plucked(num_strings, n)
+        u_next = [np.zeros(n) for _ in range(num_strings)]
+        strings.step(5)
+        for _ in range(5):
+            loop_step(u, u_prev, u_next, n, 1, 1, 0.1, 0.99, 0.1)
+        for _ in range(200):
+            strings.step()
+            loop_step(u, u_prev, u_next, n, 1, 1, 0.1, 0.99, 0.1)
+        error = max(np.abs(strings.u - np.array(u)).max(), np.abs(strings.u_prev - np.array(u_prev)).max())
+        if error > 1e-12:
+            raise SystemExit("{} strings of {} points differ from the loop by {:.3g}".format(num_strings, n, error))
+        print("{} strings of {} points: max difference from the loop {:.1e} ok".format(num_strings, n, error))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    fps = sub.add_parser("fps", help="time per step and points sustained at 60 FPS")
+    fps.add_argument("--strings", type=int, default=6)
+    fps.add_argument("--points", type=int, nargs="+", default=[200, 1000, 10000, 100000])
+    fps.add_argument("--substeps", type=int, default=10, help="steps per frame for the second estimate")
+    fps.add_argument("--loop-max", type=int, default=1000, help="largest string timed with the loop")
+
+    sub.add_parser("check", help="compare Strings.step with the original loop")
+
+    args = parser.parse_args()
+    if args.bench == "fps":
+        bench_fps(args.strings, args.points, args.substeps, args.loop_max)
+    elif args.bench == "check":
+        check()
+
+
+if __name__ == "__main__":
+    main()
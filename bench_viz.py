@@ -0,0 +1,226 @@
+"""Benchmarks for rendering shallow water animations.
+
+Run as a script, e.g.
+
+    python bench_viz.py render --size 150 --frames 120 --workers 1 2 4 8
+    python bench_viz.py lut --size 150 --frames 240 --scales 1 2 4
+    python bench_viz.py lod --sizes 250 500 1000 2000 --resolutions 25 50 100
+
+render compares frames per second of the viz_tools1 animation functions
+(FuncAnimation and FFMpegWriter in one process) with frame_renderer and a pool
+of workers, for the eta, velocity and surface animations of one shallow water
+run. lut compares the matplotlib eta frames with the colormap lookup table
+path of frame_renderer.render_eta_lut. Without an ffmpeg executable the raw
+frames are written to os.devnull instead, so that only the drawing is
+compared. lod times single frames of the quiver and surface views on growing
+grids of synthetic waves, drawn as before level of detail (every third arrow,
+plot_surface on the full grid) and block averaged to a target resolution."""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib import animation
+import frame_renderer
+from shallow_water import ShallowWaterConfig, ShallowWaterSolver
+
+
+class NullWriter(animation.AbstractMovieWriter):
+    """Movie writer that draws every frame like FFMpegWriter, but discards
+    the RGB data."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(fps=kwargs.get("fps", 24))
+
+    def setup(self, fig, outfile, dpi=None):
+        super().setup(fig, outfile, dpi)
+        self._sink = open(os.devnull, "wb")
+
+    def grab_frame(self, **savefig_kwargs):
+        self.fig.canvas.draw()
+        self._sink.write(np.asarray(self.fig.canvas.buffer_rgba())[:, :, :3].tobytes())
+
+    def finish(self):
+        self._sink.close()
+
+
+def waves(size, n_frames):
+    """X, Y and n_frames frames of eta, u and v on a size x size grid: a few
+    plane waves moving across a 1000 km square."""
+    x = np.linspace(0, 1e6, size)
+    X, Y = np.meshgrid(x, x, indexing="ij")
+    frames = []
+    for num in range(n_frames):
+        phase = 0.3*num
+        eta = 0.2*np.sin(X/4e4 - phase)*np.cos(Y/6e4) + 0.1*np.sin((X + Y)/1.5e4 + phase)
+        frames.append((eta, 0.05*np.cos(Y/5e4 + phase), 0.05*np.sin(X/3e4 - phase)))
+    return X, Y, frames
+
+
+def seconds_per_frame(view, frames, fields):
+    """Mean time to draw frames with view.render(num, *fields(frame))."""
+    view.render(0, *fields(frames[0]))     # First draw sets up the figure
+    t_0 = time.perf_counter()
+    for num, frame in enumerate(frames):
+        view.render(num, *fields(frame))
+    return (time.perf_counter() - t_0)/len(frames)
+
+
+class StrideVelocityView(frame_renderer.View):
+    """Quiver plot of every third point, as drawn before level of detail."""
+
+    def __init__(self, X, Y):
+        super().__init__((8, 8), 100, 1.0)
+        self.ax = self.fig.add_subplot()
+        self.Q = self.ax.quiver(X[::3, ::3]/1000.0, Y[::3, ::3]/1000.0, X[::3, ::3]*0, Y[::3, ::3]*0,
+                                scale=0.2, scale_units='inches')
+
+    def update(self, num, u, v):
+        self.Q.set_UVC(u[::3, ::3], v[::3, ::3])
+
+
+class FullSurfaceView(frame_renderer.SurfaceView):
+    """plot_surface on the full grid with its default sampling, as drawn
+    before level of detail."""
+
+    def __init__(self, X, Y):
+        super().__init__(X, Y, 1.0, resolution=None)
+
+    def update(self, num, eta):
+        if self.surf is not None:
+            self.surf.remove()
+        self.surf = self.ax.plot_surface(self.X, self.Y, eta, cmap = self.cmap)
+
+
+def bench_lod(sizes, resolutions, n_frames):
+    for size in sizes:
+        X, Y, frames = waves(size, n_frames)
+        velocity = lambda frame: frame[1:]
+        surface = lambda frame: frame[:1]
+        line = "{:5d} x {:<5d} quiver: stride 3 {:7.3f} s".format(
+            size, size, seconds_per_frame(StrideVelocityView(X, Y), frames, velocity))
+        for resolution in resolutions:
+            line += "  lod {} {:7.3f} s".format(resolution, seconds_per_frame(
+                frame_renderer.VelocityView(X, Y, 1.0, resolution=resolution), frames, velocity))
+        print(line)
+        line = "{:13} surface: full grid {:7.3f} s".format(
+            "", seconds_per_frame(FullSurfaceView(X, Y), frames, surface))
+        for resolution in resolutions:
+            line += "  lod {} {:7.3f} s".format(resolution, seconds_per_frame(
+                frame_renderer.SurfaceView(X, Y, 1.0, resolution=resolution), frames, surface))
+        print(line)
+
+
+def snapshots(size, n_frames):
+    """eta, u and v snapshots of a shallow water run with n_frames frames."""
+    config = ShallowWaterConfig(N_x=size, N_y=size, anim_interval=20, max_time_step=20*n_frames)
+    solver = ShallowWaterSolver(config).run()
+    return solver, solver.eta_list[:n_frames], solver.u_list[:n_frames], solver.v_list[:n_frames]
+
+
+def bench_render(size, n_frames, workers, views):
+    have_ffmpeg = shutil.which("ffmpeg") is not None
+    solver, eta, u, v = snapshots(size, n_frames)
+    X, Y, frame_interval = solver.X, solver.Y, solver.config.anim_interval*solver.dt
+    try:
+        import viz_tools1
+    except ImportError as error:
+        viz_tools1 = None
+        print("viz_tools1 cannot be imported ({}), only frame_renderer is timed".format(error))
+    if viz_tools1 is not None and not have_ffmpeg:
+        animation.FFMpegWriter = NullWriter     # Looked up by viz_tools1 when it saves
+    print("ffmpeg: {}  grid: {} x {}  frames: {}".format(
+        "yes" if have_ffmpeg else "no (frames are discarded)", size, size, len(eta)))
+
+    serial = {"eta": lambda name: viz_tools1.eta_animation(X, Y, eta, frame_interval, name),
+              "velocity": lambda name: viz_tools1.velocity_animation(X, Y, u, v, frame_interval, name),
+              "surface": lambda name: viz_tools1.eta_animation3D(X, Y, eta, frame_interval, name)}
+    parallel = {"eta": lambda name, **kw: frame_renderer.render_eta(X, Y, eta, frame_interval, name, **kw),
+                "velocity": lambda name, **kw: frame_renderer.render_velocity(X, Y, u, v, frame_interval, name, **kw),
+                "surface": lambda name, **kw: frame_renderer.render_eta3D(X, Y, eta, frame_interval, name, **kw)}
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        for view in views:
+            name = os.path.join(out_dir, view)
+            line = "{:>8}".format(view)
+            base = None
+            if viz_tools1 is not None:
+                import matplotlib.pyplot as plt
+                t_0 = time.perf_counter()
+                serial[view](name)
+                base = len(eta)/(time.perf_counter() - t_0)
+                plt.close("all")
+                line += "  viz_tools1: {:7.1f} frames/s".format(base)
+            for n_workers in workers:
+                sink = None if have_ffmpeg else open(os.devnull, "wb")
+                t_0 = time.perf_counter()
+                parallel[view](name, workers=n_workers, sink=sink)
+                rate = len(eta)/(time.perf_counter() - t_0)
+                if sink is not None:
+                    sink.close()
+                line += "  {} workers: {:7.1f} frames/s".format(n_workers, rate)
+                if base:
+                    line += " ({:.2f}x)".format(rate/base)
+            print(line)
+
+
+def bench_lut(size, n_frames, scales):
+    have_ffmpeg = shutil.which("ffmpeg") is not None
+    solver, eta, u, v = snapshots(size, n_frames)
+    X, Y, frame_interval = solver.X, solver.Y, solver.config.anim_interval*solver.dt
+    print("ffmpeg: {}  grid: {} x {}  frames: {}".format(
+        "yes" if have_ffmpeg else "no (frames are discarded)", size, size, len(eta)))
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        name = os.path.join(out_dir, "eta")
+        sink = None if have_ffmpeg else open(os.devnull, "wb")
+        t_0 = time.perf_counter()
+        frame_renderer.render_eta(X, Y, eta, frame_interval, name, workers=1, sink=sink)
+        base = len(eta)/(time.perf_counter() - t_0)
+        print("matplotlib pcolormesh: {:8.1f} frames/s".format(base))
+        for scale in scales:
+            for panel in (True, False):
+                t_0 = time.perf_counter()
+                frame_renderer.render_eta_lut(X, Y, eta, frame_interval, name, scale=scale, panel=panel, sink=sink)
+                rate = len(eta)/(time.perf_counter() - t_0)
+                print("lut  scale: {}  panel: {:5}  {:8.1f} frames/s  ({:.1f}x)".format(
+                    scale, str(panel), rate, rate/base))
+        if sink is not None:
+            sink.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    render = sub.add_parser("render", help="frames/second of the animation renderers")
+    render.add_argument("--size", type=int, default=150)
+    render.add_argument("--frames", type=int, default=120)
+    render.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    render.add_argument("--views", nargs="+", default=["eta", "velocity", "surface"])
+
+    lut = sub.add_parser("lut", help="frames/second of the lookup table eta renderer")
+    lut.add_argument("--size", type=int, default=150)
+    lut.add_argument("--frames", type=int, default=240)
+    lut.add_argument("--scales", type=int, nargs="+", default=[1, 2, 4])
+
+    lod = sub.add_parser("lod", help="seconds per frame of the quiver and surface views on large grids")
+    lod.add_argument("--sizes", type=int, nargs="+", default=[250, 500, 1000, 2000])
+    lod.add_argument("--resolutions", type=int, nargs="+", default=[25, 50, 100])
+    lod.add_argument("--frames", type=int, default=3)
+
+    args = parser.parse_args()
+    if args.bench == "render":
+        bench_render(args.size, args.frames, args.workers, args.views)
+    elif args.bench == "lut":
+        bench_lut(args.size, args.frames, args.scales)
+    elif args.bench == "lod":
+        bench_lod(args.sizes, args.resolutions, args.frames)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Convergence monitoring for iterative and time-stepping solvers.
+
+A ConvergenceMonitor is updated once per iteration (a relaxation sweep, a
+time step) with a residual: a number, or a function that computes it. Only
+every check_interval-th update evaluates the residual, so a costly reduction
+over the whole field is paid once per check rather than once per iteration.
+The monitor keeps the history of the checked residuals and reports when one
+falls below the tolerance:
+
+    monitor = ConvergenceMonitor(tolerance=1e-3, check_interval=10)
+    while not monitor.update(solver.residual):
+        solver.step(dt)
+    print(monitor.report())
+
+heat_conduction.py (norm of dT/dt) and heat_transfer_box.py (temperature
+change of a sweep) stop on it."""
+
+import numpy as np
+
+NORMS = ("max", "rms", "sum")
+
+
+def field_norm(field, norm="max"):
+    """The max, root mean square or sum of the absolute values of field."""
+    if norm == "max":
+        return float(np.abs(field).max())
+    if norm == "rms":
+        return float(np.sqrt(np.mean(np.square(field))))
+    if norm == "sum":
+        return float(np.abs(field).sum())
+    raise ValueError("Unknown norm '{}'".format(norm))
+
+
+class ConvergenceMonitor:
+    """Decides when an iteration has converged: the residual of a check is
+    below tolerance. iterations counts the updates, history holds the
+    (iteration, residual) of every check and converged_at the iteration of
+    the first converged check (None until then)."""
+
+    def __init__(self, tolerance, check_interval=1):
+        if check_interval < 1:
+            raise ValueError("check_interval must be at least 1, not {}".format(check_interval))
+        self.tolerance = tolerance
+        self.check_interval = check_interval
+        self.iterations = 0
+        self.history = []
+        self.converged_at = None
+
+    @property
+    def converged(self):
+        return self.converged_at is not None
+
+    @property
+    def residual(self):
+        """The residual of the last check (None before the first)."""
+        return self.history[-1][1] if self.history else None
+
+    @property
+    def due(self):
+        """Whether the next update is a check."""
+        return (self.iterations + 1) % self.check_interval == 0
+
+    def update(self, residual):
+        """Count an iteration and, if it is a check, evaluate residual (a
+        number or a function without arguments; None skips the check).
+        Returns whether the iteration has converged."""
+        self.iterations += 1
+        if self.iterations % self.check_interval == 0 and residual is not None:
+            value = float(residual() if callable(residual) else residual)
+            self.history.append((self.iterations, value))
+            if value < self.tolerance and self.converged_at is None:
+                self.converged_at = self.iterations
+        return self.converged
+
+    def residuals(self):
+        """The checked iterations and residuals as two arrays."""
+        history = np.array(self.history, dtype=float).reshape(-1, 2)
+        return history[:, 0].astype(int), history[:, 1]
+
+    def report(self):
+        if self.converged:
+            return "converged after {} iterations (residual {:.3g} < {:.3g})".format(
+                self.converged_at, self.residual, self.tolerance)
+        return "not converged after {} iterations (residual {}, tolerance {:.3g})".format(
+            self.iterations, "not checked" if self.residual is None else "{:.3g}".format(self.residual),
+            self.tolerance)
@@ -0,0 +1,117 @@
+"""Spectral analysis of model output with the FFT.
+
+fourier_transform() is the one-sided amplitude spectrum that
+viz_tools1.plot_time_series_and_ft plots. The other functions estimate power
+spectral densities of long or noisy series (periodogram, welch) and spectra
+of 2D fields such as eta (spatial_spectrum, radial_spectrum). Everything is
+built on numpy.fft, so a series of n samples costs O(n log n) rather than the
+O(n^2) of a direct evaluation of the discrete Fourier transform."""
+
+import numpy as np
+
+_WINDOWS = {"boxcar": np.ones, "hann": np.hanning, "hamming": np.hamming,
+            "blackman": np.blackman, "bartlett": np.bartlett}
+
+
+def window(name, N):
+    """Taper of length N. name is one of "boxcar" (or None), "hann",
+    "hamming", "blackman" and "bartlett", or an array of length N that is
+    returned as it is. The named windows are periodic (the first N points
+    of the symmetric window of length N + 1), as is usual for spectra."""
+    if name is None:
+        name = "boxcar"
+    if isinstance(name, str):
+        return _WINDOWS[name](N + 1)[:-1]
+    taper = np.asarray(name, dtype=float)
+    if taper.shape != (N,):
+        raise ValueError("Window of length {} given for {} samples".format(len(taper), N))
+    return taper
+
+
+def fourier_transform(signal, N, T, window_name=None):
+    """One-sided amplitude spectrum of the first N samples of signal, which
+    span a time T (so the sample spacing is T/N). Returns the frequencies
+    [1/unit of T] and the amplitude of the sinusoid at each frequency; a
+    window other than the boxcar is corrected for its coherent gain."""
+    signal = np.asarray(signal)[:N]
+    taper = window(window_name, N)
+    amplitude = np.abs(np.fft.rfft(signal*taper))/taper.sum()
+    amplitude[1:(N + 1)//2] *= 2    # Fold in the negative frequencies, except DC and Nyquist
+    return np.fft.rfftfreq(N, d=T/N), amplitude
+
+
+def _detrend(segments, detrend):
+    if detrend == "mean":
+        return segments - segments.mean(axis=-1, keepdims=True)
+    if detrend == "linear":
+        n = segments.shape[-1]
+        t = np.arange(n) - (n - 1)/2
+        slope = (segments*t).sum(axis=-1, keepdims=True)/(t*t).sum()
+        return segments - segments.mean(axis=-1, keepdims=True) - slope*t
+    if detrend is None:
+        return segments
+    raise ValueError("Unknown detrend '{}'".format(detrend))
+
+
+def _density(segments, fs, taper):
+    """One-sided power spectral density of every segment (last axis)."""
+    n = segments.shape[-1]
+    power = np.abs(np.fft.rfft(segments*taper, axis=-1))**2/(fs*(taper*taper).sum())
+    power[..., 1:(n + 1)//2] *= 2
+    return np.fft.rfftfreq(n, d=1/fs), power
+
+
+def periodogram(signal, fs=1.0, window_name="hann", detrend="mean"):
+    """Power spectral density of signal sampled at frequency fs, from a
+    single windowed FFT. The sum of the density times the frequency spacing
+    is the variance of the (detrended) signal. Returns (freq, psd)."""
+    signal = _detrend(np.asarray(signal, dtype=float), detrend)
+    return _density(signal, fs, window(window_name, len(signal)))
+
+
+def welch(signal, fs=1.0, segment_length=256, overlap=0.5, window_name="hann", detrend="mean"):
+    """Welch estimate of the power spectral density: the average of the
+    periodograms of overlapping windowed segments of segment_length samples.
+    This trades frequency resolution for a variance reduced by about the
+    number of segments. All segments are transformed in one call, as strided
+    views of the signal. Returns (freq, psd)."""
+    signal = np.asarray(signal, dtype=float)
+    segment_length = min(segment_length, len(signal))
+    step = max(int(segment_length*(1 - overlap)), 1)
+    segments = np.lib.stride_tricks.sliding_window_view(signal, segment_length)[::step]
+    freq, power = _density(_detrend(segments, detrend), fs, window(window_name, segment_length))
+    return freq, power.mean(axis=0)
+
+
+def spatial_spectrum(eta, dx, dy, window_name=None, detrend="mean"):
+    """2D power spectral density of a field eta[i, j] = eta(x_i, y_j) on a
+    grid with spacings dx, dy. Returns wavenumbers k_x (all, in increasing
+    order), k_y (non-negative) [cycles per unit length] and the density of
+    shape (len(k_x), len(k_y)). A window is applied along both axes."""
+    eta = np.asarray(eta, dtype=float)
+    N_x, N_y = eta.shape
+    if detrend == "mean":
+        eta = eta - eta.mean()
+    elif detrend is not None:
+        raise ValueError("Unknown detrend '{}'".format(detrend))
+    taper = np.outer(window(window_name, N_x), window(window_name, N_y))
+    spectrum = np.fft.rfft2(eta*taper)
+    power = np.abs(spectrum)**2*(dx*dy/(taper*taper).sum())
+    power[:, 1:(N_y + 1)//2] *= 2   # Fold in the negative k_y
+    k_x = np.fft.fftshift(np.fft.fftfreq(N_x, d=dx))
+    k_y = np.fft.rfftfreq(N_y, d=dy)
+    return k_x, k_y, np.fft.fftshift(power, axes=0)
+
+
+def radial_spectrum(eta, dx, dy, n_bins=None, window_name=None):
+    """Isotropic spectrum of eta: spatial_spectrum() summed over rings of
+    constant |k|. Returns the centers of the |k| bins and the spectrum,
+    normalised so that it integrates over |k| to the variance of eta."""
+    k_x, k_y, power = spatial_spectrum(eta, dx, dy, window_name=window_name)
+    k = np.hypot(k_x[:, None], k_y[None, :])
+    dk = max(k_x[1] - k_x[0], k_y[1] - k_y[0])
+    n_bins = n_bins or int(np.ceil(k.max()/dk))
+    edges = np.linspace(0, k.max()*(1 + 1e-12), n_bins + 1)
+    ring_power = np.bincount(np.digitize(k.ravel(), edges) - 1, weights=power.ravel(), minlength=n_bins)
+    cell = (k_x[1] - k_x[0])*(k_y[1] - k_y[0])
+    return (edges[1:] + edges[:-1])/2, ring_power[:n_bins]*cell/np.diff(edges)
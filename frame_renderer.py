@@ -0,0 +1,416 @@
+"""Parallel, pipelined rendering of shallow water animations to video.
+
+viz_tools1's animation functions draw every frame in the calling process
+through FuncAnimation and FFMpegWriter. Here the frames are rasterized by a
+pool of worker processes, each with its own off-screen (Agg) figure that is
+built once and only updated per frame, while the parent process streams the
+raw RGB frames to a single ffmpeg encoder in frame order:
+
+    snapshots --(frame index, arrays)--> workers: update artists, draw Agg canvas
+              <--(H x W x 3 uint8)------ ordered window -> ffmpeg stdin (rawvideo rgb24)
+
+The figures mirror eta_animation, velocity_animation and eta_animation3D, and
+the frame sequences may be lists or the memory-mapped arrays of a snapshot
+store, e.g.
+
+    store = SnapshotReader("snapshots")
+    render_eta(X, Y, store["eta"], store.frame_interval, "eta", workers=4)
+
+Only matplotlib's object-oriented API is used, so no GUI backend is needed.
+
+render_eta_lut() is a faster path for the eta heatmap that bypasses
+matplotlib for the frames altogether: eta is mapped through a precomputed
+colormap lookup table straight into a uint8 RGB buffer, and matplotlib only
+draws the static colorbar panel once."""
+
+import collections
+import itertools
+import multiprocessing
+import os
+import subprocess
+import numpy as np
+from level_of_detail import LevelOfDetail
+
+
+class View:
+    """Off-screen figure that draws one animation frame at a time. Frame num
+    is labelled with time num*frame_interval, or times[num] if times (the
+    time of every frame, e.g. SnapshotReader.times) is given. A view for
+    render() subclasses it, draws its artists in __init__ and updates them
+    in update() (see also heat_transfer.CylinderView)."""
+
+    def __init__(self, figsize, dpi, frame_interval, times=None):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        self.fig = Figure(figsize=figsize, dpi=dpi, facecolor="white")
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.frame_interval, self.times = frame_interval, times
+
+    def hours(self, num):
+        return (self.times[num] if self.times is not None else num*self.frame_interval)/3600
+
+    def update(self, num, *fields):
+        raise NotImplementedError
+
+    def render(self, num, *fields):
+        """Frame num as an (height, width, 3) array of RGB bytes."""
+        self.update(num, *fields)
+        self.canvas.draw()
+        return np.asarray(self.canvas.buffer_rgba())[:, :, :3].copy()
+
+
+class EtaView(View):
+    """pcolormesh of eta, as in viz_tools1.eta_animation."""
+
+    def __init__(self, X, Y, vmin, vmax, frame_interval, times=None, figsize=(6.4, 4.8), dpi=100):
+        import matplotlib.pyplot as plt
+        super().__init__(figsize, dpi, frame_interval, times)
+        self.ax = ax = self.fig.add_subplot()
+        ax.set_xlabel("x [m]", fontname = "serif", fontsize = 12)
+        ax.set_ylabel("y [m]", fontname = "serif", fontsize = 12)
+        self.pmesh = ax.pcolormesh(X, Y, np.zeros(X.shape), vmin = vmin, vmax = vmax, cmap = plt.cm.RdBu_r)
+        self.fig.colorbar(self.pmesh, ax = ax, orientation = "vertical")
+
+    def update(self, num, eta):
+        self.ax.set_title("Surface elevation $\\eta$ after t = {:.2f} hours".format(
+            self.hours(num)), fontname = "serif", fontsize = 16)
+        self.pmesh.set_array(np.ravel(eta))
+
+
+class VelocityView(View):
+    """Quiver plot of (u, v), as in viz_tools1.velocity_animation."""
+
+    def __init__(self, X, Y, frame_interval, times=None, resolution=50, figsize=(8, 8), dpi=100):
+        super().__init__(figsize, dpi, frame_interval, times)
+        self.lod = lod = LevelOfDetail(X.shape, resolution)
+        self.ax = ax = self.fig.add_subplot()
+        ax.set_xlabel("x [km]", fontname = "serif", fontsize = 16)
+        ax.set_ylabel("y [km]", fontname = "serif", fontsize = 16)
+        zeros = np.zeros(X.shape)
+        self.Q = ax.quiver(lod(X)/1000.0, lod(Y)/1000.0, lod(zeros), lod(zeros),
+            scale=0.2, scale_units='inches')
+        self.update(0, zeros, zeros)
+        self.fig.tight_layout()
+
+    def update(self, num, u, v):
+        self.ax.set_title("Velocity field $\\mathbf{{u}}(x,y,t)$ after t = {:.2f} hours".format(
+            self.hours(num)), fontname = "serif", fontsize = 19)
+        self.Q.set_UVC(self.lod(u), self.lod(v))
+
+
+class SurfaceView(View):
+    """3D surface of eta, as in viz_tools1.eta_animation3D. The axes are set
+    up once and only the surface is replaced every frame."""
+
+    def __init__(self, X, Y, frame_interval, times=None, z_lim=(-0.3, 0.7), resolution=50, figsize=(8, 8), dpi=100):
+        import matplotlib.pyplot as plt
+        from mpl_toolkits.mplot3d import Axes3D     # Registers the 3d projection
+        super().__init__(figsize, dpi, frame_interval, times)
+        self.lod = lod = LevelOfDetail(X.shape, resolution)
+        self.X, self.Y, self.cmap = lod(X)/1000, lod(Y)/1000, plt.cm.RdBu_r
+        self.ax = ax = self.fig.add_subplot(projection='3d')
+        ax.set_xlabel("x [km]", fontname = "serif", fontsize = 14)
+        ax.set_ylabel("y [km]", fontname = "serif", fontsize = 14)
+        ax.set_zlabel("$\\eta$ [m]", fontname = "serif", fontsize = 16)
+        ax.set_xlim(self.X.min(), self.X.max())
+        ax.set_ylim(self.Y.min(), self.Y.max())
+        ax.set_zlim(*z_lim)
+        self.surf = None
+
+    def update(self, num, eta):
+        if self.surf is not None:
+            self.surf.remove()
+        self.surf = self.ax.plot_surface(self.X, self.Y, self.lod(eta), rstride = 1, cstride = 1, cmap = self.cmap)
+        self.ax.set_title("Surface elevation $\\eta(x,y,t)$ after $t={:.2f}$ hours".format(
+            self.hours(num)), fontname = "serif", fontsize = 19, y=1.04)
+
+
+_worker_view = None
+
+
+def _init_worker(view_class, view_args):
+    global _worker_view
+    _worker_view = view_class(*view_args)
+
+
+def _render_chunk(chunk):
+    return [_worker_view.render(num, *fields) for num, fields in chunk]
+
+
+def _ordered_results(pool, tasks, chunksize, window):
+    """Images of tasks rendered by pool, in order, with at most window
+    chunks of chunksize frames in flight, so that finished frames do not
+    pile up when the encoder is slower than the workers."""
+    pending = collections.deque()
+    while True:
+        chunk = list(itertools.islice(tasks, chunksize))
+        if chunk:
+            pending.append(pool.apply_async(_render_chunk, (chunk,)))
+        if not pending:
+            return
+        if len(pending) >= window or not chunk:
+            yield from pending.popleft().get()
+
+
+def _finish_encoder(encoder, filename, failed):
+    """Close the input of the ffmpeg process encoder and wait for it to
+    write filename. Its failure is raised unless failed, i.e. an exception
+    of the frames is already propagating and should not be masked."""
+    try:
+        encoder.stdin.close()
+    except BrokenPipeError:
+        pass    # ffmpeg exited early, its exit status tells why
+    if encoder.wait() != 0 and not failed:
+        raise RuntimeError("ffmpeg failed to encode {}".format(filename))
+
+
+def open_ffmpeg(filename, width, height, fps=24, bitrate=10000, ffmpeg="ffmpeg", palette=None):
+    """Start an ffmpeg process that encodes raw rgb24 frames of width x
+    height read from its stdin into filename. A .gif file is mapped to the
+    colors of the image file palette (see write_palette()), or without one
+    each frame gets its own palette; either way frames are encoded as they
+    arrive rather than buffered for a palette of the whole video. Anything
+    else is H.264 in yuv420p, for which frames with odd dimensions are
+    padded by one pixel."""
+    if filename.endswith(".gif") and palette is not None:
+        output = ["-i", palette, "-lavfi", "[0:v][1:v]paletteuse"]
+    elif filename.endswith(".gif"):
+        output = ["-vf", "split[a][b];[a]palettegen=stats_mode=single[p];[b][p]paletteuse=new=1"]
+    else:
+        output = ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-c:v", "libx264", "-b:v", "{}k".format(bitrate),
+                  "-pix_fmt", "yuv420p"]
+    return subprocess.Popen(
+        [ffmpeg, "-y", "-loglevel", "error",
+         "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", "{}x{}".format(width, height), "-r", str(fps), "-i", "-"]
+        + output + [filename],
+        stdin=subprocess.PIPE)
+
+
+def render(view_class, view_args, frames, filename, fps=24, bitrate=10000, workers=None,
+           chunksize=2, sink=None, format="mp4", palette=None):
+    """Render frames with view_class(*view_args) and encode them to
+    filename. frames is a sequence of tuples of arrays, one tuple per frame,
+    passed to the view's update(), and the video is written to
+    filename.format (e.g. eta.mp4 or eta.gif). With workers > 1 the frames are drawn by
+    that many processes (os.cpu_count() for None) while the encoder runs,
+    with at most 2*workers chunks of chunksize frames in flight. When sink (a binary file object) is given, the raw RGB frames are
+    written to it instead of ffmpeg. palette is the palette image of a GIF
+    (see open_ffmpeg()). Returns the number of frames."""
+    workers = workers or os.cpu_count()
+    tasks = ((num, tuple(np.asarray(field) for field in fields)) for num, fields in enumerate(frames))
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(view_class, view_args))
+        images = _ordered_results(pool, tasks, chunksize, 2*workers)
+    else:
+        pool, view = None, view_class(*view_args)
+        images = (view.render(num, *fields) for num, fields in tasks)
+
+    encoder, n_frames, failed = None, 0, True
+    try:
+        for image in images:
+            if sink is None and encoder is None:
+                encoder = open_ffmpeg("{}.{}".format(filename, format), image.shape[1], image.shape[0], fps, bitrate,
+                                      palette=palette)
+            (sink or encoder.stdin).write(image.data)
+            n_frames += 1
+        failed = False
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if encoder is not None:
+            _finish_encoder(encoder, "{}.{}".format(filename, format), failed)
+    return n_frames
+
+
+def eta_range(eta_list, vmin=None, vmax=None):
+    """The color range (vmin, vmax) of eta_animation, -0.7 and 1 times the
+    largest |eta| of the middle frame of eta_list, for the limits that are
+    None."""
+    if vmin is None or vmax is None:
+        middle = np.abs(eta_list[len(eta_list)//2]).max()
+        vmin = -0.7*middle if vmin is None else vmin
+        vmax = middle if vmax is None else vmax
+    return vmin, vmax
+
+
+class _Frames:
+    """Sequence of tuples (fields[0][i], fields[1][i], ...), read lazily and
+    passed through transform (e.g. a LevelOfDetail) if given."""
+
+    def __init__(self, *fields, transform=None):
+        self.fields = fields
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.fields[0])
+
+    def __getitem__(self, i):
+        if i >= len(self):
+            raise IndexError(i)
+        if self.transform is not None:
+            return tuple(self.transform(field[i]) for field in self.fields)
+        return tuple(field[i] for field in self.fields)
+
+
+def render_eta(X, Y, eta_list, frame_interval, filename, times=None, vmin=None, vmax=None, **kwargs):
+    """Parallel version of viz_tools1.eta_animation; the color range
+    defaults to the one eta_animation uses, and other keyword arguments are
+    passed on to render()."""
+    vmin, vmax = eta_range(eta_list, vmin, vmax)
+    return render(EtaView, (X, Y, vmin, vmax, frame_interval, times),
+                  _Frames(eta_list), filename, **kwargs)
+
+
+def render_velocity(X, Y, u_list, v_list, frame_interval, filename, times=None, resolution=50, **kwargs):
+    """Parallel version of viz_tools1.velocity_animation. The fields are
+    block averaged to resolution in this process, so the workers are sent
+    the small arrays that are drawn rather than the full grid."""
+    lod = LevelOfDetail(X.shape, resolution)
+    return render(VelocityView, (lod(X), lod(Y), frame_interval, times, None),
+                  _Frames(u_list, v_list, transform=lod), filename, **kwargs)
+
+
+def render_eta3D(X, Y, eta_list, frame_interval, filename, times=None, resolution=50, **kwargs):
+    """Parallel version of viz_tools1.eta_animation3D, block averaged like
+    render_velocity()."""
+    lod = LevelOfDetail(X.shape, resolution)
+    return render(SurfaceView, (lod(X), lod(Y), frame_interval, times, (-0.3, 0.7), None),
+                  _Frames(eta_list, transform=lod), filename, **kwargs)
+
+
+def colormap_lut(cmap="RdBu_r", n_colors=256):
+    """(n_colors, 3) uint8 table of the RGB colors of a matplotlib colormap."""
+    import matplotlib
+    cmap = matplotlib.colormaps[cmap] if isinstance(cmap, str) else cmap
+    return np.round(cmap(np.linspace(0, 1, n_colors))[:, :3]*255).astype(np.uint8)
+
+
+class _GlyphText:
+    """Text drawn by pasting pre-rendered glyphs of a monospace font, for the
+    label that changes every frame. Each glyph is rendered once with
+    matplotlib into a cell of the same size."""
+
+    def __init__(self, chars, fontsize=10, dpi=100):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        self.height = int(np.ceil(1.4*fontsize*dpi/72))
+        self.width = int(np.ceil(0.62*fontsize*dpi/72))
+        self.glyphs = {}
+        for char in chars:
+            fig = Figure(figsize=(self.width/dpi, self.height/dpi), dpi=dpi, facecolor="white")
+            canvas = FigureCanvasAgg(fig)
+            fig.text(0.5, 0.5, char, ha="center", va="center", family="monospace", fontsize=fontsize)
+            canvas.draw()
+            self.glyphs[char] = np.asarray(canvas.buffer_rgba())[:, :, :3].copy()
+
+    def draw(self, out, text):
+        """Paste text into out (an RGB array at least len(text) cells wide),
+        clearing the rest of out."""
+        out[:] = 255
+        for k, char in enumerate(text[:out.shape[1]//self.width]):
+            out[:self.height, k*self.width:(k + 1)*self.width] = self.glyphs[char]
+
+
+def _colorbar_panel(height, width, vmin, vmax, cmap, label, dpi=100):
+    """Static side panel with a colorbar, drawn once with matplotlib."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.cm import ScalarMappable
+    from matplotlib.colors import Normalize
+    fig = Figure(figsize=(width/dpi, height/dpi), dpi=dpi, facecolor="white")
+    canvas = FigureCanvasAgg(fig)
+    cax = fig.add_axes([0.15, 0.06, 0.15, 0.76])
+    colorbar = fig.colorbar(ScalarMappable(Normalize(vmin, vmax), cmap), cax=cax)
+    colorbar.ax.tick_params(labelsize=8)
+    colorbar.set_label(label, fontname = "serif", fontsize = 10)
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba())[:, :, :3].copy()
+
+
+class LutEtaFrames:
+    """Frames of eta as RGB images: eta is transposed and flipped so that y
+    points up (as in viz_tools1.eta_animation), mapped through a colormap
+    lookup table between vmin and vmax, and repeated scale times along both
+    axes. With panel, a colorbar and the time "t = ... h" are drawn on the
+    right, labelled as in the matplotlib views. Frames are written into one
+    reused buffer of even width and height; frame(num, eta) returns that
+    buffer. A zero range (vmin == vmax) maps every value to the lowest
+    color and NaN is drawn with the lowest color, as Normalize does."""
+
+    def __init__(self, shape, vmin, vmax, frame_interval, times=None, cmap="RdBu_r", scale=1, panel=True,
+                 panel_width=120, n_colors=256):
+        N_x, N_y = shape
+        self.lut = colormap_lut(cmap, n_colors)
+        self.vmin, self.frame_interval, self.times, self.scale = vmin, frame_interval, times, scale
+        self._factor = (n_colors - 1)/(vmax - vmin) if vmax != vmin else 0.0
+        self._value = np.empty((N_y, N_x), dtype=np.float32)
+        self._index = np.empty((N_y, N_x), dtype=np.intp)
+
+        height, width = N_y*scale, N_x*scale
+        panel_width = panel_width if panel else 0
+        if panel:
+            self._text = _GlyphText("0123456789.-th= ")
+            height = max(height, 4*self._text.height)
+        self.buffer = np.full((height + height % 2, width + panel_width + (width + panel_width) % 2, 3),
+                              255, dtype=np.uint8)
+        self._image = self.buffer[:N_y*scale, :width].reshape(N_y, scale, N_x, scale, 3)
+        self._label = None
+        if panel:
+            text_height = self._text.height
+            self.buffer[text_height:height, width:width + panel_width] = _colorbar_panel(
+                height - text_height, panel_width, vmin, vmax, cmap, "$\\eta$ [m]")
+            self._label = self.buffer[:text_height, width:width + panel_width]
+
+    def frame(self, num, eta):
+        value, index = self._value, self._index
+        np.subtract(np.asarray(eta).T[::-1], self.vmin, out=value)
+        np.multiply(value, self._factor, out=value)
+        np.nan_to_num(value, copy=False, nan=0.0)
+        np.clip(value, 0, len(self.lut) - 1, out=value)
+        np.rint(value, out=value)
+        index[:] = value
+        self._image[:] = self.lut[index][:, None, :, None, :]
+        if self._label is not None:
+            t = self.times[num] if self.times is not None else num*self.frame_interval
+            self._text.draw(self._label, "t = {:.2f} h".format(t/3600))
+        return self.buffer
+
+
+def palette_colors(cmap, n_grays=64):
+    """(256, 3) uint8 palette for GIFs: the colors of the matplotlib
+    colormap cmap and n_grays shades of gray for the text, axes and
+    background of the figure."""
+    grays = np.repeat(np.linspace(0, 255, n_grays).round().astype(np.uint8)[:, None], 3, axis=1)
+    return np.concatenate([colormap_lut(cmap, 256 - n_grays), grays])
+
+
+def write_palette(filename, cmap, n_grays=64):
+    """Write the palette_colors() of cmap as a palette image for GIFs (see
+    open_ffmpeg()) to filename (.png). Built once, it stands in for a
+    palette generated from every frame."""
+    from matplotlib.image import imsave
+    imsave(filename, palette_colors(cmap, n_grays).reshape(16, 16, 3))
+
+
+def render_eta_lut(X, Y, eta_list, frame_interval, filename, times=None, vmin=None, vmax=None, cmap="RdBu_r",
+                   scale=1, panel=True, fps=24, bitrate=10000, sink=None, format="mp4"):
+    """Fast version of viz_tools1.eta_animation (see LutEtaFrames). The
+    color range defaults to the one eta_animation uses. Frames are encoded
+    to filename.format with ffmpeg, or written raw to sink. Returns the
+    number of frames."""
+    vmin, vmax = eta_range(eta_list, vmin, vmax)
+    frames = LutEtaFrames(X.shape, vmin, vmax, frame_interval, times, cmap=cmap, scale=scale, panel=panel)
+    height, width = frames.buffer.shape[:2]
+    encoder = None
+    if sink is None:
+        encoder = open_ffmpeg("{}.{}".format(filename, format), width, height, fps, bitrate)
+        sink = encoder.stdin
+    failed = True
+    try:
+        for num in range(len(eta_list)):
+            sink.write(frames.frame(num, eta_list[num]).data)
+        failed = False
+    finally:
+        if encoder is not None:
+            _finish_encoder(encoder, "{}.{}".format(filename, format), failed)
+    return len(eta_list)
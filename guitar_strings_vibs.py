@@ -1,13 +1,19 @@
-import pygame
-import numpy as np
+"""Vibrating strings, plucked with the mouse (pygame).
+
+All strings live in one (num_strings, n) array, and a time step updates every
+string with a single sliced stencil: the 1D wave equation plus a Hooke's law
+coupling between neighbouring points (k), both proportional to the discrete
+second difference, followed by damping. The end points are only changed by
+damping (and plucking). Strings.step() takes several substeps per rendered
+frame if asked to.
+
+pygame is only imported by the script, so the kernel can be imported (and
+timed, see bench_strings.py) without it."""
 
-# Initialize Pygame
-pygame.init()
+import numpy as np
 
 # Screen dimensions
 width, height = 800, 600
-screen = pygame.display.set_mode((width, height))
-pygame.display.set_caption("1D Wave Simulation")
 
 # Colors
 black = (0, 0, 0)
@@ -20,62 +26,86 @@ dx = 1  # Grid spacing
 dt = 0.1  # Time step
 damping = 0.99  # Damping factor to prevent infinite oscillations
 k = 0.1  # Spring constant (Hooke's law)
-
-# Create the wave grids for each string
 num_strings = 6
-u = [np.zeros(n) for _ in range(num_strings)]  # Current wave amplitude for each string
-u_prev = [np.zeros(n) for _ in range(num_strings)]  # Previous wave amplitude for each string
-u_next = [np.zeros(n) for _ in range(num_strings)]  # Next wave amplitude for each string
-
-# Variables to track mouse interaction
-mouse_held = False
-mouse_pos = (0, 0)
-
-# Simulation loop
-running = True
-while running:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        elif event.type == pygame.MOUSEBUTTONDOWN:
-            mouse_held = True
-        elif event.type == pygame.MOUSEBUTTONUP:
-            mouse_held = False
-
-    # Get mouse position
-    if mouse_held:
-        mouse_x, mouse_y = pygame.mouse.get_pos()
-        string_index = int(mouse_y / (height / num_strings))
-        string_index = max(0, min(num_strings - 1, string_index))  # Clamp to valid range
-        mouse_pos = int(mouse_x / (width / n))
-        u[string_index][mouse_pos] = (mouse_y - height / 2) / 100  # Scale mouse y to wave amplitude
-
-    # Apply the 1D wave equation with Hooke's law to each string
-    for s in range(num_strings):
-        for i in range(1, n - 1):
-            u_next[s][i] = (2 * u[s][i] - u_prev[s][i] +
-                            k * (u[s][i + 1] + u[s][i - 1] - 2 * u[s][i]) +
-                            c ** 2 * dt ** 2 / dx ** 2 *
-                            (u[s][i + 1] + u[s][i - 1] - 2 * u[s][i]))
-
-        # Apply damping
-        u_next[s] *= damping
-
-        # Update the wave grids
-        u_prev[s], u[s], u_next[s] = u[s], u_next[s], u_prev[s]
-
-    # Draw the waves
-    screen.fill(black)
-    for s in range(num_strings):
-        color = colors[s]
-        y_offset = (s + 1) * (height / (num_strings + 1))
-        for i in range(n - 1):
-            x1 = int(i * (width / n))
-            y1 = int(y_offset + u[s][i] * 100)
-            x2 = int((i + 1) * (width / n))
-            y2 = int(y_offset + u[s][i + 1] * 100)
-            pygame.draw.line(screen, color, (x1, y1), (x2, y2), 2)
-
-    pygame.display.flip()
-
-pygame.quit()
+substeps = 1  # Time steps per rendered frame
+
+
+class Strings:
+    """Amplitudes u of num_strings strings of n points, with the previous
+    step in u_prev. The arrays are swapped, not copied, every step."""
+
+    def __init__(self, num_strings=num_strings, n=n, c=c, dx=dx, dt=dt, damping=damping, k=k):
+        self.u = np.zeros((num_strings, n))  # Current wave amplitude for each string
+        self.u_prev = np.zeros((num_strings, n))  # Previous wave amplitude for each string
+        self.u_next = np.zeros((num_strings, n))  # Next wave amplitude for each string
+        self.damping = damping
+        self.coef = k + c ** 2 * dt ** 2 / dx ** 2  # Hooke's law and wave terms of the second difference
+
+    def pluck(self, string, i, amplitude):
+        self.u[string, i] = amplitude
+
+    def step(self, substeps=1):
+        """Apply the 1D wave equation with Hooke's law to every string,
+        substeps times."""
+        for _ in range(substeps):
+            u, inner = self.u[:, 1:-1], self.u_next[:, 1:-1]
+            np.add(self.u[:, 2:], self.u[:, :-2], out=inner)
+            inner -= u
+            inner -= u
+            inner *= self.coef
+            inner += u
+            inner += u
+            inner -= self.u_prev[:, 1:-1]
+            self.u_next *= self.damping
+            self.u_prev, self.u, self.u_next = self.u, self.u_next, self.u_prev
+
+
+def main():
+    import pygame
+
+    # Initialize Pygame
+    pygame.init()
+    screen = pygame.display.set_mode((width, height))
+    pygame.display.set_caption("1D Wave Simulation")
+
+    strings = Strings()
+    x = (np.arange(n) * (width / n)).astype(int)
+
+    # Variables to track mouse interaction
+    mouse_held = False
+
+    # Simulation loop
+    running = True
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                mouse_held = True
+            elif event.type == pygame.MOUSEBUTTONUP:
+                mouse_held = False
+
+        # Get mouse position
+        if mouse_held:
+            mouse_x, mouse_y = pygame.mouse.get_pos()
+            string_index = int(mouse_y / (height / num_strings))
+            string_index = max(0, min(num_strings - 1, string_index))  # Clamp to valid range
+            mouse_pos = int(mouse_x / (width / n))
+            strings.pluck(string_index, mouse_pos, (mouse_y - height / 2) / 100)  # Scale mouse y to wave amplitude
+
+        strings.step(substeps)
+
+        # Draw the waves, one polyline per string
+        screen.fill(black)
+        for s in range(num_strings):
+            y_offset = (s + 1) * (height / (num_strings + 1))
+            y = (y_offset + strings.u[s] * 100).astype(int)
+            pygame.draw.lines(screen, colors[s], False, np.column_stack((x, y)).tolist(), 2)
+
+        pygame.display.flip()
+
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
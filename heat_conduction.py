@@ -0,0 +1,382 @@
+"""Importable engine for heat conduction, dT/dt = alpha*laplacian(T).
+
+The temperature lives on the nodes of a regular grid, with the first and
+last node of every axis on the boundary. Two geometries are supported:
+
+    "cartesian"      1D, 2D or 3D, laplacian(T) = sum of d^2T/dx_k^2
+    "axisymmetric"   2D (r, z) with r = 0 on axis 0, laplacian(T) =
+                     (1/r) d/dr(r dT/dr) + d^2T/dz^2
+
+Steps are taken with one of METHODS:
+
+    "rk4"              classical Runge-Kutta, explicit: dt is limited to about
+                       0.7 h^2/(ndim alpha) by stability
+    "crank-nicolson"   implicit trapezoidal rule, one sparse LU factorization
+                       (scipy) per dt and a triangular solve per step
+    "adi"              Douglas alternating direction implicit: a tridiagonal
+                       solve along every axis per step, pure numpy
+
+The implicit methods are stable for any dt, so steps can be orders of
+magnitude larger than the RK4 limit at fine spacing. They are second order
+in time with the default theta = 0.5; theta = 1 (backward Euler) is first
+order but damps the fastest modes instead of letting them ring, which is
+the better choice for marching to a steady state with huge steps.
+
+Every face of the grid has a Dirichlet (fixed temperature) or Neumann (fixed
+outward gradient, 0 for an insulated face) condition; the r = 0 face of the
+axisymmetric geometry is the symmetry axis and takes none. Cells can also be
+held at their temperature (e.g. a heated rod), see fixed. The laplacian is
+built from differences of neighbouring slices, so nothing wraps around the
+grid, and all arrays are allocated once.
+
+    solver = HeatConduction(T_0, spacing=(dr, dz), alpha=1.172e-5, geometry="axisymmetric",
+                            boundaries=[(None, Neumann(0)), (Dirichlet(25), Dirichlet(25))],
+                            fixed=rod_mask)
+    times, samples = solver.run(2000, dt=0.1, sample_interval=10)
+
+run() stops early at the steady state when given a convergence monitor,
+e.g. ConvergenceMonitor(tolerance=1e-3, check_interval=10) for |dT/dt| below
+1e-3 degrees per second, checked every 10 steps (see convergence.py).
+
+Nothing here imports matplotlib; heat_transfer.py draws the results."""
+
+from dataclasses import dataclass
+import warnings
+import numpy as np
+from convergence import field_norm
+
+GEOMETRIES = ("cartesian", "axisymmetric")
+METHODS = ("rk4", "crank-nicolson", "adi")
+
+
+@dataclass(frozen=True)
+class Dirichlet:
+    """Fixed temperature on a face: a number or an array of the face's shape."""
+    value: object
+
+
+@dataclass(frozen=True)
+class Neumann:
+    """Fixed outward normal gradient dT/dn on a face (a number or an array of
+    the face's shape); 0 for an insulated face."""
+    gradient: object = 0.0
+
+
+def _face(axis, index):
+    """Index of the slice index along axis."""
+    return (slice(None),)*axis + (index,)
+
+
+def _range(axis, start, stop):
+    return (slice(None),)*axis + (slice(start, stop),)
+
+
+class HeatConduction:
+    """Time stepper for heat conduction from the initial temperature T_0.
+    spacing is the node distance (one number, or one per axis) and alpha the
+    thermal diffusivity. boundaries holds a (low, high) pair of Dirichlet or
+    Neumann conditions per axis; missing pairs and None are insulated faces.
+    fixed is a boolean array of the cells kept at their initial temperature.
+    method is one of METHODS; theta weighs the new temperature in the
+    implicit methods: 0.5 for second order, 1 for first order, fully
+    implicit steps that also damp the stiff modes, which a large dt leaves
+    ringing at 0.5 (e.g. to reach a steady state in few steps).
+
+    The current temperature is T at time t after time_step steps."""
+
+    def __init__(self, T_0, spacing, alpha, geometry="cartesian", boundaries=None, fixed=None,
+                 method="rk4", theta=0.5):
+        if geometry not in GEOMETRIES:
+            raise ValueError("Unknown geometry '{}'".format(geometry))
+        if method not in METHODS:
+            raise ValueError("Unknown method '{}'".format(method))
+        self.T = np.array(T_0, dtype=float)
+        self.shape, ndim = self.T.shape, self.T.ndim
+        if geometry == "axisymmetric" and ndim != 2:
+            raise ValueError("The axisymmetric geometry needs a 2D (r, z) grid")
+        if min(self.shape) < 3:
+            raise ValueError("Every axis needs at least 3 nodes")
+        self.geometry = geometry
+        self.spacing = tuple(np.broadcast_to(np.asarray(spacing, dtype=float), (ndim,)))
+        self.alpha = alpha
+        self.method = method
+        self.theta = theta
+        self.t = 0.0
+        self.time_step = 0
+
+        boundaries = list(boundaries or [])
+        boundaries += [(None, None)]*(ndim - len(boundaries))
+        if geometry == "axisymmetric":
+            if boundaries[0][0] is not None:
+                raise ValueError("The r = 0 face is the symmetry axis and takes no boundary condition")
+        self.boundaries = [tuple(Neumann(0.0) if bc is None else bc for bc in pair) for pair in boundaries]
+
+        # Dirichlet faces are fixed cells with the temperature of the face.
+        self.fixed = np.zeros(self.shape, dtype=bool) if fixed is None else np.array(fixed, dtype=bool)
+        for axis, pair in enumerate(self.boundaries):
+            for index, bc in zip((0, -1), pair):
+                if isinstance(bc, Dirichlet):
+                    self.T[_face(axis, index)] = bc.value
+                    self.fixed[_face(axis, index)] = True
+                elif not isinstance(bc, Neumann):
+                    raise ValueError("Boundary conditions are Dirichlet, Neumann or None, not {!r}".format(bc))
+        self._fixed_index = np.flatnonzero(self.fixed)
+
+        # Scratch: differences and their differences along every axis, RK4 stages.
+        self._diff = [np.empty(self.shape[:a] + (n - 1,) + self.shape[a+1:]) for a, n in enumerate(self.shape)]
+        self._diff2 = [np.empty(self.shape[:a] + (n - 2,) + self.shape[a+1:]) for a, n in enumerate(self.shape)]
+        self._k = [np.empty(self.shape) for _ in range(max(4, ndim))]
+        self._stage = np.empty(self.shape)
+        if geometry == "axisymmetric":
+            # Weights of the fluxes through r_i +- h/2 in (1/r) d/dr(r dT/dr) at node i.
+            h2, i = self.spacing[0]**2, np.arange(1, self.shape[0])[:, None]
+            self._w_out, self._w_in = (1 + 1/(2*i))/h2, (1 - 1/(2*i))/h2
+        self._coefficients = self._source = None     # For the implicit methods
+        self._factors = (None, None)    # ((method, theta, dt), factorization) of the implicit method
+
+    def laplacian(self, T, out=None):
+        """Discrete laplacian of T, with the Neumann faces from a mirrored
+        ghost node. The values on Dirichlet faces are meaningless (the faces
+        do not change). Written to out if given."""
+        return self._operator(T, np.empty(self.shape) if out is None else out, 1.0)
+
+    def rate(self, T, out=None):
+        """dT/dt for the temperature T: zero on fixed cells."""
+        out = self._operator(T, np.empty(self.shape) if out is None else out, self.alpha)
+        out.reshape(-1)[self._fixed_index] = 0
+        return out
+
+    def _operator(self, T, out, scale):
+        """scale*laplacian(T) in out. The first axis assigns to out and the
+        others add to it, and scale is folded into the coefficients, to save
+        passes over the arrays."""
+        for axis, (h, (low, high)) in enumerate(zip(self.spacing, self.boundaries)):
+            d, dd, c = self._diff[axis], self._diff2[axis], scale/h**2
+            np.subtract(T[_range(axis, 1, None)], T[_range(axis, None, -1)], out=d)
+            inner, first, last = _range(axis, 1, -1), _face(axis, 0), _face(axis, -1)
+            if axis == 0 and self.geometry == "axisymmetric":
+                w_out, w_in = scale*self._w_out, scale*self._w_in
+                np.multiply(w_out[:-1], d[_range(0, 1, None)], out=out[inner])
+                out[inner] -= w_in[:-1]*d[_range(0, None, -1)]
+                out[first] = 4*c*d[first]   # 2 d^2T/dr^2 on the axis
+                out[last] = 0
+                if isinstance(high, Neumann):
+                    out[last] = w_out[-1]*(2*h*np.asarray(high.gradient) - d[last]) - w_in[-1]*d[last]
+                continue
+            target = out[inner] if axis == 0 else dd
+            np.subtract(d[_range(axis, 1, None)], d[_range(axis, None, -1)], out=target)
+            target *= c
+            if axis == 0:
+                out[first], out[last] = 0, 0
+            else:
+                out[inner] += dd
+            if isinstance(low, Neumann):
+                out[first] += 2*c*(d[first] + h*np.asarray(low.gradient))
+            if isinstance(high, Neumann):
+                out[last] += 2*c*(h*np.asarray(high.gradient) - d[last])
+        return out
+
+    def step(self, dt):
+        """Advance T by dt with the method of the solver. The first step of
+        an implicit method is taken as two fully implicit half steps
+        (Rannacher's start), which damp the stiff modes of a discontinuous
+        initial temperature, such as the heated rod, instead of leaving them
+        to ring for many steps with theta = 0.5."""
+        if self.method == "rk4":
+            self._rk4(dt)
+        elif self.time_step == 0 and self.theta < 1:
+            theta, self.theta = self.theta, 1.0
+            for _ in range(2):
+                self._implicit(dt/2)
+            self.theta = theta
+        else:
+            self._implicit(dt)
+        self.t += dt
+        self.time_step += 1
+
+    def _rk4(self, dt):
+        T, stage, (k_1, k_2, k_3, k_4) = self.T, self._stage, self._k
+        self.rate(T, k_1)
+        np.multiply(k_1, dt/2, out=stage)
+        stage += T
+        self.rate(stage, k_2)
+        np.multiply(k_2, dt/2, out=stage)
+        stage += T
+        self.rate(stage, k_3)
+        np.multiply(k_3, dt, out=stage)
+        stage += T
+        self.rate(stage, k_4)
+        k_2 += k_3
+        k_2 *= 2
+        k_1 += k_4
+        k_1 += k_2
+        k_1 *= dt/6
+        T += k_1
+
+    def residual(self, norm="max"):
+        """The norm (see convergence.field_norm) of dT/dt at the current
+        temperature; zero at the steady state."""
+        return field_norm(self.rate(self.T, self._k[-1]), norm)
+
+    def samples(self, n_steps, dt, sample_interval=1, monitor=None):
+        """Take n_steps steps of dt and yield the time and temperature (T
+        itself, which the next step overwrites) of the initial state and of
+        every sample_interval-th step. With a convergence.ConvergenceMonitor,
+        residual() is checked after the steps and the run stops early once it
+        converges; the last sample is then the converged state."""
+        yield self.t, self.T
+        for step in range(1, n_steps + 1):
+            self.step(dt)
+            converged = monitor is not None and monitor.update(self.residual)
+            if step % sample_interval == 0 or converged:
+                yield self.t, self.T
+            if converged:
+                return
+
+    def run(self, n_steps, dt, sample_interval=1, monitor=None):
+        """samples() as arrays of shape (n_samples,) and (n_samples,) +
+        T.shape."""
+        n_samples = n_steps//sample_interval + 2
+        times, samples = np.empty(n_samples), np.empty((n_samples,) + self.shape)
+        for n, (t, T) in enumerate(self.samples(n_steps, dt, sample_interval, monitor)):
+            times[n], samples[n] = t, T
+        return times[:n + 1], samples[:n + 1]
+
+    # ============================= Implicit methods ==============================
+    # rate(T) is affine in T: the sum over the axes of tridiagonal operators
+    # A_k along axis k, plus a source from the Neumann gradients, all zero on
+    # the fixed cells. The implicit methods solve with I - theta dt A (Crank-
+    # Nicolson for theta = 0.5) or with I - theta dt A_k along every axis in
+    # turn (ADI).
+
+    @property
+    def coefficients(self):
+        """Per axis, the (lower, diag, upper) coefficients of A_k at every
+        node: the weights of the nodes i-1, i and i+1 along axis k in
+        rate(T). Arrays of the grid's shape."""
+        if self._coefficients is None:
+            free = ~self.fixed
+            self._coefficients = []
+            for axis, (h, (low, high)) in enumerate(zip(self.spacing, self.boundaries)):
+                n, c = self.shape[axis], self.alpha/h**2
+                lower, diag, upper = np.full(n, c), np.full(n, -2*c), np.full(n, c)
+                if axis == 0 and self.geometry == "axisymmetric":
+                    lower[1:], upper[1:] = self.alpha*self._w_in[:, 0], self.alpha*self._w_out[:, 0]
+                    upper[0], diag[0] = 4*c, -4*c
+                    lower[-1] = upper[-1] + lower[-1]
+                else:
+                    upper[0] = lower[-1] = 2*c
+                diag[1:] = -(lower[1:] + upper[1:])
+                diag[-1] = -lower[-1]
+                lower[0] = upper[-1] = 0
+                along = (n,) + (1,)*(len(self.shape) - axis - 1)
+                self._coefficients.append(tuple(free*coef.reshape(along) for coef in (lower, diag, upper)))
+        return self._coefficients
+
+    @property
+    def source(self):
+        """The part of rate(T) that does not depend on T (Neumann gradients)."""
+        if self._source is None:
+            self._source = self.rate(np.zeros(self.shape))
+        return self._source
+
+    def matrix(self):
+        """rate(T) as a sparse matrix A of the flattened grid (C order), so
+        that rate(T) = A @ T.ravel() + source.ravel(). Needs scipy."""
+        from scipy import sparse
+        size = self.T.size
+        matrix = sparse.csr_matrix((size, size))
+        for axis, (lower, diag, upper) in enumerate(self.coefficients):
+            stride = int(np.prod(self.shape[axis + 1:]))
+            matrix += sparse.diags([lower.ravel()[stride:], diag.ravel(), upper.ravel()[:-stride]],
+                                   [-stride, 0, stride], shape=(size, size), format="csr")
+        return matrix
+
+    def _apply(self, axis, T, out):
+        """A_k T, without the source, to out."""
+        lower, diag, upper = self.coefficients[axis]
+        np.multiply(diag, T, out=out)
+        out[_range(axis, 1, None)] += lower[_range(axis, 1, None)]*T[_range(axis, None, -1)]
+        out[_range(axis, None, -1)] += upper[_range(axis, None, -1)]*T[_range(axis, 1, None)]
+        return out
+
+    def _factorization(self, dt):
+        """The factorization of the implicit method for dt, cached for the last dt."""
+        key = (self.method, self.theta, dt)
+        if self._factors[0] == key:
+            return self._factors[1]
+        if self.method == "crank-nicolson":
+            from scipy import sparse
+            from scipy.sparse.linalg import splu
+            A, identity = self.matrix(), sparse.identity(self.T.size, format="csr")
+            factors = (identity + (1 - self.theta)*dt*A,
+                       splu((identity - self.theta*dt*A).tocsc(), permc_spec="MMD_AT_PLUS_A"),
+                       dt*self.source.ravel())
+        else:
+            factors = [_thomas_factors(*(np.moveaxis(coef, axis, 0) for coef in coefs), self.theta*dt)
+                       for axis, coefs in enumerate(self.coefficients)]
+        self._factors = (key, factors)
+        return factors
+
+    def _implicit(self, dt):
+        if self.method == "crank-nicolson":
+            self._crank_nicolson(dt)
+        else:
+            self._adi(dt)
+
+    def _crank_nicolson(self, dt):
+        try:
+            explicit, lu, source = self._factorization(dt)
+        except ImportError:
+            warnings.warn("scipy is not available, falling back to ADI")
+            self.method = "adi"
+            return self._adi(dt)
+        self.T[...] = lu.solve(explicit @ self.T.ravel() + source).reshape(self.shape)
+
+    def _adi(self, dt):
+        """Douglas' scheme: with A = sum of A_k and the source b,
+
+            (I - theta dt A_1) v_1 = (I + (1 - theta) dt A_1 + dt sum_{k>1} A_k) T + dt b
+            (I - theta dt A_k) v_k = v_{k-1} - theta dt A_k T,    k > 1
+
+        and v_ndim is the new T."""
+        factors, T, v = self._factorization(dt), self.T, self._stage
+        applied = [self._apply(axis, T, out) for axis, out in enumerate(self._k[:T.ndim])]
+        np.multiply(self.source, dt, out=v)
+        v += T
+        for axis, A_T in enumerate(applied):
+            v += ((1 - self.theta)*dt if axis == 0 else dt)*A_T
+        _thomas_solve(*factors[0], v)
+        for axis in range(1, T.ndim):
+            v -= self.theta*dt*applied[axis]
+            _thomas_solve(*factors[axis], np.moveaxis(v, axis, 0))
+        T[...] = v
+
+
+def _thomas_factors(lower, diag, upper, scale):
+    """Forward elimination of the Thomas algorithm for the tridiagonal systems
+    I - scale*A along axis 0, with the coefficients of A at every node:
+    returns the sub-diagonal, the eliminated super-diagonal and the inverse
+    pivots for _thomas_solve."""
+    a, b, c = -scale*lower, 1 - scale*diag, -scale*upper
+    c_prime, inverse = np.empty_like(b), np.empty_like(b)
+    inverse[0] = 1/b[0]
+    c_prime[0] = c[0]*inverse[0]
+    for i in range(1, len(b)):
+        inverse[i] = 1/(b[i] - a[i]*c_prime[i-1])
+        c_prime[i] = c[i]*inverse[i]
+    return a, c_prime, inverse
+
+
+def _thomas_solve(a, c_prime, inverse, d):
+    """Solve the systems of _thomas_factors for the right hand sides d (in
+    place), all lines along axis 0 at once."""
+    scratch = np.empty_like(d[0])
+    d[0] *= inverse[0]
+    for i in range(1, len(d)):
+        np.multiply(a[i], d[i-1], out=scratch)
+        d[i] -= scratch
+        d[i] *= inverse[i]
+    for i in range(len(d) - 2, -1, -1):
+        np.multiply(c_prime[i], d[i+1], out=scratch)
+        d[i] -= scratch
@@ -1,10 +1,30 @@
-import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
+"""Heat conduction in a steel cylinder with a heated rod along its axis.
+
+The simulation runs once: every frame_every-th time step (and the initial
+state) is kept as a frame, in memory or streamed to a snapshot store. The
+frames are then encoded by a streaming writer (frame_renderer's ffmpeg pipe,
+one frame in memory at a time) and played back in a window, so the cost of
+the export grows with the number of frames rather than solver steps and the
+solver never runs twice. Videos other than GIFs need ffmpeg; without it a GIF
+is written with pillow, as the original script did.
+
+    python heat_transfer.py                                  # heat_transfer.gif, then show
+    python heat_transfer.py --frame-every 10 --output heat_transfer.mp4 --no-show
+    python heat_transfer.py --store heat_frames --output none
+
+The module only defines the setup (the constants below, simulate() and
+CylinderView) when imported."""
 
-# Ensure the correct backend is used
-import matplotlib
-matplotlib.use('TkAgg')  # Use 'Agg' for headless environments
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import numpy as np
+import frame_renderer
+from heat_conduction import HeatConduction, Dirichlet, Neumann
+from convergence import ConvergenceMonitor
+from snapshot_store import SnapshotWriter, SnapshotReader
 
 # Constants
 alpha = 1.172e-5  # Thermal diffusivity of steel (m^2/s)
@@ -12,60 +32,157 @@ R = 0.10  # Radius in meters
 L = 0.50  # Length of the cylinder in meters
 T_center = 1000  # Temperature at the center in °C
 T_ends = 25  # Temperature at the ends in °C
+T_surface = None  # Temperature of the curved surface in °C (None for an insulated surface)
 dx = 0.005  # Spatial step in meters
 dt = 0.1  # Time step in seconds
-time_steps = 2000  # Number of time steps for the simulation
+method = "rk4"  # "rk4", "crank-nicolson" or "adi"; the implicit methods are stable for any dt, see heat_conduction.py
+time_steps = 2000  # Maximum number of time steps for the simulation
+tolerance = 1e-3  # Steady state: largest rate of temperature change in °C/s
+check_interval = 10  # Time steps between checks of the steady state
 
-# Discretization
+# Discretization: r along axis 0 (r = 0 is the axis of the cylinder), z along axis 1
 nx = int(R / dx) + 1
 ny = int(L / dx) + 1
 x = np.linspace(0, R, nx)
 y = np.linspace(0, L, ny)
 
-# Initial temperature distribution
-T = np.full((nx, ny), T_ends)
-T[int(nx / 2), :] = T_center  # Middle of the cylinder is kept at 1000°C
-
-# Update temperature function using Runge-Kutta method
-def update_temperature(T, alpha, dx, dt):
-    T_new = T.copy()
-    
-    def dTdt(T):
-        d2T_dx2 = (np.roll(T, -1, axis=0) - 2 * T + np.roll(T, 1, axis=0)) / dx**2
-        d2T_dy2 = (np.roll(T, -1, axis=1) - 2 * T + np.roll(T, 1, axis=1)) / dx**2
-        dTdt = alpha * (d2T_dx2 + d2T_dy2)
-        return dTdt
-    
-    k1 = dTdt(T)
-    k2 = dTdt(T + 0.5 * dt * k1)
-    k3 = dTdt(T + 0.5 * dt * k2)
-    k4 = dTdt(T + dt * k3)
-    
-    T_new = T_new + (dt / 6) * (k1 + 2*k2 + 2*k3 + k4)
-    
-    # Enforce boundary conditions (middle stays at 1000°C)
-    T_new[int(nx / 2), :] = T_center
-    
-    return T_new
-
-# Set up the figure and axis
-fig, ax = plt.subplots()
-cax = ax.imshow(T, cmap='hot', interpolation='nearest', origin='lower', extent=[0, R, 0, L])
-fig.colorbar(cax, ax=ax, label='Temperature (°C)')
-ax.set_title('Heat Transfer in a Steel Cylinder')
-ax.set_xlabel('Radius (m)')
-ax.set_ylabel('Length (m)')
-
-# Animation update function
-def animate(frame):
-    global T
-    T = update_temperature(T, alpha, dx, dt)
-    cax.set_array(T)
-    return [cax]
-
-# Create animation
-ani = animation.FuncAnimation(fig, animate, frames=time_steps, interval=20, blit=True)
-
-ani.save(filename="heat_transfer.gif", writer='pillow', fps=60)
-# Show the animation
-plt.show()
+
+def cylinder():
+    """The solver for the cylinder, at its initial temperature."""
+    T = np.full((nx, ny), T_ends, dtype=float)
+    center = np.zeros((nx, ny), dtype=bool)
+    center[0, :] = True
+    T[center] = T_center  # Middle of the cylinder (its axis) is kept at 1000°C
+
+    # Conduction in the (r, z) plane of the cylinder, see heat_conduction.py
+    surface = Neumann(0) if T_surface is None else Dirichlet(T_surface)
+    return HeatConduction(T, spacing=(x[1] - x[0], y[1] - y[0]), alpha=alpha, geometry="axisymmetric",
+                          boundaries=[(None, surface), (Dirichlet(T_ends), Dirichlet(T_ends))],
+                          fixed=center, method=method)
+
+
+def simulate(steps=time_steps, frame_every=1, monitor=None, store=None):
+    """Run the cylinder for steps time steps (fewer if monitor converges) and
+    return the times and temperatures of the frames: the initial state and
+    every frame_every-th step. The frames are arrays in memory, or with store
+    (a directory) a snapshot store written while the solver runs and read
+    back memory-mapped."""
+    solver = cylinder()
+    if store is None:
+        return solver.run(steps, dt, frame_every, monitor)
+    with SnapshotWriter(store, solver.shape, fields=("T",), frame_interval=frame_every*dt, x=x, y=y) as writer:
+        for t, T in solver.samples(steps, dt, frame_every, monitor):
+            writer.append(t, T=T)
+    reader = SnapshotReader(store)
+    return reader.times, reader["T"]
+
+
+def _draw_axes(fig, ax):
+    """The temperature image with its colorbar and labels; returns the image."""
+    image = ax.imshow(np.full((ny, nx), T_ends), cmap='hot', interpolation='nearest', origin='lower',
+                      extent=[0, R, 0, L], vmin=T_ends, vmax=T_center)
+    fig.colorbar(image, ax=ax, label='Temperature (°C)')
+    ax.set_xlabel('Radius (m)')
+    ax.set_ylabel('Length (m)')
+    return image
+
+
+class CylinderView(frame_renderer.View):
+    """Off-screen frames of the temperature for frame_renderer.render(), the
+    same figure as the window of the script. times is the time of every
+    frame."""
+
+    def __init__(self, times, figsize=(6.4, 4.8), dpi=100):
+        super().__init__(figsize, dpi, None, times)
+        self.ax = self.fig.add_subplot()
+        self.image = _draw_axes(self.fig, self.ax)
+
+    def update(self, num, T):
+        self.image.set_array(T.T)
+        self.ax.set_title('Heat Transfer in a Steel Cylinder, t = {:.1f} s'.format(self.times[num]))
+
+
+def export(times, frames, output, fps=60, workers=1, raw=None):
+    """Encode the frames to output (the format from its extension, e.g. .gif
+    or .mp4) with ffmpeg, or write the raw RGB frames to the file raw. A GIF
+    is mapped to a fixed palette of the 'hot' colormap, so it is encoded one
+    frame at a time; without ffmpeg it is written by pillow, like the
+    original script did. Other formats need ffmpeg. Returns the number of
+    frames."""
+    filename, extension = os.path.splitext(output)
+    frame_tuples = ((T,) for T in frames)
+    if raw is None and extension == ".gif" and shutil.which("ffmpeg") is None:
+        return _export_pillow(times, frames, output, fps)
+    if raw is not None:
+        with open(raw, "wb") as sink:
+            return frame_renderer.render(CylinderView, (times,), frame_tuples, filename, fps=fps,
+                                         workers=workers, sink=sink)
+    with tempfile.TemporaryDirectory() as directory:
+        palette = None
+        if extension == ".gif":
+            palette = os.path.join(directory, "palette.png")
+            frame_renderer.write_palette(palette, "hot")
+        return frame_renderer.render(CylinderView, (times,), frame_tuples, filename, fps=fps, workers=workers,
+                                     format=extension.lstrip("."), palette=palette)
+
+
+def _export_pillow(times, frames, output, fps):
+    """Write the frames to the GIF output with pillow, drawn in this process
+    and quantized to the palette of export(). Pillow keeps every (one byte
+    per pixel) frame until the file is written."""
+    from PIL import Image
+    palette = Image.new("P", (1, 1))
+    palette.putpalette(frame_renderer.palette_colors("hot").ravel().tolist())
+    view = CylinderView(times)
+    images = (Image.fromarray(view.render(num, T)).quantize(palette=palette) for num, T in enumerate(frames))
+    first = next(images)
+    first.save(output, save_all=True, append_images=images, duration=1000/fps, loop=0)
+    return len(frames)
+
+
+def show(times, frames, interval=20):
+    """Play the stored frames back in a window."""
+    import matplotlib.pyplot as plt
+    import matplotlib.animation as animation
+
+    fig, ax = plt.subplots()
+    image = _draw_axes(fig, ax)
+    ax.set_title('Heat Transfer in a Steel Cylinder')
+
+    def animate(frame):
+        image.set_array(frames[frame].T)
+        return [image]
+
+    ani = animation.FuncAnimation(fig, animate, frames=len(frames), interval=interval, blit=True)
+    plt.show()
+    return ani
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--steps", type=int, default=time_steps, help="maximum number of time steps")
+    parser.add_argument("--frame-every", type=int, default=1, help="time steps per stored and exported frame")
+    parser.add_argument("--store", help="stream the frames to this snapshot store directory instead of memory")
+    parser.add_argument("--output", default="heat_transfer.gif", help="video file, or 'none' for no export")
+    parser.add_argument("--fps", type=int, default=60)
+    parser.add_argument("--workers", type=int, default=1, help="processes drawing the frames")
+    parser.add_argument("--raw", metavar="FILE", help="write the raw RGB frames to FILE instead of ffmpeg")
+    parser.add_argument("--no-show", action="store_true", help="do not play the frames back in a window")
+    args = parser.parse_args()
+    export_video = args.raw is not None or args.output != "none"
+    if export_video and args.raw is None and not args.output.endswith(".gif") and shutil.which("ffmpeg") is None:
+        sys.exit("ffmpeg not found, needed for {} (write a .gif or raw frames with --raw)".format(args.output))
+
+    monitor = ConvergenceMonitor(tolerance, check_interval)
+    times, frames = simulate(args.steps, args.frame_every, monitor, args.store)
+    print(monitor.report())
+    print("{} frames up to t = {:.1f} s".format(len(frames), times[-1]))
+
+    if export_video:
+        export(times, frames, args.output, args.fps, args.workers, args.raw)
+    if not args.no_show:
+        show(times, frames)
+
+
+if __name__ == "__main__":
+    main()
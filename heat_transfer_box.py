@@ -1,35 +1,68 @@
+"""Steady-state temperature in a block of material with a hot insert.
+
+The temperature solves Laplace's equation on the left half of the block (the
+right half is its mirror image, see get_full_mesh). create_mesh builds the
+half-domain with its fixed boundary values, and mask marks the cells that are
+solved for. relax() iterates on the mesh with whole-array operations:
+
+    mesh, mask = create_mesh(resolution, init_temp)
+    mesh, iterations = solve(mesh, mask, method="sor")
+
+method is "jacobi" (every cell from the previous sweep), "gauss-seidel"
+(red-black ordering: the cells of one color from the latest values of the
+other), "sor" (red-black Gauss-Seidel with over-relaxation) or "multigrid".
+The last column is next to the mirror plane, so its missing right neighbour
+is a ghost column that mirrors the mesh as get_full_mesh does.
+
+Relaxation needs a number of sweeps that grows with the square of the
+resolution (SOR: linearly). Multigrid (see Multigrid) removes the smooth part
+of the error on coarser grids and converges in a handful of V-cycles at any
+resolution. solve() with method="direct" solves the linear system exactly
+with a sparse LU factorization (scipy); to solve many boundary temperatures
+on the same geometry, factorize once and reuse it:
+
+    solver = DirectSolver(mask)
+    for temp in (150, 212, 300):
+        mesh, _ = create_mesh(resolution, init_temp, insert_temp=temp)
+        solver.solve(mesh)
+
+Run as a script to watch the relaxation; bench_heat_box.py times the methods
+across resolutions. solve() stops on a convergence.ConvergenceMonitor, which
+can check the temperature change every few sweeps only."""
+
+import itertools
 import math
+import warnings
 import numpy as np
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
+from convergence import ConvergenceMonitor
 
-init_temp = 90  # initial temperature inside the material 
+init_temp = 90  # initial temperature inside the material
 resolution = 13  # number of cells in the simulation per inch of the material
 threshold = 10  # sum of temperature differences between iterations for the simulation to end
 
 
-def create_mesh(resolution: int, init_temp: float) -> np.array:
+def create_mesh(resolution: int, init_temp: float, top_temp: float = 100, bottom_temp: float = 32,
+                side_temp: float = 32, insert_temp: float = 212) -> np.array:
     mesh = np.pad(
         np.ones((9*resolution, math.ceil(4.5*resolution))) * init_temp,
         ((1, 1), (1, 0)),
-        constant_values=((100, 32), (32, 0))
+        constant_values=((top_temp, bottom_temp), (side_temp, 0))
         )
     mask = np.pad(
-        np.ones((9*resolution, math.ceil(4.5*resolution))) * init_temp,
+        np.ones((9*resolution, math.ceil(4.5*resolution))),
         ((1, 1), (1, 0)),
         constant_values=((0, 0), (0, 0))
-        )   
-    mesh[:(5*resolution+1), 0] = np.arange(100, 32, (32-100)/(5*resolution+1))[:5*resolution+1]
-    mesh[(3*resolution+1):(6*resolution+1), (3*resolution+1):] = 212
+        )
+    mesh[:(5*resolution+1), 0] = np.linspace(top_temp, side_temp, 5*resolution+2)[:5*resolution+1]
+    mesh[(3*resolution+1):(6*resolution+1), (3*resolution+1):] = insert_temp
     mask[(3*resolution+1):(6*resolution+1), (3*resolution+1):] = 0
     return mesh, mask
 
 
 def laplace_eq(m: np.array, i: int, j: int) -> float:
-    if mesh.shape[0] % 2 == 0 and j == (m.shape[1]-1):
+    if m.shape[0] % 2 == 0 and j == (m.shape[1]-1):
         return (m[i-1, j] + m[i+1, j] + m[i, j-1] + m[i, j])/4
-    elif mesh.shape[0] % 2 != 0 and j == (m.shape[1]-1):
+    elif m.shape[0] % 2 != 0 and j == (m.shape[1]-1):
         return (m[i-1, j] + m[i+1, j] + m[i, j-1] + m[i, j-1])/4
     else:
         return (m[i-1, j] + m[i+1, j] + m[i, j-1] + m[i, j+1])/4
@@ -42,43 +75,363 @@ def get_full_mesh(mesh: np.array) -> np.array:
         return np.concatenate((mesh, np.flip(mesh[:, :-1], axis=1)), axis=1)
 
 
-mesh, mask = create_mesh(resolution, init_temp)
-new_mesh = mesh
-iter = 0
-
-# mpl.rcParams['toolbar'] = 'None'
-fig = plt.figure("Exercise 2: Simulating and visualising temperature distribution in a material")
-fig.suptitle('Temperature Distribution in a Material', fontsize=14)
-plt.xlim(0., 9.)
-plt.ylim(0., 9.)
-plt.xlabel('Horizontal distance [in]')
-plt.ylabel('Vertical distance [in]')
-im = plt.imshow(get_full_mesh(mesh), extent=[0,9,0,9], animated=True, cmap='magma')
-cbar = plt.colorbar()
-cbar.set_label('Temperature [ºF]')
-
-
-def update_fig(*args):
-    global mesh, new_mesh, mask, temp_diff, iter
-    temp_diff = 0
-    iter += 1
-    for i, j in np.ndindex(mesh.shape):
-        if mask[i, j]:
-            new_val = laplace_eq(mesh, i, j)
-            temp_diff += abs(new_val - mesh[i, j])
-            new_mesh[i, j] = new_val
-    
-    mesh = new_mesh
-    if iter in [1, 10] or iter % 100 == 0:
-        print(f'Iteration: {iter}\nTemperature difference: {temp_diff:.1f}')
-    if temp_diff < threshold:
-        print(f'Iteration: {iter}\nTemperature difference: {temp_diff:.1f}')
-        plt.close()
-    else:
-        im.set_array(get_full_mesh(mesh))
-    
-    return im,
+def sor_omega(mesh: np.array) -> float:
+    """Over-relaxation factor that is optimal for Laplace's equation on a
+    rectangle the size of mesh."""
+    n = max(mesh.shape)
+    return 2/(1 + math.sin(math.pi/n))
+
+
+def _with_ghost(mesh: np.array) -> np.array:
+    """Copy of mesh with a ghost column appended on the mirror side."""
+    m = np.empty((mesh.shape[0], mesh.shape[1] + 1))
+    m[:, :-1] = mesh
+    _update_ghost(m)
+    return m
+
+
+def _update_ghost(m: np.array):
+    # Same mirror as get_full_mesh and laplace_eq: the mirror plane lies
+    # beyond the last column (even rows) or through it (odd rows).
+    m[:, -1] = m[:, -2] if m.shape[0] % 2 == 0 else m[:, -3]
+
+
+def relax(mesh: np.array, mask: np.array, method: str = "sor", omega: float = None,
+          check_interval: int = 1):
+    """Iterate on mesh, which is updated in place, and yield the sum of the
+    absolute temperature changes after every sweep (of all cells); sweeps
+    between every check_interval-th skip that sum and yield None. For
+    "multigrid" every step is a V-cycle, and the change yielded is that of
+    a Jacobi sweep on the result, the same measure of convergence. Never
+    stops by itself; see solve()."""
+    if method == "multigrid":
+        yield from Multigrid(mask).cycles(mesh)
+        return
+    if method not in ("jacobi", "gauss-seidel", "sor"):
+        raise ValueError("Unknown method '{}'".format(method))
+    m = _with_ghost(mesh)
+    inner = m[1:-1, 1:-1]      # All cells but the fixed first column, rows and ghost
+    fixed = ~mask[1:-1, 1:].astype(bool)
+    interior = mesh[1:-1, 1:]
+    if method == "jacobi":
+        new = np.empty_like(inner)
+        for sweep in itertools.count(1):
+            np.add(m[:-2, 1:-1], m[2:, 1:-1], out=new)
+            new += m[1:-1, :-2]
+            new += m[1:-1, 2:]
+            new *= 0.25
+            np.copyto(new, inner, where=fixed)
+            temp_diff = np.abs(new - inner).sum() if sweep % check_interval == 0 else None
+            inner[...] = new
+            _update_ghost(m)
+            interior[...] = inner
+            yield temp_diff
+
+    omega = 1.0 if method == "gauss-seidel" else (omega or sor_omega(mesh))
+    # Cells (i, j) of color (i + j) % 2, as strided views of m: for each
+    # parity of the row, every other column starting at the right one.
+    n_i, n_j = mesh.shape
+    colors = []
+    for color in (0, 1):
+        views = []
+        for i_0 in (1, 2):
+            j_0 = 1 + (color - i_0 - 1) % 2
+            rows, cols = slice(i_0, n_i - 1, 2), slice(j_0, n_j, 2)
+            up, down = slice(i_0 - 1, n_i - 2, 2), slice(i_0 + 1, n_i, 2)
+            left, right = slice(j_0 - 1, n_j - 1, 2), slice(j_0 + 1, n_j + 1, 2)
+            views.append((m[rows, cols], m[up, cols], m[down, cols], m[rows, left], m[rows, right],
+                          omega*mask[rows, cols]))
+        colors.append(views)
+    for sweep in itertools.count(1):
+        check = sweep % check_interval == 0
+        temp_diff = 0.0 if check else None
+        for views in colors:
+            for centre, up, down, left, right, weight in views:
+                change = up + down
+                change += left
+                change += right
+                change *= 0.25
+                change -= centre
+                change *= weight
+                centre += change
+                if check:
+                    temp_diff += np.abs(change).sum()
+            _update_ghost(m)
+        interior[...] = inner
+        yield temp_diff
+
+
+def solve(mesh: np.array, mask: np.array, method: str = "sor", omega: float = None,
+          threshold: float = threshold, max_iter: int = 1000000, monitor: ConvergenceMonitor = None):
+    """Relax mesh (in place) until the sum of the temperature changes in a
+    sweep drops below threshold. Returns the mesh and the number of sweeps
+    (V-cycles for multigrid, 1 for the direct solver). A monitor replaces
+    threshold with its tolerance, checks every check_interval-th sweep only
+    and keeps the history of the temperature changes."""
+    if method == "direct":
+        try:
+            return DirectSolver(mask).solve(mesh), 1
+        except ImportError:
+            warnings.warn("scipy is not available, falling back to multigrid")
+            method = "multigrid"
+    monitor = monitor or ConvergenceMonitor(threshold)
+    for iteration, temp_diff in enumerate(relax(mesh, mask, method, omega, monitor.check_interval), 1):
+        if monitor.update(temp_diff):
+            return mesh, iteration
+        if iteration == max_iter:
+            raise RuntimeError("No convergence: " + monitor.report())
+
+
+# ================================= Multigrid =====================================
+# Operators are 3 x 3 stencils with a coefficient array per neighbour offset,
+# on grids of 2^levels*c + 1 points per axis so that every coarse point is a
+# fine one: coarse point (I, J) is fine point (2I, 2J).
+_OFFSETS = [(di, dj) for di in (-1, 0, 1) for dj in (-1, 0, 1) if (di, dj) != (0, 0)]
+
+
+def _prolong(coarse: np.array, free: np.array) -> np.array:
+    """Bilinear interpolation of a coarse grid correction to the fine grid,
+    zero on the fixed cells."""
+    fine = np.zeros(free.shape)
+    fine[::2, ::2] = coarse
+    fine[1::2, ::2] = (coarse[:-1] + coarse[1:])/2
+    fine[::2, 1::2] = (coarse[:, :-1] + coarse[:, 1:])/2
+    fine[1::2, 1::2] = (coarse[:-1, :-1] + coarse[1:, :-1] + coarse[:-1, 1:] + coarse[1:, 1:])/4
+    fine *= free
+    return fine
+
+
+def _restrict(fine: np.array, free: np.array) -> np.array:
+    """Transpose of _prolong: full weighting of the free cells (times 4)."""
+    p = np.pad(fine*free, 1)
+    n = p.shape[0] - 1, p.shape[1] - 1
+    c_i, c_j = slice(1, n[0], 2), slice(1, n[1], 2)
+    lo_i, lo_j = slice(0, n[0] - 1, 2), slice(0, n[1] - 1, 2)
+    hi_i, hi_j = slice(2, n[0] + 1, 2), slice(2, n[1] + 1, 2)
+    return (p[c_i, c_j] + 0.5*(p[lo_i, c_j] + p[hi_i, c_j] + p[c_i, lo_j] + p[c_i, hi_j])
+            + 0.25*(p[lo_i, lo_j] + p[lo_i, hi_j] + p[hi_i, lo_j] + p[hi_i, hi_j]))
+
+
+class _Level:
+    """One grid of the multigrid hierarchy: the stencil of the operator
+    (diag and coefs), the correction e with a zero halo, the right hand
+    side F, and views of them for the four-color Gauss-Seidel smoother."""
+
+    def __init__(self, diag: np.array, coefs: dict):
+        self.shape = n_i, n_j = diag.shape
+        self.free = diag != 0
+        self.diag = np.where(self.free, diag, 1.0)
+        self.coefs = {offset: c for offset, c in coefs.items() if c.any()}
+        self.halo = np.zeros((n_i + 2, n_j + 2))
+        self.e = self.halo[1:-1, 1:-1]
+        self.F = np.zeros(self.shape)
+        inverse = 1/self.diag
+        # Points of one parity of (i, j) are not neighbours under a 3 x 3
+        # stencil; (0, 0), (1, 1) then (0, 1), (1, 0) is red-black ordering
+        # for the 5-point stencil of the finest grid.
+        self.colors = []
+        for a, b in ((0, 0), (1, 1), (0, 1), (1, 0)):
+            neighbours = [(c[a::2, b::2], self.halo[1+a+di:1+n_i+di:2, 1+b+dj:1+n_j+dj:2])
+                          for (di, dj), c in self.coefs.items()]
+            self.colors.append((self.halo[1+a:1+n_i:2, 1+b:1+n_j:2], self.F[a::2, b::2],
+                                inverse[a::2, b::2], neighbours))
+
+    def apply(self, x: np.array) -> np.array:
+        n_i, n_j = self.shape
+        p = np.pad(x, 1)
+        y = self.diag*x
+        for (di, dj), c in self.coefs.items():
+            y += c*p[1+di:1+n_i+di, 1+dj:1+n_j+dj]
+        return y
+
+    def smooth(self, sweeps: int):
+        for _ in range(sweeps):
+            for centre, F, inverse, neighbours in self.colors:
+                new = F.copy()
+                for c, neighbour in neighbours:
+                    new -= c*neighbour
+                new *= inverse
+                centre[...] = new
+
+    def coarsen(self) -> "_Level":
+        """Galerkin operator R A P of the next coarser grid. Its 3 x 3
+        stencil is found by applying R A P to 9 probes, each with ones on
+        coarse points 3 apart, whose images do not overlap."""
+        shape = (self.shape[0] + 1)//2, (self.shape[1] + 1)//2
+        diag, coefs = np.zeros(shape), {offset: np.zeros(shape) for offset in _OFFSETS}
+        for a in range(3):
+            for b in range(3):
+                probe = np.zeros(shape)
+                probe[a::3, b::3] = 1
+                image = _restrict(self.apply(_prolong(probe, self.free)), self.free)
+                # Point (I, J) sees the probe at (I + di, J + dj) only.
+                for di in (-1, 0, 1):
+                    for dj in (-1, 0, 1):
+                        hit = slice((a - di) % 3, None, 3), slice((b - dj) % 3, None, 3)
+                        target = diag if (di, dj) == (0, 0) else coefs[di, dj]
+                        target[hit] = image[hit]
+        return _Level(diag, coefs)
+
+
+class Multigrid:
+    """Geometric multigrid solver for the temperature of create_mesh. The
+    problem is solved on the full block (get_full_mesh), where the mirror
+    plane needs no special treatment, padded with fixed cells to a grid that
+    halves levels times. Each V-cycle smooths with Gauss-Seidel, moves the
+    residual to the coarser grid with full weighting, corrects with bilinear
+    interpolation, and solves the coarsest grid directly. The coarse grid
+    operators are built from the fine one (Galerkin), so the insert and the
+    boundaries are honoured on every grid even where they fall between
+    coarse points. Only the geometry (mask) is needed to set up the solver,
+    which can then be used for any boundary temperatures."""
+
+    def __init__(self, mask: np.array, min_coarse: int = 4, pre: int = 2, post: int = 2):
+        self.pre, self.post = pre, post
+        full_free = get_full_mesh(mask) != 0
+        self.full_shape = full_free.shape
+        levels = max(int(math.log2((min(self.full_shape) - 1)/min_coarse)), 0)
+        shape = tuple(-(-(n - 1)//2**levels)*2**levels + 1 for n in self.full_shape)
+        self.free = np.zeros(shape, dtype=bool)
+        self.free[:self.full_shape[0], :self.full_shape[1]] = full_free
+
+        # 5-point Laplacian (times -1) between free cells; fixed cells only
+        # enter through the residual.
+        padded = np.pad(self.free, 1)
+        coefs = {offset: np.zeros(shape) for offset in _OFFSETS}
+        for di, dj in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+            coefs[di, dj] = -1.0*(self.free & padded[1+di:1+shape[0]+di, 1+dj:1+shape[1]+dj])
+        self.levels = [_Level(4.0*self.free, coefs)]
+        for _ in range(levels):
+            self.levels.append(self.levels[-1].coarsen())
+
+        coarsest = self.levels[-1]
+        unit = np.eye(coarsest.e.size).reshape((-1,) + coarsest.shape)
+        matrix = np.array([coarsest.apply(column).ravel() for column in unit]).T
+        self._coarsest_inverse = np.linalg.inv(matrix)
+
+    def residual(self, u: np.array) -> np.array:
+        """Residual of Laplace's equation (times h^2) of the padded full mesh
+        u on the free cells; a Jacobi sweep would change u by a quarter of it."""
+        r = np.zeros(u.shape)
+        r[1:-1, 1:-1] = u[:-2, 1:-1] + u[2:, 1:-1] + u[1:-1, :-2] + u[1:-1, 2:] - 4*u[1:-1, 1:-1]
+        r *= self.free
+        return r
+
+    def _v_cycle(self, k: int = 0):
+        level = self.levels[k]
+        if k == len(self.levels) - 1:
+            level.e[...] = (self._coarsest_inverse @ level.F.ravel()).reshape(level.shape)
+            return
+        level.smooth(self.pre)
+        coarse = self.levels[k + 1]
+        coarse.F[...] = _restrict(level.F - level.apply(level.e), level.free)
+        coarse.e[...] = 0
+        self._v_cycle(k + 1)
+        level.e += _prolong(coarse.e, level.free)
+        level.smooth(self.post)
+
+    def cycles(self, mesh: np.array):
+        """V-cycles on the half-domain mesh, which is updated in place. Yields
+        the sum of the changes a Jacobi sweep on mesh would make after every
+        cycle, the temp_diff of relax()."""
+        u = np.zeros(self.free.shape)
+        u[:self.full_shape[0], :self.full_shape[1]] = get_full_mesh(mesh)
+        finest = self.levels[0]
+        while True:
+            finest.F[...] = self.residual(u)
+            finest.e[...] = 0
+            self._v_cycle()
+            u += finest.e
+            mesh[...] = u[:mesh.shape[0], :mesh.shape[1]]
+            # The state is the half mesh: mirror it again, so that the
+            # residual is that of a Jacobi sweep on mesh.
+            u[:self.full_shape[0], :self.full_shape[1]] = get_full_mesh(mesh)
+            yield np.abs(self.residual(u)[:mesh.shape[0], :mesh.shape[1]]).sum()/4
+
+
+class DirectSolver:
+    """Sparse LU factorization of the 5-point Laplacian on the free cells of
+    the half-domain, with the mirror condition of laplace_eq on the last
+    column. The fixed cells enter the right hand side through a second
+    sparse matrix, so once the solver is set up for a mask, a mesh with any
+    boundary and insert temperatures is solved with two triangular solves.
+    init_temp only sets the initial guess of the iterative methods and has
+    no effect here."""
+
+    def __init__(self, mask: np.array):
+        from scipy import sparse
+        from scipy.sparse.linalg import splu
+        self.shape = n_i, n_j = mask.shape
+        self.free = mask != 0
+        self.n_free = int(self.free.sum())
+        number = np.full(self.shape, -1)
+        number[self.free] = np.arange(self.n_free)
+
+        i, j = np.nonzero(self.free)
+        rows, cols, values = [number[i, j]], [number[i, j]], [np.full(self.n_free, 4.0)]
+        fixed_rows, fixed_cols = [], []
+        for di, dj in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+            n_i_, n_j_ = i + di, j + dj
+            if dj == 1:
+                # Mirror on the last column, as in laplace_eq
+                last = n_j_ == n_j
+                n_j_[last] = n_j - 1 if n_i % 2 == 0 else n_j - 2
+            neighbour_free = self.free[n_i_, n_j_]
+            rows.append(number[i, j][neighbour_free])
+            cols.append(number[n_i_, n_j_][neighbour_free])
+            values.append(np.full(neighbour_free.sum(), -1.0))
+            fixed_rows.append(number[i, j][~neighbour_free])
+            fixed_cols.append((n_i_*n_j + n_j_)[~neighbour_free])
+        matrix = sparse.csc_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+                                   shape=(self.n_free, self.n_free))     # Duplicates are summed
+        fixed_rows, fixed_cols = np.concatenate(fixed_rows), np.concatenate(fixed_cols)
+        self.boundary = sparse.csr_matrix((np.ones(len(fixed_rows)), (fixed_rows, fixed_cols)),
+                                          shape=(self.n_free, n_i*n_j))
+        # Minimum degree on A^T + A suits the (nearly symmetric) Laplacian:
+        # about half the fill of the default COLAMD ordering.
+        self.lu = splu(matrix, permc_spec="MMD_AT_PLUS_A")
+
+    def solve(self, mesh: np.array) -> np.array:
+        """Fill in the free cells of mesh (in place) from its fixed cells.
+        mesh may also be a stack of meshes of shape (k, n_i, n_j), which are
+        solved together."""
+        flat = mesh.reshape(-1, self.shape[0]*self.shape[1])
+        solution = self.lu.solve(np.ascontiguousarray((self.boundary @ flat.T)))
+        mesh[..., self.free] = solution.T
+        return mesh
+
+
+if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+    import matplotlib.animation as animation
+
+    mesh, mask = create_mesh(resolution, init_temp)
+    sweeps = relax(mesh, mask, "gauss-seidel")
+    monitor = ConvergenceMonitor(threshold)
+
+    # mpl.rcParams['toolbar'] = 'None'
+    fig = plt.figure("Exercise 2: Simulating and visualising temperature distribution in a material")
+    fig.suptitle('Temperature Distribution in a Material', fontsize=14)
+    plt.xlim(0., 9.)
+    plt.ylim(0., 9.)
+    plt.xlabel('Horizontal distance [in]')
+    plt.ylabel('Vertical distance [in]')
+    im = plt.imshow(get_full_mesh(mesh), extent=[0,9,0,9], animated=True, cmap='magma')
+    cbar = plt.colorbar()
+    cbar.set_label('Temperature [ºF]')
+
+    def update_fig(*args):
+        temp_diff = next(sweeps)
+        converged = monitor.update(temp_diff)
+        if monitor.iterations in [1, 10] or monitor.iterations % 100 == 0:
+            print(f'Iteration: {monitor.iterations}\nTemperature difference: {temp_diff:.1f}')
+        if converged:
+            print(f'Iteration: {monitor.iterations}\nTemperature difference: {temp_diff:.1f}')
+            plt.close()
+        else:
+            im.set_array(get_full_mesh(mesh))
 
+        return im,
 
-ani = animation.FuncAnimation(fig, update_fig, interval=2, blit=True)
-plt.show()
+    ani = animation.FuncAnimation(fig, update_fig, interval=2, blit=True, cache_frame_data=False)
+    plt.show()
@@ -0,0 +1,57 @@
+"""Level of detail for plots of large grids.
+
+A quiver plot or a 3D surface cannot show more arrows or facets than there
+are pixels, and matplotlib's cost grows with their number, so on a large grid
+the fields are averaged over blocks of cells down to a target resolution
+before they are drawn:
+
+    lod = LevelOfDetail(eta.shape, 50)      # At most 50 x 50 blocks
+    X_lod, Y_lod = lod(X), lod(Y)           # Block centers
+    eta_lod = lod(eta)                      # Block means
+
+Unlike taking every n-th point, the block mean does not alias short waves
+into spurious long ones. The averaging is a reshape to (blocks, cells per
+block) and a sum over the cell axes; when the grid is not a multiple of the
+block size, the last block along an axis is padded with zeros and divided by
+the number of cells it actually holds."""
+
+import numpy as np
+
+
+def block_factors(shape, resolution):
+    """Cells per block along each of the two axes of shape, so that there are
+    at most resolution blocks along each axis (resolution is one number or
+    one per axis). None means no averaging."""
+    if resolution is None:
+        return (1, 1)
+    if np.ndim(resolution) == 0:
+        resolution = (resolution, resolution)
+    return tuple(max(1, -(-n//int(r))) for n, r in zip(shape, resolution))
+
+
+class LevelOfDetail:
+    """Block average of fields of a given 2D shape (the last two axes of the
+    arrays it is called with) to at most resolution blocks per axis."""
+
+    def __init__(self, shape, resolution):
+        self.shape = tuple(shape[-2:])
+        self.factors = f_x, f_y = block_factors(self.shape, resolution)
+        n_x, n_y = self.shape
+        self.lod_shape = m_x, m_y = -(-n_x//f_x), -(-n_y//f_y)
+        self._padded = (m_x*f_x, m_y*f_y) != self.shape
+        if self._padded:
+            cells_x = np.minimum(f_x, n_x - f_x*np.arange(m_x))
+            cells_y = np.minimum(f_y, n_y - f_y*np.arange(m_y))
+            self._cells = np.outer(cells_x, cells_y)
+
+    def __call__(self, field):
+        field = np.asarray(field)
+        if self.factors == (1, 1):
+            return field
+        (f_x, f_y), (m_x, m_y) = self.factors, self.lod_shape
+        lead = field.shape[:-2]
+        if not self._padded:
+            return field.reshape(lead + (m_x, f_x, m_y, f_y)).mean(axis=(-3, -1))
+        padded = np.zeros(lead + (m_x*f_x, m_y*f_y), dtype=np.result_type(field, float))
+        padded[..., :self.shape[0], :self.shape[1]] = field
+        return padded.reshape(lead + (m_x, f_x, m_y, f_y)).sum(axis=(-3, -1))/self._cells
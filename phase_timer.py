@@ -0,0 +1,65 @@
+"""Low-overhead wall clock timers for the phases of a time stepping loop.
+
+A PhaseTimer is driven by two calls. mark() starts a step, and lap(phase)
+charges the time since the previous mark or lap to phase. Every call reads
+time.perf_counter() once, so a step split into a handful of phases costs a
+few microseconds, and code that is not profiled pays one `is not None` test
+per phase. Time between the last lap of a step and the next mark (e.g. the
+driver printing progress) is not charged to any phase.
+
+record() summarises the totals as a dict that can be written as one JSON line
+with write_record(), so runs of different versions can be compared:
+
+    {"steps": 5000, "time": 3.61, "steps_per_second": 1385.0,
+     "phases": {"momentum": {"time": 1.02, "fraction": 0.28, "per_step": 0.000204}, ...},
+     ...extra fields passed to record()}"""
+
+import json
+import time
+
+
+class PhaseTimer:
+    """Accumulated wall time [s] per phase over a number of steps."""
+
+    def __init__(self):
+        self.totals = {}
+        self.n_steps = 0
+        self._last = None
+
+    def mark(self, n_steps=1):
+        """Start timing n_steps steps (more than one when a whole chunk of
+        steps is timed as one phase)."""
+        self.n_steps += n_steps
+        self._last = time.perf_counter()
+
+    def lap(self, phase):
+        """Charge the time since the last mark or lap to phase."""
+        now = time.perf_counter()
+        self.totals[phase] = self.totals.get(phase, 0.0) + (now - self._last)
+        self._last = now
+
+    def reset(self):
+        self.totals.clear()
+        self.n_steps = 0
+
+    def record(self, **extra):
+        """Summary of the timings as a JSON-serialisable dict, with the
+        fields of extra (e.g. the backend and grid size) added."""
+        total = sum(self.totals.values())
+        phases = {phase: {"time": t, "fraction": t/total if total else 0.0,
+                          "per_step": t/self.n_steps if self.n_steps else 0.0}
+                  for phase, t in self.totals.items()}
+        record = {"steps": self.n_steps, "time": total,
+                  "steps_per_second": self.n_steps/total if total else 0.0, "phases": phases}
+        record.update(extra)
+        return record
+
+
+def write_record(record, path):
+    """Append record as one line of JSON to the file at path ("-" for stdout)."""
+    line = json.dumps(record) + "\n"
+    if path == "-":
+        print(line, end="")
+        return
+    with open(path, "a") as record_file:
+        record_file.write(line)
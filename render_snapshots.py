@@ -0,0 +1,145 @@
+"""Render the animations and plots of a stored shallow water run.
+
+wave_and_velocity.py streams eta, u and v to a snapshot store (see
+snapshot_store.py); this script draws them afterwards, so a run can be
+rendered on another machine, or rendered again with other settings, without
+simulating it again. For example
+
+    python render_snapshots.py snapshots --view eta --workers 4
+    python render_snapshots.py snapshots --view velocity --frames 100:200 --output velocity_100-200
+    python render_snapshots.py snapshots --view surface --format gif
+    python render_snapshots.py snapshots --view eta --lut --scale 3
+    python render_snapshots.py snapshots --view hovmuller
+
+The views are those of viz_tools1: eta (heatmap), velocity (quiver), surface
+(3D) and hovmuller (x-t plot, saved as a PNG). The animations are drawn by
+frame_renderer with a pool of worker processes and the Agg backend, so no
+display is needed. --frames start:stop:step selects a range of frames, which
+are read from the memory-mapped store only when they are drawn; long runs
+can be split into ranges that are rendered on different machines. The ranges
+share the eta color range of the whole run, or the one given with --vmin and
+--vmax. For a store written by an ensemble, --member selects the member and
+--dt gives its time step (the store records time steps rather than times)."""
+
+import argparse
+import shutil
+import sys
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+import frame_renderer
+from snapshot_store import SnapshotReader
+
+VIEWS = ("eta", "velocity", "surface", "hovmuller")
+
+
+def parse_frames(text):
+    """slice for a "start:stop:step" frame range (each part optional)."""
+    parts = text.split(":")
+    if len(parts) > 3:
+        raise argparse.ArgumentTypeError("Frame range '{}' is not start:stop:step".format(text))
+    try:
+        return slice(*(int(part) if part else None for part in parts))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Frame range '{}' is not start:stop:step".format(text))
+
+
+def render_view(store, view, output, frames=slice(None), member=None, dt=None, lut=False, scale=1,
+                resolution=50, vmin=None, vmax=None, **kwargs):
+    """Render view of the SnapshotReader store to output (without the
+    extension) and return the number of frames drawn. frames is a slice of
+    the stored frames; member and dt select a member of an ensemble store.
+    The color range of the eta view is vmin to vmax, by default that of the
+    whole run (not of the frames drawn), so that ranges rendered separately
+    match. The velocity and surface views are block averaged to at most
+    resolution arrows or facets along each axis. Other keyword arguments
+    (workers, format, fps, sink, ...) are passed on to frame_renderer."""
+    ensemble = len(store.shape) == 3
+    if ensemble and (member is None or dt is None):
+        raise ValueError("The store holds an ensemble, give the member and its time step")
+    select = (frames, member) if ensemble else frames
+
+    if view == "hovmuller":
+        return _hovmuller(store, output, member if ensemble else None)
+
+    X, Y = np.meshgrid(store.x, store.y, indexing="ij")
+    times = store.times[frames]
+    if ensemble:
+        times = times*dt
+    fields = {name: store[name][select] for name in ("eta", "u", "v") if name in store.fields}
+    if view == "eta":
+        vmin, vmax = frame_renderer.eta_range(store["eta"][:, member] if ensemble else store["eta"], vmin, vmax)
+    if view == "eta" and lut:
+        return frame_renderer.render_eta_lut(X, Y, fields["eta"], store.frame_interval, output, times, vmin, vmax,
+                                             scale=scale, **{k: v for k, v in kwargs.items() if k != "workers"})
+    if view == "eta":
+        return frame_renderer.render_eta(X, Y, fields["eta"], store.frame_interval, output, times, vmin, vmax,
+                                         **kwargs)
+    if view == "velocity":
+        return frame_renderer.render_velocity(X, Y, fields["u"], fields["v"], store.frame_interval, output,
+                                              times, resolution, **kwargs)
+    if view == "surface":
+        return frame_renderer.render_eta3D(X, Y, fields["eta"], store.frame_interval, output, times, resolution,
+                                           **kwargs)
+    raise ValueError("Unknown view '{}'".format(view))
+
+
+def _hovmuller(store, output, member=None):
+    """Save the Hovmuller diagram of the samples saved with the store."""
+    import matplotlib.pyplot as plt
+    import viz_tools1
+    if not (store.has_array("hm_sample") and store.has_array("t_sample")):
+        raise ValueError("{} holds no Hovmuller samples (hm_sample.npy, t_sample.npy)".format(store.path))
+    hm_sample, t_sample = store.array("hm_sample"), store.array("t_sample")
+    if member is not None:
+        hm_sample, t_sample = hm_sample[:, member], t_sample[:, member]
+    viz_tools1.hovmuller_plot(store.x, t_sample, hm_sample)
+    plt.savefig(output + ".png", dpi=100)
+    plt.close("all")
+    return 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("store", help="snapshot store directory written by the model")
+    parser.add_argument("--view", choices=VIEWS, default="eta")
+    parser.add_argument("--frames", type=parse_frames, default=slice(None), metavar="START:STOP:STEP",
+                        help="range of stored frames to render (default: all)")
+    parser.add_argument("--output", help="output file without extension (default: the view)")
+    parser.add_argument("--format", choices=("mp4", "gif"), default="mp4")
+    parser.add_argument("--workers", type=int, default=None, help="rendering processes (default: all CPUs)")
+    parser.add_argument("--fps", type=int, default=24)
+    parser.add_argument("--lut", action="store_true", help="draw eta with the fast colormap lookup table")
+    parser.add_argument("--scale", type=int, default=1, help="pixels per grid cell with --lut")
+    parser.add_argument("--resolution", type=int, default=50,
+                        help="arrows or surface facets along each axis of the velocity and surface views")
+    parser.add_argument("--vmin", type=float, help="lower end of the eta color range [m] (default: from the run)")
+    parser.add_argument("--vmax", type=float, help="upper end of the eta color range [m] (default: from the run)")
+    parser.add_argument("--member", type=int, help="member of an ensemble store")
+    parser.add_argument("--dt", type=float, help="time step [s] of the member of an ensemble store")
+    parser.add_argument("--raw", metavar="FILE",
+                        help="write the raw RGB frames to FILE instead of encoding them with ffmpeg")
+    args = parser.parse_args()
+
+    store = SnapshotReader(args.store)
+    output = args.output or args.view
+    if args.view != "hovmuller" and args.raw is None and shutil.which("ffmpeg") is None:
+        sys.exit("ffmpeg not found, install it or write raw frames with --raw")
+    sink = open(args.raw, "wb") if args.raw and args.view != "hovmuller" else None
+    try:
+        n_frames = render_view(store, args.view, output, args.frames, args.member, args.dt, args.lut,
+                               args.scale, args.resolution, args.vmin, args.vmax, workers=args.workers, format=args.format,
+                               fps=args.fps, sink=sink)
+    except ValueError as error:
+        sys.exit(str(error))
+    finally:
+        if sink is not None:
+            sink.close()
+    if args.view == "hovmuller":
+        print("Saved {}.png".format(output))
+    else:
+        print("Rendered {} frames to {}".format(n_frames, args.raw or "{}.{}".format(output, args.format)))
+
+
+if __name__ == "__main__":
+    main()
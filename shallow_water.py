@@ -0,0 +1,691 @@
+"""Importable engine for the 2D shallow water model of wave_and_velocity.py.
+
+The model solves the linear momentum equations and the nonlinear continuity
+equation with finite differences,
+
+    du/dt - fv = -g*d(eta)/dx + tau_x/(rho_0*H)- kappa*u
+    dv/dt + fu = -g*d(eta)/dy + tau_y/(rho_0*H)- kappa*v
+    d(eta)/dt + d((eta + H)*u)/dx + d((eta + H)*u)/dy = sigma - w
+
+where f = f_0 + beta*y can be the full latitude varying coriolis parameter.
+All parameters live in a ShallowWaterConfig and all state lives in a
+ShallowWaterSolver, so several configurations can be run side by side in the
+same process. Nothing in this module imports matplotlib; plotting is left to
+viz_tools1 and the wave_and_velocity.py driver."""
+
+from dataclasses import asdict, dataclass, replace
+import json
+import os
+import warnings
+import numpy as np
+from phase_timer import PhaseTimer
+
+
+@dataclass
+class ShallowWaterConfig:
+    """Physical and computational parameters of the shallow water model. The
+    defaults reproduce the original setup of wave_and_velocity.py."""
+    # --------------- Physical prameters ---------------
+    L_x: float = 1E+6              # Length of domain in x-direction
+    L_y: float = 1E+6              # Length of domain in y-direction
+    g: float = 9.81                # Acceleration of gravity [m/s^2]
+    H: float = 100                 # Depth of fluid [m]
+    f_0: float = 1E-4              # Fixed part ofcoriolis parameter [1/s]
+    beta: float = 2E-11            # gradient of coriolis parameter [1/ms]
+    rho_0: float = 1024.0          # Density of fluid [kg/m^3)]
+    tau_0: float = 0.1             # Amplitude of wind stress [kg/ms^2]
+    kappa_0: float = 1/(5*24*3600) # Bottom friction coefficient [1/s]
+    use_coriolis: bool = True      # True if you want coriolis force
+    use_friction: bool = False     # True if you want bottom friction
+    use_wind: bool = False         # True if you want wind stress
+    use_beta: bool = True          # True if you want variation in coriolis
+    use_source: bool = False       # True if you want mass source into the domain
+    use_sink: bool = False         # True if you want mass sink out of the domain
+    bump_amplitude: float = 1.0    # Height of the initial Gaussian bump in eta [m]
+    bump_x: float = None           # x-position of the bump (L_x/2.7 if not given)
+    bump_y: float = None           # y-position of the bump (L_y/4 if not given)
+    bump_width: float = 0.05E+6    # Standard deviation of the bump [m]
+
+    # --------------- Computational prameters ---------------
+    N_x: int = 150                 # Number of grid points in x-direction
+    N_y: int = 150                 # Number of grid points in y-direction
+    max_time_step: int = 5000      # Total number of time steps in simulation
+    anim_interval: int = 20        # How often to store snapshots for animation
+    sample_interval: int = 1000    # How often to sample for time series
+    backend: str = "numpy"         # "numpy" (in-place, buffer swapping), "numba" or "reference"
+    checkpoint_interval: int = 0   # How often to write a checkpoint (0 for never)
+    checkpoint_path: str = "checkpoint.npz"  # File the checkpoints are written to
+    dtype: str = "float64"         # Precision of state and scratch arrays ("float64" or "float32")
+    mass_float64: bool = True      # Accumulate the mass diagnostic in float64 for any dtype
+    profile: bool = False          # True to time the phases of every step (see phase_timer.py)
+    adaptive_dt: bool = False      # True to adapt dt to the current wave speed every step
+    cfl: float = 0.5               # Courant number for adaptive time steps (stable below 1/sqrt(2))
+    max_alpha: float = 0.1         # Largest alpha = dt*f allowed for adaptive time steps
+
+    @property
+    def dx(self):
+        """Grid spacing in x-direction."""
+        return self.L_x/(self.N_x - 1)
+
+    @property
+    def dy(self):
+        """Grid spacing in y-direction."""
+        return self.L_y/(self.N_y - 1)
+
+    @property
+    def dt(self):
+        """Time step (defined from the CFL condition). With adaptive_dt this is
+        only the reference step: anim_interval and sample_interval are then
+        taken as multiples of it in physical time, and the run ends at
+        end_time."""
+        return 0.1*min(self.dx, self.dy)/np.sqrt(self.g*self.H)
+
+    @property
+    def end_time(self):
+        """Physical time reached after max_time_step reference steps."""
+        return self.max_time_step*self.dt
+
+    def param_string(self):
+        """Return the human readable parameter block that the original script
+        printed to screen and wrote to param_output.txt."""
+        g, H, f_0, beta = self.g, self.H, self.f_0, self.beta
+        param_string = "\n================================================================"
+        param_string += "\nuse_coriolis = {}\nuse_beta = {}".format(self.use_coriolis, self.use_beta)
+        param_string += "\nuse_friction = {}\nuse_wind = {}".format(self.use_friction, self.use_wind)
+        param_string += "\nuse_source = {}\nuse_sink = {}".format(self.use_source, self.use_sink)
+        param_string += "\ng = {:g}\nH = {:g}".format(g, H)
+        param_string += "\ndx = {:.2f} km\ndy = {:.2f} km\ndt = {:.2f} s".format(self.dx, self.dy, self.dt)
+        if self.dtype != "float64":
+            param_string += "\nprecision: {}, mass in {}".format(self.dtype, "float64" if self.mass_float64 else self.dtype)
+        if self.adaptive_dt:
+            param_string += "\nadaptive dt: cfl = {:g}, max alpha = {:g}".format(self.cfl, self.max_alpha)
+        if self.use_friction:
+            param_string += "\nkappa = {:g}\nkappa/beta = {:g} km".format(self.kappa_0, self.kappa_0/(beta*1000))
+        if self.use_wind:
+            param_string += "\ntau_0 = {:g}\nrho_0 = {:g} km".format(self.tau_0, self.rho_0)
+        if self.use_coriolis:
+            y = np.linspace(-self.L_y/2, self.L_y/2, self.N_y)
+            f = f_0 + beta*y if self.use_beta else f_0*np.ones(len(y))
+            param_string += "\nf_0 = {:g}".format(f_0)
+            param_string += "\nMax alpha = {:g}\n".format((self.dt*f).max())
+            if self.use_beta:
+                L_R = np.sqrt(g*H)/f_0  # Rossby deformation radius
+                c_R = beta*g*H/f_0**2   # Long Rossby wave speed
+                param_string += "\nRossby radius: {:.1f} km".format(L_R/1000)
+                param_string += "\nRossby number: {:g}".format(np.sqrt(g*H)/(f_0*self.L_x))
+                param_string += "\nLong Rossby wave speed: {:.3f} m/s".format(c_R)
+                param_string += "\nLong Rossby transit time: {:.2f} days".format(self.L_x/(c_R*24*3600))
+            param_string += "\n================================================================\n"
+        return param_string
+
+
+def gaussian_bump(config, X, Y):
+    """Initial condition used by wave_and_velocity.py: a Gaussian bump in eta,
+    by default of unit height off the center of the domain."""
+    x_0 = config.bump_x if config.bump_x is not None else config.L_x/2.7
+    y_0 = config.bump_y if config.bump_y is not None else config.L_y/4
+    width = config.bump_width
+    return config.bump_amplitude*np.exp(-((X-x_0)**2/(2*(width)**2) + (Y-y_0)**2/(2*(width)**2)))
+
+
+class ShallowWaterSolver:
+    """Time stepper for the 2D shallow water model. All arrays are allocated
+    once in the constructor and reused for every step. The current state is
+    available as u, v and eta, and the time series samples for the Hovmuller
+    diagram and spectrum are collected in hm_sample, ts_sample and t_sample.
+
+    Every anim_interval steps a snapshot of eta, u and v is taken. By default
+    the snapshots are kept in eta_list, u_list and v_list. When a snapshots
+    writer (e.g. snapshot_store.SnapshotWriter) is given they are streamed to
+    it with snapshots.append(t, eta=..., u=..., v=...) instead.
+
+    With checkpoint_interval set, the full state is written to checkpoint_path
+    periodically, and from_checkpoint() continues the run from the last
+    checkpoint with results identical to an uninterrupted run.
+
+    With profile set, timer is a phase_timer.PhaseTimer that accumulates the
+    time spent in each phase of a step (momentum, coriolis, fluxes,
+    eta_update, sampling, snapshot_io, ...), and profile_record() summarises
+    it."""
+
+    def __init__(self, config=None, eta_0=None, snapshots=None):
+        self.config = config = config if config is not None else ShallowWaterConfig()
+        N_x, N_y = config.N_x, config.N_y
+        self.dt = config.dt
+        self.H = config.H
+        self.time_step = 0
+        self.n_snapshots = 0
+        self._t_elapsed = 0.0       # Physical time, kept separately with adaptive_dt
+        self.timer = PhaseTimer() if config.profile else None
+
+        self.x = np.linspace(-config.L_x/2, config.L_x/2, N_x)  # Array with x-points
+        self.y = np.linspace(-config.L_y/2, config.L_y/2, N_y)  # Array with y-points
+        X, Y = np.meshgrid(self.x, self.y)
+        self.X = np.transpose(X)        # To get plots right
+        self.Y = np.transpose(Y)        # To get plots right
+
+        # State at current and next time step.
+        self._dtype = dtype = np.dtype(config.dtype)
+        self.u_n = np.zeros((N_x, N_y), dtype=dtype)
+        self.u_np1 = np.zeros((N_x, N_y), dtype=dtype)
+        self.v_n = np.zeros((N_x, N_y), dtype=dtype)
+        self.v_np1 = np.zeros((N_x, N_y), dtype=dtype)
+        self.eta_n = np.zeros((N_x, N_y), dtype=dtype)
+        self.eta_np1 = np.zeros((N_x, N_y), dtype=dtype)
+
+        # Temporary variables (each time step) for upwind scheme in eta equation
+        self.h_e = np.zeros((N_x, N_y), dtype=dtype)
+        self.h_n = np.zeros((N_x, N_y), dtype=dtype)
+        self.uhwe = np.zeros((N_x, N_y), dtype=dtype)
+        self.vhns = np.zeros((N_x, N_y), dtype=dtype)
+        backend = config.backend
+        if backend == "numba":
+            try:
+                import shallow_water_kernels
+            except ImportError:
+                warnings.warn("numba is not available, falling back to the numpy backend")
+                backend = "numpy"
+            else:
+                self._fused_step = shallow_water_kernels.fused_step
+                self._flux_x = np.zeros(N_y, dtype=dtype)
+                # Stand-ins for the coefficient arrays of disabled terms
+                self._unused_2d, self._unused_1d = np.zeros((1, 1), dtype=dtype), np.zeros(1, dtype=dtype)
+                # float32 waves leave tails whose products with the coefficients
+                # are subnormal, which is very slow in the scalar loop, so the
+                # kernel flushes values below tiny/eps (about 1E-31) to zero.
+                info = np.finfo(dtype)
+                self._flush_below = dtype.type(info.tiny/info.eps if dtype == np.float32 else 0)
+                self._step_kernel = self._step_numba
+        if backend == "reference":
+            self.h_w = np.zeros((N_x, N_y), dtype=dtype)
+            self.h_s = np.zeros((N_x, N_y), dtype=dtype)
+            self._step_kernel = self._step_reference
+        elif backend == "numpy":
+            self._tmp = np.zeros((N_x, N_y), dtype=dtype)   # Scratch for products and differences
+            self._upwind = np.zeros((N_x, N_y), dtype=bool) # Scratch for the upwind direction
+            self._step_kernel = self._step_numpy
+        elif backend != "numba":
+            raise ValueError("Unknown backend '{}'".format(config.backend))
+        self.backend = backend
+
+        # Initial conditions, u and v at rest satisfy the boundary conditions.
+        self.eta_n[:, :] = gaussian_bump(config, self.X, self.Y) if eta_0 is None else eta_0
+
+        self._setup_forcing()
+        self._update_coefficients()
+
+        # Sampling variables for Hovmuller diagram, time series and animation.
+        self.hm_sample = [self.eta_n[:, N_y//2].copy()]     # Sample initial eta in middle of domain
+        self.ts_sample = [self.eta_n[N_x//2, N_y//2]]       # Sample initial eta at center of domain
+        self.t_sample = [0.0]                               # Add initial time to t-samples
+        self.eta_list = list(); self.u_list = list(); self.v_list = list()
+        self.snapshots = snapshots
+
+    def _setup_forcing(self):
+        """Define the friction, wind, coriolis and source/sink fields for the
+        terms that are enabled in the configuration."""
+        c = self.config
+        if c.use_friction:
+            self.kappa = np.ones((c.N_x, c.N_y))*c.kappa_0
+        if c.use_wind:
+            self.tau_x = -c.tau_0*np.cos(np.pi*self.y/c.L_y)*0
+            self.tau_y = np.zeros((1, c.N_y))
+        if c.use_coriolis:
+            self.f = c.f_0 + c.beta*self.y if c.use_beta else c.f_0*np.ones(c.N_y)
+        if c.use_source or c.use_sink:
+            self.sigma = 0.0001*np.exp(-((self.X-c.L_x/2)**2/(2*(1E+5)**2) + (self.Y-c.L_y/2)**2/(2*(1E+5)**2)))
+        if c.use_sink:
+            self.w = np.ones((c.N_x, c.N_y))*self.sigma.sum()/(c.N_x*c.N_y)
+
+    def _typed(self, value):
+        """value (scalar or array) in the precision of the state arrays, so
+        that no operation of a step is promoted to a wider type."""
+        if isinstance(value, np.ndarray):
+            return value.astype(self._dtype)
+        return self._dtype.type(value)
+
+    def _update_coefficients(self):
+        """Recompute the coefficients that depend on the time step dt. They
+        are computed in float64 and then stored in the precision of the state."""
+        c, dt = self.config, self.dt
+        self._dt = self._typed(dt)
+        self._H = self._typed(self.H)
+        self._g_dt_dx = self._typed(c.g*dt/c.dx)
+        self._g_dt_dy = self._typed(c.g*dt/c.dy)
+        if c.use_coriolis:
+            alpha = dt*self.f                   # Parameter needed for coriolis scheme
+            beta_c = alpha**2/4                 # Parameter needed for coriolis scheme
+            self.alpha, self.beta_c = self._typed(alpha), self._typed(beta_c)
+            self._one_beta_c = self._typed(1 + beta_c)
+        if c.use_friction:
+            self._dt_kappa = self._typed(dt*self.kappa[:-1, :])
+        if c.use_wind:
+            self._dt_tau_x = self._typed(dt*self.tau_x[:]/(c.rho_0*c.H))
+            self._dt_tau_y = self._typed(dt*self.tau_y[:]/(c.rho_0*c.H))
+        if c.use_source:
+            self._dt_sigma = self._typed(dt*self.sigma)
+        if c.use_sink:
+            self._dt_w = self._typed(dt*self.w)
+
+    @property
+    def u(self):
+        return self.u_n
+
+    @property
+    def v(self):
+        return self.v_n
+
+    @property
+    def eta(self):
+        return self.eta_n
+
+    @property
+    def t(self):
+        """Physical time of the current state [s]."""
+        if self.config.adaptive_dt:
+            return self._t_elapsed
+        return self.time_step*self.dt
+
+    @property
+    def finished(self):
+        """True when the run has reached max_time_step (or end_time when the
+        time step is adaptive)."""
+        if self.config.adaptive_dt:
+            return self._t_elapsed >= self.config.end_time
+        return self.time_step >= self.config.max_time_step
+
+    def mass(self):
+        """Total mass anomaly sum(eta) of the current state, accumulated in
+        float64 unless mass_float64 is switched off."""
+        if self.config.mass_float64:
+            return np.sum(self.eta_n, dtype=np.float64)
+        return np.sum(self.eta_n)
+
+    def step(self):
+        """Advance the model one time step and record samples that fall due.
+        With adaptive time steps the run cannot go past end_time, and a step
+        once it is finished raises a RuntimeError."""
+        adaptive, timer = self.config.adaptive_dt, self.timer
+        if adaptive and self.finished:
+            raise RuntimeError("The run has reached its end time of {} s".format(self.config.end_time))
+        if timer is not None:
+            timer.mark()
+        if adaptive:
+            t_next = self._adapt_dt()
+            if timer is not None:
+                timer.lap("adapt_dt")
+        self._step_kernel()
+        self.time_step += 1
+        if adaptive:
+            self._t_elapsed = t_next
+        self._after_step()
+
+    def _output_time(self, interval, count):
+        """Physical time of output number count of an output taken every
+        interval reference time steps."""
+        return count*(interval*self.config.dt)
+
+    def _adapt_dt(self):
+        """Choose the largest stable time step for the current state and
+        return the time it reaches. The gravity wave speed sqrt(g*(H + eta))
+        plus the flow speed sets the CFL limit, and alpha = dt*f is kept below
+        max_alpha. Steps are shortened to land exactly on the next output time
+        (and split evenly when the remainder would leave a tiny step)."""
+        c, t = self.config, self._t_elapsed
+        speed = np.sqrt(c.g*(self.H + self.eta_n.max()))
+        speed += max(self.u_n.max(), -self.u_n.min(), self.v_n.max(), -self.v_n.min())
+        dt = c.cfl*min(c.dx, c.dy)/speed
+        if c.use_coriolis:
+            dt = min(dt, c.max_alpha/np.abs(self.f).max())
+
+        t_event = min(self._output_time(c.sample_interval, len(self.t_sample)),
+                      self._output_time(c.anim_interval, self.n_snapshots + 1), c.end_time)
+        if t + dt >= t_event:
+            dt, t_next = t_event - t, t_event
+        else:
+            if t + 2*dt > t_event:
+                dt = (t_event - t)/2
+            t_next = t + dt
+        if dt != self.dt:
+            self.dt = dt
+            self._update_coefficients()
+        return t_next
+
+    def _due(self, interval, count):
+        """True if output number count of an output taken every interval
+        (reference) time steps is due."""
+        if self.config.adaptive_dt:
+            return self._t_elapsed >= self._output_time(interval, count)
+        return self.time_step % interval == 0
+
+    def _after_step(self):
+        """Record samples and write a checkpoint if they are due."""
+        timer = self.timer
+        self._sample()
+        if timer is not None:
+            timer.lap("sampling")
+        if self.config.checkpoint_interval and self.time_step % self.config.checkpoint_interval == 0:
+            self.save_checkpoint()
+            if timer is not None:
+                timer.lap("checkpoint")
+
+    def profile_record(self, **extra):
+        """Phase timings of the steps taken since profiling started (see
+        PhaseTimer.record), tagged with the backend, grid size and precision."""
+        c = self.config
+        return self.timer.record(backend=self.backend, N_x=c.N_x, N_y=c.N_y, dtype=c.dtype, **extra)
+
+    def _step_reference(self):
+        """Straightforward transcription of the original time loop. Every
+        expression allocates temporaries and the new state is copied back into
+        the current state buffers."""
+        c = self.config
+        g, H, dt, dx, dy = c.g, c.H, self._dt, c.dx, c.dy
+        u_n, v_n, eta_n = self.u_n, self.v_n, self.eta_n
+        u_np1, v_np1, eta_np1 = self.u_np1, self.v_np1, self.eta_np1
+        h_e, h_w, h_n, h_s, uhwe, vhns = self.h_e, self.h_w, self.h_n, self.h_s, self.uhwe, self.vhns
+        timer = self.timer
+
+        # ------------ Computing values for u and v at next time step --------------
+        u_np1[:-1, :] = u_n[:-1, :] - g*dt/dx*(eta_n[1:, :] - eta_n[:-1, :])
+        v_np1[:, :-1] = v_n[:, :-1] - g*dt/dy*(eta_n[:, 1:] - eta_n[:, :-1])
+
+        # Add friction if enabled.
+        if c.use_friction:
+            u_np1[:-1, :] -= dt*self.kappa[:-1, :]*u_n[:-1, :]
+            v_np1[:-1, :] -= dt*self.kappa[:-1, :]*v_n[:-1, :]
+
+        # Add wind stress if enabled.
+        if c.use_wind:
+            u_np1[:-1, :] += dt*self.tau_x[:]/(c.rho_0*H)
+            v_np1[:-1, :] += dt*self.tau_y[:]/(c.rho_0*H)
+        if timer is not None:
+            timer.lap("momentum")
+
+        # Use a corrector method to add coriolis if it's enabled.
+        if c.use_coriolis:
+            alpha, beta_c = self.alpha, self.beta_c
+            u_np1[:, :] = (u_np1[:, :] - beta_c*u_n[:, :] + alpha*v_n[:, :])/(1 + beta_c)
+            v_np1[:, :] = (v_np1[:, :] - beta_c*v_n[:, :] - alpha*u_n[:, :])/(1 + beta_c)
+
+        v_np1[:, -1] = 0.0      # Northern boundary condition
+        u_np1[-1, :] = 0.0      # Eastern boundary condition
+        if timer is not None:
+            timer.lap("coriolis")
+        # -------------------------- Done with u and v -----------------------------
+
+        # --- Computing arrays needed for the upwind scheme in the eta equation.----
+        h_e[:-1, :] = np.where(u_np1[:-1, :] > 0, eta_n[:-1, :] + H, eta_n[1:, :] + H)
+        h_e[-1, :] = eta_n[-1, :] + H
+
+        h_w[0, :] = eta_n[0, :] + H
+        h_w[1:, :] = np.where(u_np1[:-1, :] > 0, eta_n[:-1, :] + H, eta_n[1:, :] + H)
+
+        h_n[:, :-1] = np.where(v_np1[:, :-1] > 0, eta_n[:, :-1] + H, eta_n[:, 1:] + H)
+        h_n[:, -1] = eta_n[:, -1] + H
+
+        h_s[:, 0] = eta_n[:, 0] + H
+        h_s[:, 1:] = np.where(v_np1[:, :-1] > 0, eta_n[:, :-1] + H, eta_n[:, 1:] + H)
+
+        uhwe[0, :] = u_np1[0, :]*h_e[0, :]
+        uhwe[1:, :] = u_np1[1:, :]*h_e[1:, :] - u_np1[:-1, :]*h_w[1:, :]
+
+        vhns[:, 0] = v_np1[:, 0]*h_n[:, 0]
+        vhns[:, 1:] = v_np1[:, 1:]*h_n[:, 1:] - v_np1[:, :-1]*h_s[:, 1:]
+        if timer is not None:
+            timer.lap("fluxes")
+        # ------------------------- Upwind computations done -------------------------
+
+        # ----------------- Computing eta values at next time step -------------------
+        eta_np1[:, :] = eta_n[:, :] - dt*(uhwe[:, :]/dx + vhns[:, :]/dy)    # Without source/sink
+
+        # Add source term if enabled.
+        if c.use_source:
+            eta_np1[:, :] += dt*self.sigma
+
+        # Add sink term if enabled.
+        if c.use_sink:
+            eta_np1[:, :] -= dt*self.w
+        # ----------------------------- Done with eta --------------------------------
+
+        u_n[:, :] = u_np1           # Update u for next iteration
+        v_n[:, :] = v_np1           # Update v for next iteration
+        eta_n[:, :] = eta_np1       # Update eta for next iteration
+        if timer is not None:
+            timer.lap("eta_update")
+
+    def _step_numpy(self):
+        """Same scheme as _step_reference, but every intermediate is written
+        with out= into persistent scratch arrays and the state buffers are
+        swapped instead of copied, so a step allocates no full-grid arrays.
+        The order of the floating point operations is kept, so both backends
+        give identical results. Arrays are indexed from the back, so the same
+        code steps a stack of ensemble members (see shallow_water_ensemble.py)."""
+        c = self.config
+        H, dt = self._H, self._dt
+        u_n, v_n, eta_n = self.u_n, self.v_n, self.eta_n
+        u_np1, v_np1, eta_np1 = self.u_np1, self.v_np1, self.eta_np1
+        h_e, h_n, uhwe, vhns = self.h_e, self.h_n, self.uhwe, self.vhns
+        tmp, upwind = self._tmp, self._upwind
+        timer = self.timer
+
+        # ------------ Computing values for u and v at next time step --------------
+        np.subtract(eta_n[..., 1:, :], eta_n[..., :-1, :], out=tmp[..., :-1, :])
+        np.multiply(tmp[..., :-1, :], self._g_dt_dx, out=tmp[..., :-1, :])
+        np.subtract(u_n[..., :-1, :], tmp[..., :-1, :], out=u_np1[..., :-1, :])
+        np.subtract(eta_n[..., 1:], eta_n[..., :-1], out=tmp[..., :-1])
+        np.multiply(tmp[..., :-1], self._g_dt_dy, out=tmp[..., :-1])
+        np.subtract(v_n[..., :-1], tmp[..., :-1], out=v_np1[..., :-1])
+
+        # Add friction if enabled.
+        if c.use_friction:
+            np.multiply(self._dt_kappa, u_n[..., :-1, :], out=tmp[..., :-1, :])
+            np.subtract(u_np1[..., :-1, :], tmp[..., :-1, :], out=u_np1[..., :-1, :])
+            np.multiply(self._dt_kappa, v_n[..., :-1, :], out=tmp[..., :-1, :])
+            np.subtract(v_np1[..., :-1, :], tmp[..., :-1, :], out=v_np1[..., :-1, :])
+
+        # Add wind stress if enabled.
+        if c.use_wind:
+            np.add(u_np1[..., :-1, :], self._dt_tau_x, out=u_np1[..., :-1, :])
+            np.add(v_np1[..., :-1, :], self._dt_tau_y, out=v_np1[..., :-1, :])
+        if timer is not None:
+            timer.lap("momentum")
+
+        # Use a corrector method to add coriolis if it's enabled.
+        if c.use_coriolis:
+            alpha, beta_c = self.alpha, self.beta_c
+            np.multiply(beta_c, u_n, out=tmp)
+            np.subtract(u_np1, tmp, out=u_np1)
+            np.multiply(alpha, v_n, out=tmp)
+            np.add(u_np1, tmp, out=u_np1)
+            np.divide(u_np1, self._one_beta_c, out=u_np1)
+            np.multiply(beta_c, v_n, out=tmp)
+            np.subtract(v_np1, tmp, out=v_np1)
+            np.multiply(alpha, u_n, out=tmp)
+            np.subtract(v_np1, tmp, out=v_np1)
+            np.divide(v_np1, self._one_beta_c, out=v_np1)
+
+        v_np1[..., -1] = 0.0      # Northern boundary condition
+        u_np1[..., -1, :] = 0.0      # Eastern boundary condition
+        if timer is not None:
+            timer.lap("coriolis")
+        # -------------------------- Done with u and v -----------------------------
+
+        # --- Upwind fluxes in the eta equation. The western depth h_w[1:] is the
+        # same as the eastern depth h_e[:-1] (and h_s[..., 1:] is h_n[..., :-1]), so
+        # the flux u*h_e is computed once and differenced. ---
+        np.add(eta_n, H, out=tmp)
+        np.copyto(h_e[..., :-1, :], tmp[..., 1:, :])
+        np.greater(u_np1[..., :-1, :], 0, out=upwind[..., :-1, :])
+        np.copyto(h_e[..., :-1, :], tmp[..., :-1, :], where=upwind[..., :-1, :])
+        h_e[..., -1, :] = tmp[..., -1, :]
+
+        np.copyto(h_n[..., :-1], tmp[..., 1:])
+        np.greater(v_np1[..., :-1], 0, out=upwind[..., :-1])
+        np.copyto(h_n[..., :-1], tmp[..., :-1], where=upwind[..., :-1])
+        h_n[..., -1] = tmp[..., -1]
+
+        np.multiply(u_np1, h_e, out=h_e)                # Flux u*h through eastern faces
+        uhwe[..., 0, :] = h_e[..., 0, :]
+        np.subtract(h_e[..., 1:, :], h_e[..., :-1, :], out=uhwe[..., 1:, :])
+
+        np.multiply(v_np1, h_n, out=h_n)                # Flux v*h through northern faces
+        vhns[..., 0] = h_n[..., 0]
+        np.subtract(h_n[..., 1:], h_n[..., :-1], out=vhns[..., 1:])
+        if timer is not None:
+            timer.lap("fluxes")
+        # ------------------------- Upwind computations done -------------------------
+
+        # ----------------- Computing eta values at next time step -------------------
+        np.divide(uhwe, c.dx, out=uhwe)
+        np.divide(vhns, c.dy, out=vhns)
+        np.add(uhwe, vhns, out=uhwe)
+        np.multiply(uhwe, dt, out=uhwe)
+        np.subtract(eta_n, uhwe, out=eta_np1)
+
+        # Add source term if enabled.
+        if c.use_source:
+            np.add(eta_np1, self._dt_sigma, out=eta_np1)
+
+        # Add sink term if enabled.
+        if c.use_sink:
+            np.subtract(eta_np1, self._dt_w, out=eta_np1)
+        # ----------------------------- Done with eta --------------------------------
+
+        self._swap()
+        if timer is not None:
+            timer.lap("eta_update")
+
+    def _step_numba(self):
+        """Same scheme as _step_reference, computed by the fused compiled kernel
+        in shallow_water_kernels.py in a single sweep over the grid."""
+        c, unused_2d, unused_1d = self.config, self._unused_2d, self._unused_1d
+        self._fused_step(
+            self.u_n, self.v_n, self.eta_n, self.u_np1, self.v_np1, self.eta_np1,
+            self._H, self._dt, self._typed(c.dx), self._typed(c.dy), self._g_dt_dx, self._g_dt_dy,
+            c.use_friction, self._dt_kappa if c.use_friction else unused_2d,
+            c.use_wind, self._dt_tau_x if c.use_wind else unused_1d,
+            self._dt_tau_y.ravel() if c.use_wind else unused_1d,
+            c.use_coriolis, self.alpha if c.use_coriolis else unused_1d,
+            self.beta_c if c.use_coriolis else unused_1d,
+            self._one_beta_c if c.use_coriolis else unused_1d,
+            c.use_source, self._dt_sigma if c.use_source else unused_2d,
+            c.use_sink, self._dt_w if c.use_sink else unused_2d,
+            self._flux_x, self._flush_below)
+        self._swap()
+        if self.timer is not None:
+            self.timer.lap("fused")     # The phases are interleaved row by row
+
+    def _swap(self):
+        """Swap buffers, the old state is overwritten during the next step."""
+        self.u_n, self.u_np1 = self.u_np1, self.u_n
+        self.v_n, self.v_np1 = self.v_np1, self.v_n
+        self.eta_n, self.eta_np1 = self.eta_np1, self.eta_n
+
+    def _sample(self):
+        """Store samples for the Hovmuller diagram, the spectrum and the
+        animations when the current time step is due."""
+        c = self.config
+        if self._due(c.sample_interval, len(self.t_sample)):
+            self.hm_sample.append(self.eta[:, c.N_y//2].copy())     # Sample middle of domain for Hovmuller
+            self.ts_sample.append(self.eta[c.N_x//2, c.N_y//2])     # Sample center point for spectrum
+            self.t_sample.append(self.t)                            # Keep track of sample times.
+
+        if self._due(c.anim_interval, self.n_snapshots + 1):
+            self.n_snapshots += 1
+            if self.snapshots is not None:
+                if self.timer is not None:
+                    self.timer.lap("sampling")
+                self.snapshots.append(self.t, eta=self.eta, u=self.u, v=self.v)
+                if self.timer is not None:
+                    self.timer.lap("snapshot_io")
+                return
+            self.u_list.append(self.u.copy())
+            self.v_list.append(self.v.copy())
+            self.eta_list.append(self.eta.copy())
+
+    def snapshot_writer(self, path, chunk_frames=16):
+        """Create a snapshot_store.SnapshotWriter at path for the grid and
+        snapshot interval of this solver and stream the snapshots to it."""
+        from snapshot_store import SnapshotWriter
+        c = self.config
+        self.snapshots = SnapshotWriter(path, (c.N_x, c.N_y), dtype=self._dtype, chunk_frames=chunk_frames,
+            frame_interval=c.anim_interval*self.dt, x=self.x, y=self.y)
+        return self.snapshots
+
+    def save_samples(self):
+        """Save the Hovmuller and time series samples (hm_sample, ts_sample,
+        t_sample) with the snapshots, so that the store holds everything
+        render_snapshots.py draws."""
+        for name in ("hm_sample", "ts_sample", "t_sample"):
+            self.snapshots.save_array(name, np.array(getattr(self, name)))
+
+    def save_checkpoint(self, path=None):
+        """Write the full state of the solver to path (by default the
+        checkpoint_path of the configuration). The file is written next to
+        the target and then moved in place, so an interrupted write never
+        leaves a broken checkpoint behind."""
+        path = path if path is not None else self.config.checkpoint_path
+        state = dict(
+            config=json.dumps(asdict(self.config)), param_string=self.config.param_string(),
+            time_step=self.time_step, dt=self.dt, t=self._t_elapsed, n_snapshots=self.n_snapshots,
+            u=self.u, v=self.v, eta=self.eta,
+            hm_sample=np.array(self.hm_sample), ts_sample=np.array(self.ts_sample),
+            t_sample=np.array(self.t_sample))
+        if self.snapshots is not None:
+            self.snapshots.flush()
+            state.update(snapshot_path=self.snapshots.path, snapshot_frames=self.snapshots.n_frames,
+                         snapshot_chunk_frames=self.snapshots.chunk_frames)
+        else:
+            state.update(eta_list=np.array(self.eta_list).reshape(-1, *self.eta.shape),
+                         u_list=np.array(self.u_list).reshape(-1, *self.u.shape),
+                         v_list=np.array(self.v_list).reshape(-1, *self.v.shape))
+        with open(path + ".tmp", "wb") as checkpoint_file:
+            np.savez(checkpoint_file, **state)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def from_checkpoint(cls, path, **config_changes):
+        """Create a solver from a checkpoint written by save_checkpoint(). If
+        the run streamed its snapshots to a store, the store is reopened and
+        the frames written after the checkpoint are dropped. config_changes
+        override settings that do not affect the results, e.g. the backend
+        or the checkpoint interval; names that are not ShallowWaterConfig
+        fields raise a TypeError."""
+        with np.load(path) as checkpoint:
+            config = replace(ShallowWaterConfig(**json.loads(str(checkpoint["config"]))), **config_changes)
+            solver = cls(config, eta_0=checkpoint["eta"])
+            solver.dt = float(checkpoint["dt"])
+            solver._update_coefficients()
+            solver.time_step = int(checkpoint["time_step"])
+            solver._t_elapsed = float(checkpoint["t"])
+            solver.n_snapshots = int(checkpoint["n_snapshots"])
+            solver.u_n[:, :] = checkpoint["u"]
+            solver.v_n[:, :] = checkpoint["v"]
+            solver.hm_sample = list(checkpoint["hm_sample"])
+            solver.ts_sample = list(checkpoint["ts_sample"])
+            solver.t_sample = list(checkpoint["t_sample"])
+            if "snapshot_path" in checkpoint:
+                from snapshot_store import SnapshotWriter
+                solver.snapshots = SnapshotWriter.reopen(
+                    str(checkpoint["snapshot_path"]), int(checkpoint["snapshot_frames"]),
+                    chunk_frames=int(checkpoint["snapshot_chunk_frames"]))
+            else:
+                solver.eta_list = list(checkpoint["eta_list"])
+                solver.u_list = list(checkpoint["u_list"])
+                solver.v_list = list(checkpoint["v_list"])
+        return solver
+
+    def run(self, n_steps=None):
+        """Advance the model n_steps time steps, or to the end of the run
+        (see finished) when n_steps is not given. With adaptive time steps
+        the run also stops at end_time. Returns the solver itself."""
+        if n_steps is None:
+            while not self.finished:
+                self.step()
+            return self
+        for _ in range(n_steps):
+            if self.config.adaptive_dt and self.finished:
+                break
+            self.step()
+        return self
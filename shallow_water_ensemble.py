@@ -0,0 +1,188 @@
+"""Ensemble mode of the shallow water solver for parameter sweeps.
+
+The members of an ensemble share the grid and the set of enabled model terms,
+but may differ in depth, coriolis and friction parameters and in the initial
+Gaussian bump. Their states are stacked along a leading axis, (M, N_x, N_y),
+and the per-member parameters are stored with shapes that broadcast against
+that stack, so every stencil operation of the numpy backend updates all
+members at once. Each member gets the time step of its own CFL condition, and
+its results are identical to a separate ShallowWaterSolver run with the same
+parameters."""
+
+from dataclasses import replace
+import numpy as np
+from phase_timer import PhaseTimer
+from shallow_water import ShallowWaterConfig, ShallowWaterSolver, gaussian_bump
+
+# Parameters that may differ between members of an ensemble.
+MEMBER_PARAMETERS = ("H", "f_0", "beta", "kappa_0", "tau_0", "rho_0",
+                     "bump_amplitude", "bump_x", "bump_y", "bump_width")
+
+
+class ShallowWaterEnsemble(ShallowWaterSolver):
+    """Steps M members of the shallow water model as one stacked array. members
+    is a list of dicts overriding MEMBER_PARAMETERS of the shared config, e.g.
+    [dict(H=50), dict(H=100), dict(H=100, f_0=5E-5)]. The current state u, v,
+    eta has shape (M, N_x, N_y); hm_sample, ts_sample and t_sample hold one
+    array per sample with a leading member axis, and member(m) collects the
+    outputs of a single member. Ensembles run on the numpy backend, without
+    adaptive time steps or checkpoints; config settings asking for those
+    raise a ValueError, and save_checkpoint() and from_checkpoint() a
+    TypeError."""
+
+    def __init__(self, config=None, members=(dict(),), snapshots=None):
+        self.config = config = config if config is not None else ShallowWaterConfig()
+        if config.adaptive_dt:
+            raise ValueError("Adaptive time steps are not supported for ensembles")
+        if config.checkpoint_interval:
+            raise ValueError("Checkpoints are not supported for ensembles, set checkpoint_interval to 0")
+        if config.backend != "numpy":
+            raise ValueError("Ensembles run on the numpy backend only, not '{}'".format(config.backend))
+        for overrides in members:
+            unknown = set(overrides) - set(MEMBER_PARAMETERS)
+            if unknown:
+                raise ValueError("Parameters {} cannot vary between members".format(sorted(unknown)))
+        self.member_configs = [replace(config, **overrides) for overrides in members]
+        M, N_x, N_y = len(self.member_configs), config.N_x, config.N_y
+        shape = (M, N_x, N_y)
+
+        def per_member(values):
+            """Stack one value (or 1D array along y) per member for broadcasting."""
+            return np.array(values, dtype=float).reshape(M, 1, -1)
+
+        self.dt = per_member([mc.dt for mc in self.member_configs])
+        self.H = per_member([mc.H for mc in self.member_configs])
+        self.time_step = 0
+        self.n_snapshots = 0
+        self.timer = PhaseTimer() if config.profile else None
+        self.backend = "numpy"
+        self._step_kernel = self._step_numpy
+
+        self.x = np.linspace(-config.L_x/2, config.L_x/2, N_x)  # Array with x-points
+        self.y = np.linspace(-config.L_y/2, config.L_y/2, N_y)  # Array with y-points
+        X, Y = np.meshgrid(self.x, self.y)
+        self.X = np.transpose(X)        # To get plots right
+        self.Y = np.transpose(Y)        # To get plots right
+
+        self._dtype = dtype = np.dtype(config.dtype)
+        self.u_n, self.u_np1 = np.zeros(shape, dtype=dtype), np.zeros(shape, dtype=dtype)
+        self.v_n, self.v_np1 = np.zeros(shape, dtype=dtype), np.zeros(shape, dtype=dtype)
+        self.eta_n, self.eta_np1 = np.zeros(shape, dtype=dtype), np.zeros(shape, dtype=dtype)
+        self.h_e, self.h_n = np.zeros(shape, dtype=dtype), np.zeros(shape, dtype=dtype)
+        self.uhwe, self.vhns = np.zeros(shape, dtype=dtype), np.zeros(shape, dtype=dtype)
+        self._tmp = np.zeros(shape, dtype=dtype)
+        self._upwind = np.zeros(shape, dtype=bool)
+        for m, member_config in enumerate(self.member_configs):
+            self.eta_n[m] = gaussian_bump(member_config, self.X, self.Y)
+
+        self._setup_forcing(per_member)
+        self._update_coefficients()
+
+        self.hm_sample = [self.eta_n[:, :, N_y//2].copy()]
+        self.ts_sample = [self.eta_n[:, N_x//2, N_y//2].copy()]
+        self.t_sample = [self.t]
+        self.eta_list = list(); self.u_list = list(); self.v_list = list()
+        self.snapshots = snapshots
+
+    def _setup_forcing(self, per_member):
+        """Per-member versions of the forcing fields of ShallowWaterSolver."""
+        c, mcs = self.config, self.member_configs
+        if c.use_friction:
+            self.kappa = per_member([mc.kappa_0 for mc in mcs])
+        if c.use_wind:
+            self.tau_x = per_member([-mc.tau_0*np.cos(np.pi*self.y/c.L_y)*0 for mc in mcs])
+            self.tau_y = np.zeros((len(mcs), 1, c.N_y))
+            self._rho_0 = per_member([mc.rho_0 for mc in mcs])
+        if c.use_coriolis:
+            self.f = per_member([mc.f_0 + mc.beta*self.y if c.use_beta else mc.f_0*np.ones(c.N_y) for mc in mcs])
+        if c.use_source or c.use_sink:
+            self.sigma = 0.0001*np.exp(-((self.X-c.L_x/2)**2/(2*(1E+5)**2) + (self.Y-c.L_y/2)**2/(2*(1E+5)**2)))
+        if c.use_sink:
+            self.w = np.ones((c.N_x, c.N_y))*self.sigma.sum()/(c.N_x*c.N_y)
+
+    def _update_coefficients(self):
+        c, dt = self.config, self.dt
+        self._dt = self._typed(dt)
+        self._H = self._typed(self.H)
+        self._g_dt_dx = self._typed(c.g*dt/c.dx)
+        self._g_dt_dy = self._typed(c.g*dt/c.dy)
+        if c.use_coriolis:
+            alpha = dt*self.f
+            beta_c = alpha**2/4
+            self.alpha, self.beta_c = self._typed(alpha), self._typed(beta_c)
+            self._one_beta_c = self._typed(1 + beta_c)
+        if c.use_friction:
+            self._dt_kappa = self._typed(dt*self.kappa)
+        if c.use_wind:
+            self._dt_tau_x = self._typed(dt*self.tau_x/(self._rho_0*self.H))
+            self._dt_tau_y = self._typed(dt*self.tau_y/(self._rho_0*self.H))
+        if c.use_source:
+            self._dt_sigma = self._typed(dt*self.sigma)
+        if c.use_sink:
+            self._dt_w = self._typed(dt*self.w)
+
+    @property
+    def n_members(self):
+        return len(self.member_configs)
+
+    @property
+    def t(self):
+        """Physical time of every member [s]."""
+        return self.time_step*self.dt.ravel()
+
+    def mass(self):
+        """Total mass anomaly sum(eta) of every member."""
+        if self.config.mass_float64:
+            return np.sum(self.eta_n, axis=(1, 2), dtype=np.float64)
+        return np.sum(self.eta_n, axis=(1, 2))
+
+    def _sample(self):
+        c = self.config
+        if self.time_step % c.sample_interval == 0:
+            self.hm_sample.append(self.eta[:, :, c.N_y//2].copy())
+            self.ts_sample.append(self.eta[:, c.N_x//2, c.N_y//2].copy())
+            self.t_sample.append(self.t)
+
+        if self.time_step % c.anim_interval == 0:
+            self.n_snapshots += 1
+            if self.snapshots is not None:
+                if self.timer is not None:
+                    self.timer.lap("sampling")
+                self.snapshots.append(self.time_step, eta=self.eta, u=self.u, v=self.v)
+                if self.timer is not None:
+                    self.timer.lap("snapshot_io")
+                return
+            self.u_list.append(self.u.copy())
+            self.v_list.append(self.v.copy())
+            self.eta_list.append(self.eta.copy())
+
+    def snapshot_writer(self, path, chunk_frames=16):
+        """Stream snapshots of shape (M, N_x, N_y) to a store at path. The
+        store records the time step of every frame, since the physical time
+        differs between members."""
+        from snapshot_store import SnapshotWriter
+        c = self.config
+        self.snapshots = SnapshotWriter(path, self.eta.shape, dtype=self._dtype, chunk_frames=chunk_frames,
+            frame_interval=c.anim_interval, x=self.x, y=self.y)
+        return self.snapshots
+
+    def save_samples(self):
+        """Save hm_sample, ts_sample and t_sample with the snapshots, with
+        the members along their second axis."""
+        for name in ("hm_sample", "ts_sample", "t_sample"):
+            self.snapshots.save_array(name, np.array(getattr(self, name)))
+
+    def member(self, m):
+        """Outputs of member m: the parameters it was run with, its current
+        state and its Hovmuller and time series samples."""
+        return dict(config=self.member_configs[m], u=self.u[m], v=self.v[m], eta=self.eta[m],
+                    hm_sample=[sample[m] for sample in self.hm_sample],
+                    ts_sample=[sample[m] for sample in self.ts_sample],
+                    t_sample=[sample[m] for sample in self.t_sample])
+
+    def save_checkpoint(self, path=None):
+        raise TypeError("Checkpoints are not supported for ensembles")
+
+    @classmethod
+    def from_checkpoint(cls, path, **config_changes):
+        raise TypeError("Checkpoints are not supported for ensembles")
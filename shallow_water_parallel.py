@@ -0,0 +1,281 @@
+"""Domain-decomposed parallel version of the shallow water solver.
+
+The N_x x N_y grid is split into strips of whole rows (x-index ranges, which
+are contiguous in memory) and every strip is advanced by its own worker
+process. The state arrays u, v and eta at the current and next time step live
+in one shared memory block, so the one-cell halo a worker needs from its
+neighbours (eta in the row after its strip for the momentum equations, u and
+the upwind depth in the row before its strip for the continuity equation) is
+read directly from the neighbouring strip. Two barriers per step separate the
+phases:
+
+    momentum + coriolis (u, v at n+1)  ->  barrier  ->  continuity (eta at n+1)  ->  barrier
+
+Each worker performs exactly the operations of the numpy backend of
+ShallowWaterSolver on its rows, so the decomposed result is identical to the
+serial one."""
+
+import multiprocessing
+import os
+import traceback
+import weakref
+from multiprocessing import shared_memory
+import numpy as np
+from shallow_water import ShallowWaterConfig, ShallowWaterSolver
+
+
+def _momentum(k, cur, nxt, i0, i1):
+    """u and v at the next time step for rows i0:i1 (ShallowWaterSolver._step_numpy)."""
+    u_n, v_n, eta_n = cur
+    u_np1, v_np1, _ = nxt
+    N_x = u_n.shape[0]
+    tmp = k["tmp"]
+    iu = min(i1, N_x - 1)       # Rows with a u-point inside the domain
+    n, m = iu - i0, i1 - i0
+
+    np.subtract(eta_n[i0 + 1:iu + 1, :], eta_n[i0:iu, :], out=tmp[:n, :])
+    np.multiply(tmp[:n, :], k["g_dt_dx"], out=tmp[:n, :])
+    np.subtract(u_n[i0:iu, :], tmp[:n, :], out=u_np1[i0:iu, :])
+    np.subtract(eta_n[i0:i1, 1:], eta_n[i0:i1, :-1], out=tmp[:m, :-1])
+    np.multiply(tmp[:m, :-1], k["g_dt_dy"], out=tmp[:m, :-1])
+    np.subtract(v_n[i0:i1, :-1], tmp[:m, :-1], out=v_np1[i0:i1, :-1])
+
+    if "dt_kappa" in k:
+        np.multiply(k["dt_kappa"], u_n[i0:iu, :], out=tmp[:n, :])
+        np.subtract(u_np1[i0:iu, :], tmp[:n, :], out=u_np1[i0:iu, :])
+        np.multiply(k["dt_kappa"], v_n[i0:iu, :], out=tmp[:n, :])
+        np.subtract(v_np1[i0:iu, :], tmp[:n, :], out=v_np1[i0:iu, :])
+
+    if "dt_tau_x" in k:
+        np.add(u_np1[i0:iu, :], k["dt_tau_x"], out=u_np1[i0:iu, :])
+        np.add(v_np1[i0:iu, :], k["dt_tau_y"], out=v_np1[i0:iu, :])
+
+    if "alpha" in k:
+        alpha, beta_c, one_beta_c = k["alpha"], k["beta_c"], k["one_beta_c"]
+        np.multiply(beta_c, u_n[i0:i1, :], out=tmp[:m, :])
+        np.subtract(u_np1[i0:i1, :], tmp[:m, :], out=u_np1[i0:i1, :])
+        np.multiply(alpha, v_n[i0:i1, :], out=tmp[:m, :])
+        np.add(u_np1[i0:i1, :], tmp[:m, :], out=u_np1[i0:i1, :])
+        np.divide(u_np1[i0:i1, :], one_beta_c, out=u_np1[i0:i1, :])
+        np.multiply(beta_c, v_n[i0:i1, :], out=tmp[:m, :])
+        np.subtract(v_np1[i0:i1, :], tmp[:m, :], out=v_np1[i0:i1, :])
+        np.multiply(alpha, u_n[i0:i1, :], out=tmp[:m, :])
+        np.subtract(v_np1[i0:i1, :], tmp[:m, :], out=v_np1[i0:i1, :])
+        np.divide(v_np1[i0:i1, :], one_beta_c, out=v_np1[i0:i1, :])
+
+    v_np1[i0:i1, -1] = 0.0      # Northern boundary condition
+    if i1 == N_x:
+        u_np1[-1, :] = 0.0      # Eastern boundary condition
+
+
+def _continuity(k, cur, nxt, i0, i1):
+    """eta at the next time step for rows i0:i1 (ShallowWaterSolver._step_numpy).
+    The eastern flux of row i0 - 1 is recomputed from the halo row."""
+    _, _, eta_n = cur
+    u_np1, v_np1, eta_np1 = nxt
+    N_x = eta_n.shape[0]
+    tmp, upwind, h_e, h_n, uhwe, vhns = k["tmp"], k["upwind"], k["h_e"], k["h_n"], k["uhwe"], k["vhns"]
+    r0, r1 = max(i0 - 1, 0), min(i1 + 1, N_x)
+    ie = min(i1, N_x - 1)       # Rows with an upwind choice at the eastern face
+    n, m = ie - r0, i1 - i0
+
+    eta_H = tmp[:r1 - r0, :]    # eta + H for rows r0:r1
+    np.add(eta_n[r0:r1, :], k["H"], out=eta_H)
+    h_e = h_e[:i1 - r0, :]      # Upwind depth and flux for rows r0:i1
+    np.copyto(h_e[:n, :], eta_H[1:n + 1, :])
+    np.greater(u_np1[r0:ie, :], 0, out=upwind[:n, :])
+    np.copyto(h_e[:n, :], eta_H[:n, :], where=upwind[:n, :])
+    if i1 == N_x:
+        h_e[-1, :] = eta_H[-1, :]
+    np.multiply(u_np1[r0:i1, :], h_e, out=h_e)
+    if i0 == 0:
+        uhwe[0, :] = h_e[0, :]
+        np.subtract(h_e[1:, :], h_e[:-1, :], out=uhwe[1:m, :])
+    else:
+        np.subtract(h_e[1:, :], h_e[:-1, :], out=uhwe[:m, :])
+
+    eta_H = eta_H[i0 - r0:i0 - r0 + m, :]
+    np.copyto(h_n[:, :-1], eta_H[:, 1:])
+    np.greater(v_np1[i0:i1, :-1], 0, out=upwind[:m, :-1])
+    np.copyto(h_n[:, :-1], eta_H[:, :-1], where=upwind[:m, :-1])
+    h_n[:, -1] = eta_H[:, -1]
+    np.multiply(v_np1[i0:i1, :], h_n, out=h_n)
+    vhns[:, 0] = h_n[:, 0]
+    np.subtract(h_n[:, 1:], h_n[:, :-1], out=vhns[:, 1:])
+
+    uhwe = uhwe[:m, :]
+    np.divide(uhwe, k["dx"], out=uhwe)
+    np.divide(vhns, k["dy"], out=vhns)
+    np.add(uhwe, vhns, out=uhwe)
+    np.multiply(uhwe, k["dt"], out=uhwe)
+    np.subtract(eta_n[i0:i1, :], uhwe, out=eta_np1[i0:i1, :])
+    if "dt_sigma" in k:
+        np.add(eta_np1[i0:i1, :], k["dt_sigma"], out=eta_np1[i0:i1, :])
+    if "dt_w" in k:
+        np.subtract(eta_np1[i0:i1, :], k["dt_w"], out=eta_np1[i0:i1, :])
+
+
+def _worker(shm_name, shape, dtype, i0, i1, coefficients, barrier, commands, done):
+    """Worker process advancing rows i0:i1. Receives a number of steps on the
+    commands queue (None to quit) and reports back on the done queue."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        state = np.ndarray((6,) + shape, dtype=dtype, buffer=shm.buf)
+        cur, nxt = (state[0], state[1], state[2]), (state[3], state[4], state[5])
+        m, N_y = i1 - i0, shape[1]
+        k = dict(coefficients, tmp=np.zeros((m + 2, N_y), dtype=dtype),
+                 upwind=np.zeros((m + 2, N_y), dtype=bool),
+                 h_e=np.zeros((m + 1, N_y), dtype=dtype), h_n=np.zeros((m, N_y), dtype=dtype),
+                 uhwe=np.zeros((m, N_y), dtype=dtype), vhns=np.zeros((m, N_y), dtype=dtype))
+        while True:
+            n_steps = commands.get()
+            if n_steps is None:
+                break
+            try:
+                for _ in range(n_steps):
+                    _momentum(k, cur, nxt, i0, i1)
+                    barrier.wait()
+                    _continuity(k, cur, nxt, i0, i1)
+                    barrier.wait()
+                    cur, nxt = nxt, cur
+            except Exception:
+                barrier.abort()
+                done.put(traceback.format_exc())
+            else:
+                done.put(None)
+        del state, cur, nxt
+    finally:
+        shm.close()
+
+
+def _release(shm):
+    """Free the shared memory block, also if the solver was never closed."""
+    try:
+        shm.close()
+    except BufferError:
+        pass    # Arrays still refer to the block, it is unmapped when they go
+    shm.unlink()
+
+
+class ParallelShallowWaterSolver(ShallowWaterSolver):
+    """ShallowWaterSolver whose time steps are computed by n_workers processes,
+    each owning a strip of rows. Sampling, snapshots and checkpoints work as in
+    the serial solver; the workers are stopped with close() (or by using the
+    solver as a context manager), after which run() raises a RuntimeError."""
+
+    def __init__(self, config=None, eta_0=None, snapshots=None, n_workers=None):
+        config = config if config is not None else ShallowWaterConfig()
+        if config.adaptive_dt:
+            raise ValueError("Adaptive time steps are not supported by the parallel solver")
+        super().__init__(config, eta_0=eta_0, snapshots=snapshots)
+        self.n_workers = min(n_workers or os.cpu_count(), config.N_x)
+
+        # Move the state into shared memory. The serial scratch arrays are
+        # not needed, every worker has its own for its strip.
+        shape = (config.N_x, config.N_y)
+        self._shm = shared_memory.SharedMemory(create=True, size=6*int(np.prod(shape))*self._dtype.itemsize)
+        self._state = np.ndarray((6,) + shape, dtype=self._dtype, buffer=self._shm.buf)
+        self._state[:] = 0.0
+        for index, name in enumerate(("u_n", "v_n", "eta_n", "u_np1", "v_np1", "eta_np1")):
+            self._state[index] = getattr(self, name)
+            setattr(self, name, self._state[index])
+        for name in ("h_e", "h_w", "h_n", "h_s", "uhwe", "vhns", "_tmp", "_upwind", "_flux_x"):
+            self.__dict__.pop(name, None)
+        self.backend = "parallel"
+        self._shm_finalizer = weakref.finalize(self, _release, self._shm)
+        self._processes = None
+        self.closed = False
+
+    def _coefficients(self, i0, i1):
+        """Coefficients a worker needs for rows i0:i1."""
+        c = self.config
+        iu = min(i1, c.N_x - 1)
+        k = dict(H=self._H, dt=self._dt, dx=c.dx, dy=c.dy, g_dt_dx=self._g_dt_dx, g_dt_dy=self._g_dt_dy)
+        if c.use_friction:
+            k["dt_kappa"] = self._dt_kappa[i0:iu, :]
+        if c.use_wind:
+            k["dt_tau_x"], k["dt_tau_y"] = self._dt_tau_x, self._dt_tau_y
+        if c.use_coriolis:
+            k["alpha"], k["beta_c"], k["one_beta_c"] = self.alpha, self.beta_c, self._one_beta_c
+        if c.use_source:
+            k["dt_sigma"] = self._dt_sigma[i0:i1, :]
+        if c.use_sink:
+            k["dt_w"] = self._dt_w[i0:i1, :]
+        return k
+
+    def _start_workers(self):
+        """Start one worker per strip. The workers are started on the first
+        step, so that the coefficients include changes made after construction
+        (e.g. by from_checkpoint)."""
+        ctx = multiprocessing.get_context()
+        bounds = np.linspace(0, self.config.N_x, self.n_workers + 1).astype(int)
+        self._barrier = ctx.Barrier(self.n_workers)
+        self._done = ctx.Queue()
+        self._commands = [ctx.Queue() for _ in range(self.n_workers)]
+        self._processes = []
+        for commands, i0, i1 in zip(self._commands, bounds[:-1], bounds[1:]):
+            process = ctx.Process(target=_worker, daemon=True, args=(
+                self._shm.name, self.eta.shape, self._dtype, int(i0), int(i1), self._coefficients(i0, i1),
+                self._barrier, commands, self._done))
+            process.start()
+            self._processes.append(process)
+
+    def _advance(self, n_steps):
+        """Let the workers take n_steps steps and wait for them."""
+        if self._processes is None:
+            self._start_workers()
+        for commands in self._commands:
+            commands.put(n_steps)
+        errors = [self._done.get() for _ in self._processes]
+        errors = [error for error in errors if error is not None]
+        if errors:
+            raise RuntimeError("Parallel shallow water worker failed:\n" + errors[0])
+        if n_steps % 2 == 1:
+            self._swap()
+        self.time_step += n_steps
+
+    def step(self):
+        self.run(1)
+
+    def run(self, n_steps=None):
+        """Advance the model n_steps time steps. The workers run uninterrupted
+        up to the next step at which a sample, snapshot or checkpoint is due."""
+        if self.closed:
+            raise RuntimeError("The parallel solver is closed, its workers and shared memory are released")
+        c = self.config
+        if n_steps is None:
+            n_steps = c.max_time_step - self.time_step
+        end = self.time_step + n_steps
+        intervals = [c.sample_interval, c.anim_interval] + ([c.checkpoint_interval] if c.checkpoint_interval else [])
+        while self.time_step < end:
+            chunk = min([end - self.time_step] + [i - self.time_step % i for i in intervals])
+            if self.timer is not None:
+                self.timer.mark(chunk)
+            self._advance(chunk)
+            if self.timer is not None:
+                self.timer.lap("workers")   # All phases run inside the worker processes
+            self._after_step()
+        return self
+
+    def close(self):
+        """Stop the workers and release the shared memory. The final state is
+        copied out, so u, v and eta stay available."""
+        if self._processes is not None:
+            for commands in self._commands:
+                commands.put(None)
+            for process in self._processes:
+                process.join()
+            self._processes = None
+        if self._shm is not None:
+            self.u_n, self.v_n, self.eta_n = self.u_n.copy(), self.v_n.copy(), self.eta_n.copy()
+            self.u_np1, self.v_np1, self.eta_np1 = self.u_np1.copy(), self.v_np1.copy(), self.eta_np1.copy()
+            del self._state
+            self._shm_finalizer()
+            self._shm = None
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,174 @@
+"""Append-only on-disk store for snapshots of 2D fields such as eta, u and v.
+
+A store is a directory with
+
+    meta.json       grid shape, dtype, field names and time between frames
+    x.npy, y.npy    grid coordinates (optional)
+    <name>.npy      other arrays saved with save_array(), e.g. the Hovmuller samples
+    times.bin       physical time of every frame (raw float64)
+    <field>.bin     raw C-ordered frames of each field, one after another
+
+Frames are collected in a small in-memory chunk and appended to the .bin files
+when the chunk is full, so memory use does not grow with the length of a run.
+The number of frames is derived from the file sizes, which means a store left
+behind by a crashed run can still be read up to the last complete frame.
+SnapshotReader maps the files with np.memmap, and the per-field arrays it
+returns can be handed to the viz_tools1 animation functions in place of lists;
+only the frames that are drawn are read from disk."""
+
+import json
+import os
+import numpy as np
+
+
+class SnapshotWriter:
+    """Stream frames of one or more fields to a store directory. Use as a
+    context manager or call close() when done so the last chunk is written.
+    With n_frames given, an existing store is reopened for appending after
+    its first n_frames frames; anything written after those is discarded."""
+
+    def __init__(self, path, shape, fields=("eta", "u", "v"), dtype=np.float64,
+                 chunk_frames=16, frame_interval=None, x=None, y=None, n_frames=None):
+        self.path = path
+        self.shape = tuple(shape)
+        self.fields = tuple(fields)
+        self.dtype = np.dtype(dtype)
+        self.chunk_frames = chunk_frames
+        self._chunks = {name: np.empty((chunk_frames,) + self.shape, dtype=self.dtype) for name in self.fields}
+        self._times = np.empty(chunk_frames)
+        self._n_buffered = 0
+
+        if n_frames is not None:
+            self._reopen(n_frames)
+            return
+
+        os.makedirs(path, exist_ok=True)
+        meta = {"shape": list(self.shape), "dtype": self.dtype.str, "fields": list(self.fields),
+                "frame_interval": frame_interval}
+        with open(os.path.join(path, "meta.json"), "w") as meta_file:
+            json.dump(meta, meta_file, indent=1)
+        if x is not None:
+            np.save(os.path.join(path, "x.npy"), x)
+        if y is not None:
+            np.save(os.path.join(path, "y.npy"), y)
+
+        self._files = {name: open(os.path.join(path, name + ".bin"), "wb") for name in self.fields}
+        self._times_file = open(os.path.join(path, "times.bin"), "wb")
+        self.n_frames = 0
+
+    @classmethod
+    def reopen(cls, path, n_frames, chunk_frames=16):
+        """Reopen the store at path for appending after its first n_frames
+        frames, e.g. when resuming a run from a checkpoint."""
+        with open(os.path.join(path, "meta.json")) as meta_file:
+            meta = json.load(meta_file)
+        return cls(path, meta["shape"], fields=meta["fields"], dtype=meta["dtype"],
+                   chunk_frames=chunk_frames, n_frames=n_frames)
+
+    def _reopen(self, n_frames):
+        """Truncate the store to n_frames frames and open it for appending."""
+        frame_bytes = self.dtype.itemsize*int(np.prod(self.shape))
+        sizes = {name + ".bin": n_frames*frame_bytes for name in self.fields}
+        sizes["times.bin"] = n_frames*8
+        files = {}
+        for name, size in sizes.items():
+            f = open(os.path.join(self.path, name), "r+b")
+            if os.fstat(f.fileno()).st_size < size:
+                f.close()
+                raise ValueError("{} holds fewer than {} frames".format(name, n_frames))
+            f.truncate(size)
+            f.seek(size)
+            files[name] = f
+        self._times_file = files.pop("times.bin")
+        self._files = {name: files[name + ".bin"] for name in self.fields}
+        self.n_frames = n_frames
+
+    def append(self, t, **frames):
+        """Append one frame of every field, taken at physical time t. The
+        arrays are copied, so the caller may keep overwriting them."""
+        k = self._n_buffered
+        for name in self.fields:
+            self._chunks[name][k] = frames[name]
+        self._times[k] = t
+        self._n_buffered += 1
+        self.n_frames += 1
+        if self._n_buffered == self.chunk_frames:
+            self.flush()
+
+    def save_array(self, name, array):
+        """Save an array that is not a sequence of frames (e.g. time series
+        samples) with the store as <name>.npy, replacing an earlier one."""
+        np.save(os.path.join(self.path, name + ".npy"), array)
+
+    def flush(self):
+        """Write the buffered frames to disk."""
+        k = self._n_buffered
+        for name in self.fields:
+            self._chunks[name][:k].tofile(self._files[name])
+            self._files[name].flush()
+        self._times[:k].tofile(self._times_file)
+        self._times_file.flush()
+        self._n_buffered = 0
+
+    def close(self):
+        self.flush()
+        for f in self._files.values():
+            f.close()
+        self._times_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SnapshotReader:
+    """Read-only view of a store written by SnapshotWriter. reader["eta"] is a
+    memory-mapped array of shape (n_frames, N_x, N_y) that supports len() and
+    frame indexing like the lists it replaces."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as meta_file:
+            meta = json.load(meta_file)
+        self.shape = tuple(meta["shape"])
+        self.dtype = np.dtype(meta["dtype"])
+        self.fields = tuple(meta["fields"])
+        self.frame_interval = meta["frame_interval"]
+
+        # Only complete frames of every field (and their times) are exposed.
+        frame_bytes = self.dtype.itemsize*int(np.prod(self.shape))
+        sizes = [os.path.getsize(os.path.join(path, name + ".bin"))//frame_bytes for name in self.fields]
+        sizes.append(os.path.getsize(os.path.join(path, "times.bin"))//8)
+        self.n_frames = min(sizes)
+
+    def __len__(self):
+        return self.n_frames
+
+    def __getitem__(self, field):
+        if field not in self.fields:
+            raise KeyError(field)
+        if self.n_frames == 0:
+            return np.empty((0,) + self.shape, dtype=self.dtype)
+        return np.memmap(os.path.join(self.path, field + ".bin"), dtype=self.dtype, mode="r",
+                         shape=(self.n_frames,) + self.shape)
+
+    @property
+    def times(self):
+        return np.fromfile(os.path.join(self.path, "times.bin"), count=self.n_frames)
+
+    def array(self, name):
+        """Memory-mapped array saved with SnapshotWriter.save_array()."""
+        return np.load(os.path.join(self.path, name + ".npy"), mmap_mode="r")
+
+    def has_array(self, name):
+        return os.path.exists(os.path.join(self.path, name + ".npy"))
+
+    @property
+    def x(self):
+        return np.load(os.path.join(self.path, "x.npy"))
+
+    @property
+    def y(self):
+        return np.load(os.path.join(self.path, "y.npy"))
@@ -1,105 +1,186 @@
 
 """File with several visualization functions intended to use
-with results from 2D shallow water model swe2D.py"""
+with results from 2D shallow water model swe2D.py
 
+The animation functions draw their frames one by one in this process. For
+long runs frame_renderer.py renders the same figures with a pool of worker
+processes and streams them to ffmpeg.
+
+The frames of the animations (eta_list, u_list, v_list) can come from any
+frame source (see frame_source): a list of arrays, a memory-mapped stack such
+as np.load("eta.npy", mmap_mode="r") or a SnapshotReader field, a generator,
+or a function returning a new iterator of frames. Only the frame being drawn
+is read, so a run does not have to fit in memory to be animated.
+
+The quiver and surface plots average the fields over blocks of cells down to
+a target resolution (see level_of_detail.py) before drawing them, so their
+cost does not grow with the size of the grid.
+
+matplotlib is imported when a function first draws something, so importing
+this module (e.g. from a compute job) costs no more than importing numpy;
+bench_import.py guards this."""
+
+import importlib
+import itertools
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib import animation
-from mpl_toolkits.mplot3d import Axes3D
 import fourier_transform as ft
+from level_of_detail import LevelOfDetail
+
+
+class _LazyModule:
+    """Stand-in for a module that is imported on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
+
+plt = _LazyModule("matplotlib.pyplot")     # pyplot also registers the 3d projection
+animation = _LazyModule("matplotlib.animation")
 
 #plt.style.use("seaborn")
 
-def eta_animation(X, Y, eta_list, frame_interval, filename):
+def frame_source(*sources):
+    """Lazy, synchronised view of one or more frame sources for FuncAnimation.
+    Every source is either a sequence of 2D arrays with len() and indexing,
+    an iterable of 2D arrays, or a function returning a new iterator of 2D
+    arrays each time it is called. Returns the first frame of every source
+    (as a tuple), a function returning an iterator of (num, frames) pairs,
+    and the number of frames (None if it is not known in advance).
+
+    A plain iterable (e.g. a generator) can only be read once, so an
+    animation made from it can be saved but not replayed afterwards; pass a
+    function to read it again."""
+    if all(hasattr(s, "__len__") and hasattr(s, "__getitem__") for s in sources):
+        n_frames = min(len(s) for s in sources)
+        first = tuple(s[0] for s in sources)
+        return first, lambda: ((num, tuple(s[num] for s in sources)) for num in range(n_frames)), n_frames
+    if all(callable(s) for s in sources):
+        first = next(zip(*(s() for s in sources)))
+        return first, lambda: enumerate(zip(*(s() for s in sources))), None
+    iterator = zip(*(iter(s) for s in sources))
+    first = next(iterator)
+    frames = enumerate(itertools.chain([first], iterator))
+    return first, lambda: frames, None
+
+def _animate(fig, update, frames, n_frames, artists):
+    """FuncAnimation over the (num, frames) pairs of frame_source. The first
+    frame is drawn when the figure is set up, and frame data is not cached,
+    so frames are only held in memory while they are drawn."""
+    return animation.FuncAnimation(fig, update, frames = frames, init_func = lambda: artists,
+        save_count = n_frames, cache_frame_data = False, interval = 10, blit = False)
+
+def eta_animation(X, Y, eta_list, frame_interval, filename, vmin = None, vmax = None):
     """Function that takes in the domain x, y (2D meshgrids) and a list of 2D arrays
     eta_list and creates an animation of all eta images. To get updating title one
     also need specify time step dt between each frame in the simulation, the number
-    of time steps between each eta in eta_list and finally, a filename for video."""
+    of time steps between each eta in eta_list and finally, a filename for video.
+    eta_list can be any frame source (see frame_source). The color range is
+    taken from the middle frame, or from the first frame when the number of
+    frames is not known, for each of vmin and vmax that is not given."""
+    (eta_0,), frames, n_frames = frame_source(eta_list)
+    if vmin is None or vmax is None:
+        eta_range = np.abs(eta_list[n_frames//2] if n_frames else eta_0).max()
+        vmin = -0.7*eta_range if vmin is None else vmin
+        vmax = eta_range if vmax is None else vmax
     fig, ax = plt.subplots(1, 1)
     plt.xlabel("x [m]", fontname = "serif", fontsize = 12)
     plt.ylabel("y [m]", fontname = "serif", fontsize = 12)
-    pmesh = plt.pcolormesh(X, Y, eta_list[0], vmin = -0.7*np.abs(eta_list[int(len(eta_list)/2)]).max(),
-        vmax = np.abs(eta_list[int(len(eta_list)/2)]).max(), cmap = plt.cm.RdBu_r)
+    pmesh = plt.pcolormesh(X, Y, eta_0, vmin = vmin, vmax = vmax, cmap = plt.cm.RdBu_r)
     plt.colorbar(pmesh, orientation = "vertical")
 
     # Update function for pcolormesh animation.
-    def update_eta(num):
+    def update_eta(frame):
+        num, (eta,) = frame
         ax.set_title("Surface elevation $\eta$ after t = {:.2f} hours".format(
             num*frame_interval/3600), fontname = "serif", fontsize = 16)
-        pmesh.set_array(eta_list[num].flatten())
+        pmesh.set_array(np.ravel(eta))
         return pmesh,
 
-    anim = animation.FuncAnimation(fig, update_eta,
-        frames = len(eta_list), interval = 10, blit = False)
+    anim = _animate(fig, update_eta, frames, n_frames, (pmesh,))
     mpeg_writer = animation.FFMpegWriter(fps = 24, bitrate = 10000,
         codec = "libx264", extra_args = ["-pix_fmt", "yuv420p"])
     anim.save("{}.mp4".format(filename), writer = mpeg_writer)
     return anim    # Need to return anim object to see the animation
 
-def velocity_animation(X, Y, u_list, v_list, frame_interval, filename):
+def velocity_animation(X, Y, u_list, v_list, frame_interval, filename, resolution = 50):
     """Function that takes in the domain x, y (2D meshgrids) and a lists of 2D arrays
     u_list, v_list and creates an quiver animation of the velocity field (u, v). To get
     updating title one also need specify time step dt between each frame in the simulation,
-    the number of time steps between each eta in eta_list and finally, a filename for video."""
+    the number of time steps between each eta in eta_list and finally, a filename for video.
+    As in eta_animation, u_list and v_list can be any frame sources. The velocity
+    is averaged over blocks to at most resolution arrows along each axis (None
+    draws one arrow per grid point)."""
+    (u_0, v_0), frames, n_frames = frame_source(u_list, v_list)
+    lod = LevelOfDetail(X.shape, resolution)
     fig, ax = plt.subplots(figsize = (8, 8), facecolor = "white")
     plt.title("Velocity field $\mathbf{u}(x,y)$ after 0.0 days", fontname = "serif", fontsize = 19)
     plt.xlabel("x [km]", fontname = "serif", fontsize = 16)
     plt.ylabel("y [km]", fontname = "serif", fontsize = 16)
-    q_int = 3
-    Q = ax.quiver(X[::q_int, ::q_int]/1000.0, Y[::q_int, ::q_int]/1000.0, u_list[0][::q_int,::q_int], v_list[0][::q_int,::q_int],
+    Q = ax.quiver(lod(X)/1000.0, lod(Y)/1000.0, lod(u_0), lod(v_0),
         scale=0.2, scale_units='inches')
     #qk = plt.quiverkey(Q, 0.9, 0.9, 0.001, "0.1 m/s", labelpos = "E", coordinates = "figure")
 
     # Update function for quiver animation.
-    def update_quiver(num):
-        u = u_list[num]
-        v = v_list[num]
+    def update_quiver(frame):
+        num, (u, v) = frame
         ax.set_title("Velocity field $\mathbf{{u}}(x,y,t)$ after t = {:.2f} hours".format(
             num*frame_interval/3600), fontname = "serif", fontsize = 19)
-        Q.set_UVC(u[::q_int, ::q_int], v[::q_int, ::q_int])
+        Q.set_UVC(lod(u), lod(v))
         return Q,
 
-    anim = animation.FuncAnimation(fig, update_quiver,
-        frames = len(u_list), interval = 10, blit = False)
+    anim = _animate(fig, update_quiver, frames, n_frames, (Q,))
     mpeg_writer = animation.FFMpegWriter(fps = 24, bitrate = 10000,
         codec = "libx264", extra_args = ["-pix_fmt", "yuv420p"])
     fig.tight_layout()
     anim.save("{}.mp4".format(filename), writer = mpeg_writer)
     return anim    # Need to return anim object to see the animation
 
-def eta_animation3D(X, Y, eta_list, frame_interval, filename):
+def eta_animation3D(X, Y, eta_list, frame_interval, filename, resolution = 50):
+    """3D surface animation of eta. The axes are set up once and only the
+    surface is replaced every frame (frame_renderer.render_eta3D renders the
+    same figure in parallel). eta_list can be any frame source. eta is averaged
+    over blocks to a surface of at most resolution facets along each axis
+    (None draws the full grid)."""
+    (eta_0,), frames, n_frames = frame_source(eta_list)
+    lod = LevelOfDetail(X.shape, resolution)
+    X_lod, Y_lod = lod(X)/1000, lod(Y)/1000
     fig = plt.figure(figsize = (8, 8), facecolor = "white")
     ax = fig.add_subplot(111, projection='3d')
+    ax.set_xlabel("x [km]", fontname = "serif", fontsize = 14)
+    ax.set_ylabel("y [km]", fontname = "serif", fontsize = 14)
+    ax.set_zlabel("$\eta$ [m]", fontname = "serif", fontsize = 16)
+    ax.set_xlim(X.min()/1000, X.max()/1000)
+    ax.set_ylim(Y.min()/1000, Y.max()/1000)
+    ax.set_zlim(-0.3, 0.7)
+    plt.tight_layout()
 
-    surf = ax.plot_surface(X, Y, eta_list[0], cmap = plt.cm.RdBu_r)
+    surf = [ax.plot_surface(X_lod, Y_lod, lod(eta_0), rstride = 1, cstride = 1, cmap = plt.cm.RdBu_r)]
 
-    def update_surf(num):
-        ax.clear()
-        surf = ax.plot_surface(X/1000, Y/1000, eta_list[num], cmap = plt.cm.RdBu_r)
+    def update_surf(frame):
+        num, (eta,) = frame
+        surf[0].remove()
+        surf[0] = ax.plot_surface(X_lod, Y_lod, lod(eta), rstride = 1, cstride = 1, cmap = plt.cm.RdBu_r)
         ax.set_title("Surface elevation $\eta(x,y,t)$ after $t={:.2f}$ hours".format(
             num*frame_interval/3600), fontname = "serif", fontsize = 19, y=1.04)
-        ax.set_xlabel("x [km]", fontname = "serif", fontsize = 14)
-        ax.set_ylabel("y [km]", fontname = "serif", fontsize = 14)
-        ax.set_zlabel("$\eta$ [m]", fontname = "serif", fontsize = 16)
-        ax.set_xlim(X.min()/1000, X.max()/1000)
-        ax.set_ylim(Y.min()/1000, Y.max()/1000)
-        ax.set_zlim(-0.3, 0.7)
-        plt.tight_layout()
-        return surf,
-
-    anim = animation.FuncAnimation(fig, update_surf,
-        frames = len(eta_list), interval = 10, blit = False)
+        return surf[0],
+
+    anim = _animate(fig, update_surf, frames, n_frames, (surf[0],))
     mpeg_writer = animation.FFMpegWriter(fps = 24, bitrate = 10000,
         codec = "libx264", extra_args = ["-pix_fmt", "yuv420p"])
     anim.save("{}.mp4".format(filename), writer = mpeg_writer)
     return anim    # Need to return anim object to see the animation
 
-def surface_plot3D(X, Y, eta, x_lim, y_lim, z_lim):
+def surface_plot3D(X, Y, eta, x_lim, y_lim, z_lim, resolution = 100):
     """Function that takes input 1D coordinate arrays x, y and 2D array
-    array psi. Then plots psi as a surface in 3D space on a meshgrid."""
+    array psi. Then plots psi as a surface in 3D space on a meshgrid,
+    averaged over blocks to at most resolution facets along each axis."""
+    lod = LevelOfDetail(X.shape, resolution)
     fig = plt.figure(figsize = (11, 7))
-    ax = Axes3D(fig)
-    surf = ax.plot_surface(X, Y, eta, rstride = 1, cstride = 1,
+    ax = fig.add_subplot(projection = "3d")
+    surf = ax.plot_surface(lod(X), lod(Y), lod(eta), rstride = 1, cstride = 1,
         cmap = plt.cm.jet, linewidth = 0, antialiased = True)
     ax.set_xlim(*x_lim)
     ax.set_ylim(*y_lim)
@@ -119,27 +200,28 @@ def pmesh_plot(X, Y, eta, plot_title):
     plt.xlabel("x [m]", fontname = "serif", fontsize = 12)
     plt.ylabel("y [s]", fontname = "serif", fontsize = 12)
 
-def quiver_plot(X, Y, U, V, plot_title):
-    """Function that makes a quiver plot of (U, V) at points (X, Y)."""
+def quiver_plot(X, Y, U, V, plot_title, resolution = 40):
+    """Function that makes a quiver plot of (U, V) at points (X, Y), with
+    (U, V) averaged over blocks to at most resolution arrows along each axis."""
+    lod = LevelOfDetail(X.shape, resolution)
     plt.figure()
     plt.title(plot_title, fontname = "serif", fontsize = 17)
     plt.xlabel("x [m]", fontname = "serif", fontsize = 12)
     plt.ylabel("y [m]", fontname = "serif", fontsize = 12)
-    Q = plt.quiver(X[::4, ::4], Y[::4, ::4], U[::4, ::4], V[::4, ::4],
+    Q = plt.quiver(lod(X), lod(Y), lod(U), lod(V),
         units = "xy", scale = 0.002, scale_units = "inches")
     qk = plt.quiverkey(Q, 0.9, 0.9, 0.001, "0.1 m/s",
         labelpos = "E", coordinates = "figure")
 
 def hovmuller_plot(x, t, eta):
     """Function that generates a Hovmuller diagram of
-    eta as a function of x and t at a choosen y-coordinate"""
-    X, T = np.meshgrid(x, np.array(t))
-    X = np.transpose(X)         # Transpose for plotting
-    T = np.transpose(T)         # Transpose for plotting
-    eta_hm = np.transpose(np.array(eta))  # Transpose for plotting
+    eta as a function of x and t at a choosen y-coordinate. eta holds one
+    row per time in t, as a list of 1D arrays or a (memory-mapped) 2D
+    array, which is plotted without copying."""
+    eta_hm = np.asarray(eta)
 
     plt.figure(figsize = (5, 8))
-    plt.pcolormesh(X, T, eta_hm, vmin = eta_hm.min(), vmax = eta_hm.max(), cmap = plt.cm.PiYG)
+    plt.pcolormesh(x, np.asarray(t), eta_hm, vmin = eta_hm.min(), vmax = eta_hm.max(), cmap = plt.cm.PiYG)
     plt.colorbar(orientation = "vertical")
     plt.title("x-t plot for middle of domain", fontname = "serif", fontsize = 17)
     plt.xlabel("x [m]", fontname = "serif", fontsize = 12)
@@ -148,8 +230,8 @@ def hovmuller_plot(x, t, eta):
 def plot_time_series_and_ft(t, signal):
     """Function that takes a signal and its corresponding time array.
     Then plots the time signal as well as its Fourier transform."""
-    t = np.array(t)
-    signal = np.array(signal)
+    t = np.asarray(t)
+    signal = np.asarray(signal)
 
     # Plotting the time series.
     plt.figure(figsize = (8, 7))